@@ -1,9 +1,75 @@
+import json
+
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
 from django.contrib.auth import get_user_model
 from django.contrib.auth.admin import UserAdmin
+from django.db import connections
+from django.db.models import Q
+
+from .routers import replica_reads
 
 User = get_user_model()
 
+AFTER_VAR = "after"
+
+
+def estimated_count(queryset):
+    """
+    Число строк по оценке планировщика PostgreSQL вместо COUNT(*) и
+    признак оценки. Небольшие выборки и другие базы считаются точно.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql":
+        return queryset.count(), False
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    estimate = int(plan[0]["Plan"]["Plan Rows"])
+    if estimate < settings.ADMIN_EXACT_COUNT_LIMIT:
+        return queryset.count(), False
+    return estimate, True
+
+
+class KeysetChangeList(ChangeList):
+    """
+    Список пользователей по возрастанию pk: следующая страница начинается
+    после последнего показанного id, без OFFSET и COUNT(*).
+    """
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(AFTER_VAR, None)
+        return lookup_params
+
+    def get_results(self, request):
+        try:
+            after = int(self.params.pop(AFTER_VAR, 0))
+        except ValueError:
+            raise IncorrectLookupParameters
+        rows = list(
+            self.queryset.filter(pk__gt=after)[: self.list_per_page + 1]
+        )
+        self.result_list = rows[: self.list_per_page]
+        self.next_url = None
+        if len(rows) > self.list_per_page:
+            last = self.result_list[-1].pk
+            self.next_url = self.get_query_string({AFTER_VAR: last})
+        self.first_url = self.get_query_string() if after else None
+        self.result_count, self.is_estimate = estimated_count(self.queryset)
+        self.full_result_count = None
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        # Номера страниц и "показать все" при keyset-пагинации не нужны.
+        self.can_show_all = False
+        self.multi_page = False
+        self.paginator = None
+
 
 @admin.register(User)
 class CustomUserAdmin(UserAdmin):
@@ -11,6 +77,7 @@ class CustomUserAdmin(UserAdmin):
     ordering = ["email"]
     list_display = [
         "email",
+        "tenant",
         "username",
         "is_active",
         "is_staff",
@@ -18,7 +85,7 @@ class CustomUserAdmin(UserAdmin):
     ]
     list_filter = ["is_staff", "is_superuser", "is_active"]
     fieldsets = (
-        (None, {"fields": ("email", "password")}),
+        (None, {"fields": ("tenant", "email", "password")}),
         (("Personal Info"), {"fields": ("username",)}),
         (
             ("Permissions"),
@@ -32,6 +99,7 @@ class CustomUserAdmin(UserAdmin):
             {
                 "classes": ("wide",),
                 "fields": (
+                    "tenant",
                     "email",
                     "username",
                     "password1",
@@ -43,3 +111,50 @@ class CustomUserAdmin(UserAdmin):
         ),
     )
     search_fields = ["email", "username"]
+
+    @property
+    def indexed(self):
+        return settings.ADMIN_USER_SEARCH != "contains"
+
+    def get_changelist(self, request, **kwargs):
+        if self.indexed:
+            return KeysetChangeList
+        return super().get_changelist(request, **kwargs)
+
+    def get_ordering(self, request):
+        return ["pk"] if self.indexed else super().get_ordering(request)
+
+    def get_sortable_by(self, request):
+        return () if self.indexed else super().get_sortable_by(request)
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Поиск по началу email и username (prefix) или по подстроке через
+        триграммные индексы PostgreSQL (trigram, от трёх символов).
+        """
+        term = search_term.strip()
+        if not self.indexed or not term:
+            return super().get_search_results(request, queryset, search_term)
+        lookup = "istartswith"
+        if settings.ADMIN_USER_SEARCH == "trigram" and len(term) >= 3:
+            lookup = "icontains"
+        return (
+            queryset.filter(
+                Q(**{f"email__{lookup}": term})
+                | Q(**{f"username__{lookup}": term})
+            ),
+            False,
+        )
+
+    def changelist_view(self, request, extra_context=None):
+        # Просмотр списка не нагружает основную базу, если есть реплики.
+        if request.method != "GET":
+            return super().changelist_view(request, extra_context)
+        with replica_reads():
+            return super().changelist_view(request, extra_context)
+
+    def save_model(self, request, obj, form, change):
+        # Деактивация сразу отзывает все токены пользователя.
+        if change and "is_active" in form.changed_data and not obj.is_active:
+            obj.token_version += 1
+        super().save_model(request, obj, form, change)
@@ -0,0 +1,18 @@
+from django.urls import path
+
+from .async_views import (AsyncIntrospectionView, AsyncLoginView,
+                          AsyncLogoutAllView, AsyncLogoutView,
+                          AsyncRegisterAPIView, AsyncTokenRefreshView,
+                          AsyncUserDetailView)
+from .views import BulkRegisterView
+
+urlpatterns = [
+    path("register/", AsyncRegisterAPIView.as_view(), name="register"),
+    path("register/bulk/", BulkRegisterView.as_view(), name="register_bulk"),
+    path("login/", AsyncLoginView.as_view(), name="login"),
+    path("refresh/", AsyncTokenRefreshView.as_view(), name="token_refresh"),
+    path("logout/", AsyncLogoutView.as_view(), name="logout"),
+    path("logout/all/", AsyncLogoutAllView.as_view(), name="logout_all"),
+    path("introspect/", AsyncIntrospectionView.as_view(), name="introspect"),
+    path("me/", AsyncUserDetailView.as_view(), name="user_detail"),
+]
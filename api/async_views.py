@@ -0,0 +1,238 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.http import JsonResponse, QueryDict
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.exceptions import (APIException, NotAuthenticated,
+                                       ParseError, PermissionDenied, Throttled)
+from rest_framework_simplejwt.exceptions import TokenError
+
+from . import audit, lockout, lookup, revocation
+from .authentication import CachedJWTAuthentication
+from .introspection import HasIntrospectionSecret, aintrospect
+from .keys import keyring
+from .renderers import FastJsonResponse, loads
+from .serializers import (IntrospectionSerializer, LoginSerializer,
+                          LogoutSerializer, RegisterSerializer,
+                          TokenRefreshSerializer, UserDetailSerializer,
+                          user_payload)
+from .throttling import (LoginThrottle, LogoutThrottle, RefreshThrottle,
+                         RegisterThrottle)
+from .tokens import arefresh_pair, get_refresh_token_class
+
+User = get_user_model()
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncAPIView(View):
+    """
+    Асинхронный аналог APIView: разбирает JSON или form-тело и
+    превращает исключения DRF в такие же JSON-ответы.
+    """
+
+    throttle_classes = []
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            if not settings.JWT_SIGNING_ALGORITHM.startswith("HS"):
+                await keyring.aload()
+            await self.check_throttles(request)
+            return await super().dispatch(request, *args, **kwargs)
+        except APIException as exc:
+            return self.handle_exception(exc)
+
+    async def check_throttles(self, request):
+        waits = []
+        for throttle_class in self.throttle_classes:
+            throttle = throttle_class()
+            if not await throttle.aallow_request(
+                request, self.get_data(request)
+            ):
+                waits.append(throttle.wait())
+        if waits:
+            raise Throttled(max(waits))
+
+    def handle_exception(self, exc):
+        data = exc.detail
+        if not isinstance(data, (dict, list)):
+            data = {"detail": data}
+        response = JsonResponse(data, status=exc.status_code, safe=False)
+        if getattr(exc, "wait", None):
+            response["Retry-After"] = "%d" % exc.wait
+        if exc.status_code == status.HTTP_401_UNAUTHORIZED:
+            response["WWW-Authenticate"] = (
+                CachedJWTAuthentication().authenticate_header(self.request)
+            )
+        return response
+
+    async def authenticate(self, request):
+        result = await CachedJWTAuthentication().aauthenticate(request)
+        if result is None:
+            raise NotAuthenticated()
+        return result[0]
+
+    def get_data(self, request):
+        if not hasattr(self, "_data"):
+            self._data = self.parse(request)
+        return self._data
+
+    def parse(self, request):
+        if request.content_type == "application/json":
+            try:
+                return loads(request.body or b"{}")
+            except ValueError as exc:
+                raise ParseError(f"JSON parse error - {exc}")
+        if request.method == "POST":
+            return request.POST
+        return QueryDict(request.body)
+
+
+class AsyncRegisterAPIView(AsyncAPIView):
+    throttle_classes = [RegisterThrottle]
+
+    async def post(self, request):
+        serializer = RegisterSerializer(data=self.get_data(request))
+        if not await sync_to_async(serializer.is_valid)():
+            return JsonResponse(
+                serializer.errors, status=status.HTTP_400_BAD_REQUEST
+            )
+        data = serializer.validated_data
+        user = await User.objects.acreate_user(
+            email=data["email"],
+            password=data["password"],
+            username=data.get("username") or data["email"],
+        )
+        return JsonResponse(
+            serializer.to_representation(user),
+            status=status.HTTP_201_CREATED,
+        )
+
+
+class AsyncLoginView(AsyncAPIView):
+    throttle_classes = [LoginThrottle]
+
+    async def post(self, request):
+        serializer = LoginSerializer(data=self.get_data(request))
+        if serializer.is_valid():
+            email = serializer.validated_data["email"]
+            wait = await lockout.acheck(request, email)
+            if wait:
+                audit.record("login_locked", request)
+                raise Throttled(wait, "Too many failed login attempts.")
+            user = await lookup.aauthenticate(
+                email, serializer.validated_data["password"]
+            )
+            if user:
+                await lockout.asucceeded(email)
+                refresh = await get_refresh_token_class(
+                    asynchronous=True
+                ).afor_user(user)
+                audit.record("login", request, user.pk, user.tenant)
+                return FastJsonResponse(
+                    {
+                        "access_token": str(refresh.access_token),
+                        "refresh_token": str(refresh),
+                    }
+                )
+            await lockout.afailed(request, email)
+            audit.record("login_failed", request)
+        return FastJsonResponse(
+            {"error": "Invalid credentials"},
+            status=status.HTTP_401_UNAUTHORIZED,
+        )
+
+
+class AsyncTokenRefreshView(AsyncAPIView):
+    throttle_classes = [RefreshThrottle]
+
+    async def post(self, request):
+        serializer = TokenRefreshSerializer(data=self.get_data(request))
+        if serializer.is_valid():
+            try:
+                pair, subject = await arefresh_pair(
+                    serializer.validated_data["refresh_token"]
+                )
+            except TokenError:
+                audit.record("refresh_failed", request)
+                return FastJsonResponse(
+                    {"error": "Invalid token or expired refresh token"},
+                    status=status.HTTP_401_UNAUTHORIZED,
+                )
+            audit.record("refresh", request, *subject)
+            return FastJsonResponse(pair)
+        return FastJsonResponse(
+            serializer.errors, status=status.HTTP_400_BAD_REQUEST
+        )
+
+
+class AsyncLogoutView(AsyncAPIView):
+    throttle_classes = [LogoutThrottle]
+
+    async def post(self, request):
+        serializer = LogoutSerializer(data=self.get_data(request))
+        if serializer.is_valid():
+            try:
+                subject = await get_refresh_token_class(
+                    asynchronous=True
+                ).arevoke(serializer.validated_data["refresh_token"])
+                audit.record("logout", request, *subject)
+                return FastJsonResponse({"success": "User logged out."})
+            except Exception as e:
+                audit.record("logout_failed", request)
+                return FastJsonResponse(
+                    {"error": str(e)}, status=status.HTTP_400_BAD_REQUEST
+                )
+        return FastJsonResponse(
+            serializer.errors, status=status.HTTP_400_BAD_REQUEST
+        )
+
+
+class AsyncLogoutAllView(AsyncAPIView):
+
+    async def post(self, request):
+        user = await self.authenticate(request)
+        await sync_to_async(revocation.revoke_all)(user.pk, user.tenant)
+        audit.record("logout_all", request, user.pk, user.tenant)
+        return FastJsonResponse({"success": "All sessions revoked."})
+
+
+class AsyncUserDetailView(AsyncAPIView):
+
+    async def get(self, request):
+        user = await self.authenticate(request)
+        return FastJsonResponse(user_payload(user))
+
+    async def put(self, request):
+        snapshot = await self.authenticate(request)
+        user = await User.objects.aget(pk=snapshot.pk)
+        serializer = UserDetailSerializer(
+            user, data=self.get_data(request), partial=True
+        )
+        if not await sync_to_async(serializer.is_valid)():
+            return JsonResponse(
+                serializer.errors, status=status.HTTP_400_BAD_REQUEST
+            )
+        for field, value in serializer.validated_data.items():
+            setattr(user, field, value)
+        await user.asave(update_fields=list(serializer.validated_data))
+        audit.record("profile_update", request, user.pk, user.tenant)
+        return JsonResponse(serializer.to_representation(user))
+
+
+class AsyncIntrospectionView(AsyncAPIView):
+
+    async def post(self, request):
+        if not HasIntrospectionSecret().has_permission(request, self):
+            raise PermissionDenied()
+        serializer = IntrospectionSerializer(data=self.get_data(request))
+        if not serializer.is_valid():
+            return JsonResponse(
+                serializer.errors, status=status.HTTP_400_BAD_REQUEST
+            )
+        data = serializer.validated_data
+        if "token" in data:
+            return JsonResponse((await aintrospect([data["token"]]))[0])
+        return JsonResponse({"results": await aintrospect(data["tokens"])})
@@ -0,0 +1,140 @@
+import atexit
+import collections
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils.module_loading import import_string
+
+from . import metrics
+from .connections import get_redis
+from .renderers import dumps
+from .tenants import current_tenant
+from .throttling import client_ip
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ("ts", "event", "user", "tenant", "ip")
+
+_buffer = collections.deque()
+_wakeup = threading.Event()
+_flusher = None
+_flusher_lock = threading.Lock()
+_flush_lock = threading.Lock()
+
+
+def record(event, request=None, user_id=None, tenant=None):
+    """
+    Событие в буфер процесса. Запрос не ждёт записи: при переполнении
+    буфера событие отбрасывается и учитывается в метрике.
+    """
+    if not settings.AUDIT_SINK:
+        return
+    if len(_buffer) >= settings.AUDIT_BUFFER_SIZE:
+        metrics.AUDIT_EVENTS.labels("dropped").inc()
+        return
+    # Адрес клиента, а не прокси: тот же, что у лимитов и блокировок.
+    ip = client_ip(request) if request is not None else None
+    _buffer.append(
+        (time.time(), event, user_id, tenant or current_tenant(), ip)
+    )
+    if len(_buffer) >= settings.AUDIT_BATCH_SIZE:
+        _wakeup.set()
+    start_flusher()
+
+
+def as_dict(entry):
+    return dict(zip(FIELDS, entry))
+
+
+def get_sink():
+    return import_string(settings.AUDIT_SINK)()
+
+
+def flush():
+    """Запись накопленных событий пачками по AUDIT_BATCH_SIZE."""
+    with _flush_lock:
+        while _buffer:
+            batch = []
+            while _buffer and len(batch) < settings.AUDIT_BATCH_SIZE:
+                batch.append(_buffer.popleft())
+            try:
+                get_sink().write(batch)
+            except Exception:
+                logger.exception("Could not write %d audit events", len(batch))
+                metrics.AUDIT_EVENTS.labels("failed").inc(len(batch))
+            else:
+                metrics.AUDIT_EVENTS.labels("written").inc(len(batch))
+
+
+def _run():
+    while True:
+        _wakeup.wait(settings.AUDIT_FLUSH_INTERVAL)
+        _wakeup.clear()
+        flush()
+
+
+def start_flusher():
+    """Фоновая запись стартует в воркере при первом событии, после fork."""
+    global _flusher
+    if _flusher is not None:
+        return
+    with _flusher_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(
+                target=_run, name="auth-audit", daemon=True
+            )
+            _flusher.start()
+            atexit.register(flush)
+
+
+class RedisStreamSink:
+    """События в Redis stream AUDIT_STREAM длиной около AUDIT_STREAM_MAXLEN."""
+
+    def write(self, batch):
+        pipe = get_redis().pipeline(transaction=False)
+        for entry in batch:
+            fields = {
+                key: "" if value is None else value
+                for key, value in as_dict(entry).items()
+            }
+            pipe.xadd(
+                settings.AUDIT_STREAM,
+                fields,
+                maxlen=settings.AUDIT_STREAM_MAXLEN,
+                approximate=True,
+            )
+        pipe.execute()
+
+
+class JSONLinesSink:
+    """Дозапись событий в файл AUDIT_LOG_PATH, по строке JSON на событие."""
+
+    def write(self, batch):
+        lines = b"".join(dumps(as_dict(entry)) + b"\n" for entry in batch)
+        with Path(settings.AUDIT_LOG_PATH).open("ab") as file:
+            file.write(lines)
+
+
+class DatabaseSink:
+    """Одна вставка bulk_create на пачку в таблицу AuditEvent."""
+
+    def write(self, batch):
+        from .models import AuditEvent
+
+        # Поток живёт дольше запросов: устаревшее подключение заменяется.
+        close_old_connections()
+        AuditEvent.objects.bulk_create(
+            AuditEvent(
+                created_at=datetime.fromtimestamp(ts, timezone.utc),
+                event=event,
+                user_id=user_id,
+                tenant=tenant,
+                ip=ip,
+            )
+            for ts, event, user_id, tenant, ip in batch
+        )
@@ -0,0 +1,186 @@
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework import HTTP_HEADER_ENCODING
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import (AuthenticationFailed,
+                                                 InvalidToken)
+from rest_framework_simplejwt.settings import api_settings
+
+from . import broadcast, revocation, tenants
+from .cache import TTLCache
+from .routers import replica_reads
+
+INVALIDATION_CHANNEL = "auth:user-invalidated"
+
+access_token_cache = TTLCache(
+    maxsize=settings.ACCESS_TOKEN_CACHE_SIZE,
+    ttl=settings.ACCESS_TOKEN_CACHE_TTL,
+)
+
+
+class UserSnapshot:
+    """Компактная копия пользователя, достаточная для запросов к /me/."""
+
+    __slots__ = (
+        "id",
+        "email",
+        "username",
+        "is_active",
+        "tenant",
+        "is_staff",
+        "is_superuser",
+    )
+
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(
+        self,
+        id,
+        email,
+        username,
+        is_active,
+        tenant,
+        is_staff=False,
+        is_superuser=False,
+    ):
+        self.id = id
+        self.email = email
+        self.username = username
+        self.is_active = is_active
+        self.tenant = tenant
+        # Нужны IsAdminUser, например для массовой регистрации.
+        self.is_staff = is_staff
+        self.is_superuser = is_superuser
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(
+            user.pk,
+            user.email,
+            user.username,
+            user.is_active,
+            user.tenant,
+            user.is_staff,
+            user.is_superuser,
+        )
+
+    @property
+    def pk(self):
+        return self.id
+
+    def __str__(self):
+        return self.email
+
+
+def evict_user(user_id):
+    return access_token_cache.discard_where(
+        lambda entry: entry[0].id == user_id
+    )
+
+
+def _on_invalidation(message):
+    if message is None:
+        access_token_cache.clear()
+    else:
+        evict_user(int(message))
+
+
+def invalidate_user(user_id):
+    """Сброс кэша пользователя в этом и во всех остальных воркерах."""
+    evict_user(user_id)
+    broadcast.publish(INVALIDATION_CHANNEL, user_id)
+
+
+broadcast.subscribe(INVALIDATION_CHANNEL, _on_invalidation)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication, который запоминает проверенные access-токены.
+    Повторный запрос с тем же токеном не проверяет подпись и не ходит в БД.
+    Дальше запрос работает в арендаторе из токена.
+    """
+
+    def get_raw_token(self, header):
+        # Ключ кэша — строка токена, как в introspection и benchmarks.
+        raw_token = super().get_raw_token(header)
+        if raw_token is None:
+            return None
+        return raw_token.decode(HTTP_HEADER_ENCODING)
+
+    def authenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        broadcast.start_listener()
+        cached = access_token_cache.get(raw_token)
+        if cached is not None:
+            tenants.activate(cached[0].tenant)
+            return cached
+        validated_token = self.get_validated_token(raw_token)
+        tenants.activate(tenants.token_tenant(validated_token))
+        user = self.get_user(validated_token)
+        self.check_version(validated_token, user)
+        return self.remember(raw_token, user, validated_token)
+
+    async def aauthenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        broadcast.start_listener()
+        cached = access_token_cache.get(raw_token)
+        if cached is not None:
+            tenants.activate(cached[0].tenant)
+            return cached
+        validated_token = self.get_validated_token(raw_token)
+        tenants.activate(tenants.token_tenant(validated_token))
+        user = await self.aget_user(validated_token)
+        self.check_version(validated_token, user)
+        return self.remember(raw_token, user, validated_token)
+
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        with replica_reads(user_ids=[user_id] if user_id else ()):
+            return super().get_user(validated_token)
+
+    async def aget_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(
+                _("Token contained no recognizable user identification")
+            )
+        async with replica_reads(user_ids=[user_id]):
+            user = await self.user_model.objects.filter(
+                **{api_settings.USER_ID_FIELD: user_id}
+            ).afirst()
+        if user is None:
+            raise AuthenticationFailed(
+                _("User not found"), code="user_not_found"
+            )
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(
+                _("User is inactive"), code="user_inactive"
+            )
+        return user
+
+    def check_version(self, validated_token, user):
+        """Токен выпущен до последнего отзыва всех сессий пользователя."""
+        if not revocation.is_current(validated_token, user):
+            raise AuthenticationFailed(
+                _("Token has been revoked"), code="token_revoked"
+            )
+
+    def remember(self, raw_token, user, validated_token):
+        entry = (UserSnapshot.from_user(user), validated_token)
+        access_token_cache.set(
+            raw_token, entry, expires_at=validated_token["exp"]
+        )
+        return entry
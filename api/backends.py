@@ -0,0 +1,19 @@
+from django.contrib.auth.backends import ModelBackend
+
+from . import lookup
+
+
+class TenantBackend(ModelBackend):
+    """
+    Вход через django.contrib.auth (админка): email ищется в арендаторе
+    запроса тем же путём, что и в API, с выравниванием времени ответа.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        email = username or kwargs.get("email")
+        if email is None or password is None:
+            return None
+        user = lookup.authenticate(email, password)
+        if user is not None and self.user_can_authenticate(user):
+            return user
+        return None
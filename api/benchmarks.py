@@ -0,0 +1,307 @@
+import http.client
+import json
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import redis
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import override_settings
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from . import connections, hashing
+from .authentication import UserSnapshot, access_token_cache
+from .live_config import live_config
+from .renderers import FastJSONRenderer
+from .serializers import LoginSerializer, UserDetailSerializer, user_payload
+from .tokens import (AccessToken, RefreshToken, get_refresh_token_class,
+                     verified_payloads)
+from .views import UserDetailView
+
+User = get_user_model()
+
+BENCH_PASSWORD = "bench-password-123"
+
+BENCH_CHANNEL_PREFIX = "bench:"
+
+
+def summarize(durations, elapsed):
+    """Перцентили в миллисекундах и пропускная способность."""
+    durations = sorted(durations)
+    if len(durations) > 1:
+        cuts = statistics.quantiles(durations, n=100, method="inclusive")
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    else:
+        p50 = p95 = p99 = durations[0] if durations else 0.0
+    return {
+        "count": len(durations),
+        "p50_ms": round(p50 * 1000, 3),
+        "p95_ms": round(p95 * 1000, 3),
+        "p99_ms": round(p99 * 1000, 3),
+        "per_second": round(len(durations) / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+def measure(func, iterations, warmup=3):
+    for _ in range(warmup):
+        func()
+    durations = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        call_started = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - call_started)
+    return summarize(durations, time.perf_counter() - started)
+
+
+def micro_benchmarks():
+    """Операции горячего пути без HTTP и без записи в БД."""
+    user = User(pk=1, email="bench@example.com", username="bench")
+    values = live_config.snapshot()
+    refresh = RefreshToken.new_for_user(user, values)
+    raw_access = str(refresh.access_token)
+    raw_refresh = str(refresh)
+    encoded = hashing.make_password(BENCH_PASSWORD)
+    login = {"email": "bench@example.com", "password": BENCH_PASSWORD}
+    tokens = {"access_token": raw_access, "refresh_token": raw_refresh}
+    me_view, me_request = detail_view(raw_access)
+    return {
+        "token_mint": lambda: (
+            str(RefreshToken.new_for_user(user, values).access_token)
+        ),
+        "access_verify": lambda: AccessToken(raw_access),
+        "refresh_verify": lambda: (
+            verified_payloads.clear(), RefreshToken(raw_refresh)
+        ),
+        "refresh_verify_memo": lambda: RefreshToken(raw_refresh),
+        "hash_make": lambda: hashing.make_password(BENCH_PASSWORD),
+        "hash_check": lambda: hashing.check_password(BENCH_PASSWORD, encoded),
+        "login_serializer": lambda: LoginSerializer(data=login).is_valid(),
+        "user_serializer": lambda: UserDetailSerializer(user).data,
+        "user_payload": lambda: user_payload(user),
+        "render_drf": lambda: JSONRenderer().render(tokens),
+        "render_fast": lambda: FastJSONRenderer().render(tokens),
+        "me_view": lambda: me_view(me_request()).render(),
+    }
+
+
+def detail_view(raw_access):
+    """GET /api/me/ целиком через DRF, с уже закэшированным токеном."""
+    factory = APIRequestFactory()
+    access_token_cache.set(
+        raw_access,
+        (
+            UserSnapshot(1, "bench@example.com", "bench", True, "default"),
+            AccessToken(raw_access),
+        ),
+    )
+    view = UserDetailView.as_view()
+    return view, lambda: factory.get(
+        "/api/me/", HTTP_AUTHORIZATION=f"Bearer {raw_access}"
+    )
+
+
+def run_micro(iterations, names=None):
+    results = {}
+    for name, func in micro_benchmarks().items():
+        if names and name not in names:
+            continue
+        # Хеширование на порядки медленнее остального.
+        count = max(1, iterations // 20) if name.startswith("hash") else (
+            iterations
+        )
+        results[name] = measure(func, count)
+    return results
+
+
+class Client:
+    """HTTP-клиент одного потока нагрузки с keep-alive подключением."""
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.connection = http.client.HTTPConnection(
+            parts.hostname, parts.port or 80, timeout=30
+        )
+
+    def request(self, method, path, data=None, token=None):
+        headers = {"Content-Type": "application/json"}
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        body = json.dumps(data) if data is not None else None
+        self.connection.request(method, path, body=body, headers=headers)
+        response = self.connection.getresponse()
+        content = response.read()
+        return response.status, json.loads(content) if content else None
+
+    def close(self):
+        self.connection.close()
+
+
+def prepare_users(count):
+    """Пользователи bench-N с одним общим хешем пароля."""
+    User.objects.filter(email__startswith="bench-").delete()
+    encoded = hashing.make_password(BENCH_PASSWORD)
+    return User.objects.bulk_create(
+        User(email=f"bench-{index}@example.com", password=encoded)
+        for index in range(count)
+    )
+
+
+def scenario_steps(name, user, requests):
+    """Запросы одного потока сценария; токены готовятся заранее."""
+    token_class = get_refresh_token_class()
+    credentials = {"email": user.email, "password": BENCH_PASSWORD}
+    if name == "login_storm":
+        return [("POST", "/api/login/", credentials, None)] * requests
+    if name == "me_reads":
+        access = str(token_class.for_user(user).access_token)
+        return [("GET", "/api/me/", None, access)] * requests
+    if name == "logout_burst":
+        return [
+            (
+                "POST",
+                "/api/logout/",
+                {"refresh_token": str(token_class.for_user(user))},
+                None,
+            )
+            for _ in range(requests)
+        ]
+    if name == "refresh_churn":
+        # Каждый запрос использует токен, выданный предыдущим.
+        return [("REFRESH", str(token_class.for_user(user)))] * requests
+    raise ValueError(f"Unknown scenario {name}")
+
+
+SCENARIOS = ("login_storm", "refresh_churn", "me_reads", "logout_burst")
+
+
+def run_worker(base_url, steps):
+    client = Client(base_url)
+    durations, errors = [], 0
+    refresh = None
+    try:
+        for step in steps:
+            started = time.perf_counter()
+            if step[0] == "REFRESH":
+                refresh = refresh or step[1]
+                code, data = client.request(
+                    "POST", "/api/refresh/", {"refresh_token": refresh}
+                )
+                if code == 200:
+                    refresh = data["refresh_token"]
+            else:
+                code, _ = client.request(*step)
+            durations.append(time.perf_counter() - started)
+            errors += code >= 400
+    finally:
+        client.close()
+    return durations, errors
+
+
+def run_scenario(base_url, name, users, requests):
+    plans = [scenario_steps(name, user, requests) for user in users]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(plans)) as executor:
+        results = list(
+            executor.map(lambda steps: run_worker(base_url, steps), plans)
+        )
+    elapsed = time.perf_counter() - started
+    durations = [duration for worker, _ in results for duration in worker]
+    summary = summarize(durations, elapsed)
+    summary["errors"] = sum(errors for _, errors in results)
+    return summary
+
+
+@contextmanager
+def throwaway_database():
+    """
+    Временная база с миграциями для сценариев нагрузки: пользователи
+    bench-N не попадают в рабочую базу. Отдаёт имя базы для сервера.
+    """
+    test_settings = connection.settings_dict["TEST"]
+    old_name = connection.settings_dict["NAME"]
+    old_test_name = test_settings.get("NAME")
+    with tempfile.TemporaryDirectory() as directory:
+        if connection.vendor == "sqlite":
+            test_settings["NAME"] = str(Path(directory) / "bench.sqlite3")
+        else:
+            test_settings["NAME"] = f"bench_{old_name}"
+        name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        try:
+            yield name
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            test_settings["NAME"] = old_test_name
+
+
+@contextmanager
+def throwaway_redis(db):
+    """
+    Пустая база Redis для сценариев нагрузки: токены, отзывы и счётчики
+    bench-пользователей не попадают в рабочую базу, а каналы pub/sub
+    получают свой префикс. Занятую базу не трогаем, после прогона
+    очищаем.
+    """
+    options = {**settings.CONSTANCE_REDIS_CONNECTION, "db": db}
+    client = redis.Redis(**options)
+    if db == settings.CONSTANCE_REDIS_CONNECTION["db"] or client.dbsize():
+        raise ValueError(f"Redis database {db} is not empty")
+    try:
+        with override_settings(
+            CONSTANCE_REDIS_CONNECTION=options,
+            BROADCAST_CHANNEL_PREFIX=BENCH_CHANNEL_PREFIX,
+        ):
+            connections.reset()
+            try:
+                yield db
+            finally:
+                connections.reset()
+    finally:
+        client.flushdb()
+
+
+def run_macro(base_url, concurrency, requests, names=None):
+    users = prepare_users(concurrency)
+    try:
+        return {
+            name: run_scenario(base_url, name, users, requests)
+            for name in SCENARIOS
+            if not names or name in names
+        }
+    finally:
+        User.objects.filter(email__startswith="bench-").delete()
+
+
+def compare(results, baseline, tolerance):
+    """
+    Регрессии относительно сохранённого прогона: p95 выросла или
+    пропускная способность упала больше чем на tolerance.
+    """
+    regressions = []
+    for kind in ("micro", "macro"):
+        for name, current in results.get(kind, {}).items():
+            previous = baseline.get(kind, {}).get(name)
+            if not previous:
+                continue
+            if current["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+                regressions.append(
+                    f"{kind}/{name}: p95 {previous['p95_ms']} -> "
+                    f"{current['p95_ms']} ms"
+                )
+            if current["per_second"] < previous["per_second"] * (
+                1 - tolerance
+            ):
+                regressions.append(
+                    f"{kind}/{name}: {previous['per_second']} -> "
+                    f"{current['per_second']} per second"
+                )
+    return regressions
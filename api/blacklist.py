@@ -0,0 +1,322 @@
+import hashlib
+import math
+import threading
+import time
+from functools import lru_cache
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.module_loading import import_string
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import (BlacklistedToken,
+                                                             OutstandingToken)
+from rest_framework_simplejwt.utils import datetime_from_epoch
+
+from .connections import get_async_redis, get_redis
+
+
+class BloomFilter:
+    """Фильтр Блума поверх bytearray в битовом порядке Redis SETBIT."""
+
+    def __init__(self, capacity, error_rate, bits=None):
+        self.size = math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2
+        )
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        length = (self.size + 7) // 8
+        self.bits = bytearray((bits or b"")[:length].ljust(length, b"\0"))
+
+    def positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "big")
+        second = int.from_bytes(digest[8:], "big") | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self.positions(key):
+            self.bits[position >> 3] |= 0x80 >> (position & 7)
+
+    def __contains__(self, key):
+        return all(
+            self.bits[position >> 3] & (0x80 >> (position & 7))
+            for position in self.positions(key)
+        )
+
+
+class BaseBlacklist:
+    """
+    Интерфейс хранилища отозванных refresh-токенов. Асинхронные методы
+    по умолчанию выполняют синхронные в отдельном потоке.
+    """
+
+    def outstanding(self, token, user):
+        """Регистрация только что выпущенного токена."""
+
+    def blacklist(self, token):
+        raise NotImplementedError
+
+    def is_blacklisted(self, token):
+        raise NotImplementedError
+
+    def blacklisted_many(self, tokens):
+        """Множество jti отозванных токенов из переданных."""
+        return {
+            token[api_settings.JTI_CLAIM]
+            for token in tokens
+            if self.is_blacklisted(token)
+        }
+
+    async def aoutstanding(self, token, user):
+        return await sync_to_async(self.outstanding)(token, user)
+
+    async def ablacklist(self, token):
+        return await sync_to_async(self.blacklist)(token)
+
+    async def ais_blacklisted(self, token):
+        return await sync_to_async(self.is_blacklisted)(token)
+
+    async def ablacklisted_many(self, tokens):
+        return await sync_to_async(self.blacklisted_many)(tokens)
+
+
+class DatabaseBlacklist(BaseBlacklist):
+    """Таблицы token_blacklist из rest_framework_simplejwt."""
+
+    def outstanding(self, token, user):
+        OutstandingToken.objects.create(
+            user=user,
+            jti=token[api_settings.JTI_CLAIM],
+            token=str(token),
+            created_at=token.current_time,
+            expires_at=datetime_from_epoch(token["exp"]),
+        )
+
+    def blacklist(self, token):
+        outstanding, _ = OutstandingToken.objects.get_or_create(
+            jti=token[api_settings.JTI_CLAIM],
+            defaults={
+                "user_id": token.get(api_settings.USER_ID_CLAIM),
+                "created_at": token.current_time,
+                "token": str(token),
+                "expires_at": datetime_from_epoch(token["exp"]),
+            },
+        )
+        return BlacklistedToken.objects.get_or_create(token=outstanding)
+
+    def is_blacklisted(self, token):
+        return BlacklistedToken.objects.filter(
+            token__jti=token[api_settings.JTI_CLAIM]
+        ).exists()
+
+    def blacklisted_many(self, tokens):
+        if not tokens:
+            return set()
+        return set(
+            BlacklistedToken.objects.filter(
+                token__jti__in=[
+                    token[api_settings.JTI_CLAIM] for token in tokens
+                ]
+            ).values_list("token__jti", flat=True)
+        )
+
+
+class RedisBlacklist(BaseBlacklist):
+    """
+    JTI отозванных токенов хранятся в Redis с TTL до истечения токена.
+    Фильтры Блума разбиты на окна по exp и копируются в память воркера,
+    поэтому большинство проверок «не отозван» обходятся без Redis.
+    """
+
+    key_prefix = "blacklist"
+
+    def __init__(self):
+        self.capacity = settings.TOKEN_BLACKLIST_BLOOM_CAPACITY
+        self.error_rate = settings.TOKEN_BLACKLIST_BLOOM_ERROR_RATE
+        self.window = int(
+            settings.TOKEN_BLACKLIST_BLOOM_WINDOW.total_seconds()
+        )
+        self.refresh_interval = settings.TOKEN_BLACKLIST_BLOOM_REFRESH
+        self.log_ttl = settings.TOKEN_BLACKLIST_LOG_TTL
+        self._filters = {}
+        self._log_id = None
+        self._synced_at = None
+        self._lock = threading.Lock()
+
+    def _key(self, *parts):
+        return ":".join((self.key_prefix, *map(str, parts)))
+
+    def _new_filter(self, bits=None):
+        return BloomFilter(self.capacity, self.error_rate, bits)
+
+    def _queue_revocations(self, pipe, entries):
+        now = int(time.time())
+        for jti, exp in entries:
+            if exp <= now:
+                continue
+            window = exp // self.window
+            bloom_key = self._key("bloom", window)
+            pipe.set(self._key("jti", jti), 1, ex=exp - now)
+            for position in self._new_filter().positions(jti):
+                pipe.setbit(bloom_key, position, 1)
+            pipe.expireat(bloom_key, (window + 2) * self.window)
+            # Остальные воркеры получают только новые jti из журнала.
+            pipe.xadd(
+                self._key("log"),
+                {"jti": jti, "exp": exp},
+                minid=(now - self.log_ttl) * 1000,
+                approximate=True,
+            )
+            with self._lock:
+                self._filters.setdefault(window, self._new_filter()).add(jti)
+
+    def revoke_many(self, entries):
+        """Отзыв пар (jti, exp) одним пайплайном."""
+        pipe = get_redis().pipeline()
+        self._queue_revocations(pipe, entries)
+        pipe.execute()
+
+    async def arevoke_many(self, entries):
+        pipe = get_async_redis().pipeline()
+        self._queue_revocations(pipe, entries)
+        await pipe.execute()
+
+    def blacklist(self, token):
+        self.revoke_many([(token[api_settings.JTI_CLAIM], token["exp"])])
+
+    async def ablacklist(self, token):
+        await self.arevoke_many(
+            [(token[api_settings.JTI_CLAIM], token["exp"])]
+        )
+
+    def _surely_absent(self, token):
+        # Отзывы других воркеров доходят до фильтров с задержкой до
+        # refresh_interval, свои — сразу. Только что выпущенный токен
+        # (ротация, повтор сразу после неё) всегда проверяется в Redis.
+        if token.get("iat", 0) + self.refresh_interval >= int(time.time()):
+            return False
+        bloom = self._filters.get(token["exp"] // self.window)
+        return bloom is None or token[api_settings.JTI_CLAIM] not in bloom
+
+    def is_blacklisted(self, token):
+        if self.refresh_interval:
+            self._sync()
+            if self._surely_absent(token):
+                return False
+        key = self._key("jti", token[api_settings.JTI_CLAIM])
+        return bool(get_redis().exists(key))
+
+    async def ais_blacklisted(self, token):
+        if self.refresh_interval:
+            await self._async_sync()
+            if self._surely_absent(token):
+                return False
+        key = self._key("jti", token[api_settings.JTI_CLAIM])
+        return bool(await get_async_redis().exists(key))
+
+    def _candidates(self, tokens):
+        return [
+            token[api_settings.JTI_CLAIM]
+            for token in tokens
+            if not self.refresh_interval or not self._surely_absent(token)
+        ]
+
+    def _revoked(self, jtis, values):
+        return {jti for jti, value in zip(jtis, values) if value}
+
+    def blacklisted_many(self, tokens):
+        """Проверка пачки токенов одним MGET по кандидатам из фильтров."""
+        if self.refresh_interval:
+            self._sync()
+        jtis = self._candidates(tokens)
+        if not jtis:
+            return set()
+        keys = [self._key("jti", jti) for jti in jtis]
+        return self._revoked(jtis, get_redis().mget(keys))
+
+    async def ablacklisted_many(self, tokens):
+        if self.refresh_interval:
+            await self._async_sync()
+        jtis = self._candidates(tokens)
+        if not jtis:
+            return set()
+        keys = [self._key("jti", jti) for jti in jtis]
+        return self._revoked(jtis, await get_async_redis().mget(keys))
+
+    def _is_fresh(self, now):
+        return (
+            self._synced_at is not None
+            and now - self._synced_at < self.refresh_interval
+        )
+
+    def _needs_reload(self, now):
+        # Журнал хранит записи LOG_TTL секунд: отставший воркер мог
+        # пропустить часть из них и загружает фильтры целиком.
+        return (
+            self._synced_at is None or now - self._synced_at >= self.log_ttl
+        )
+
+    def _load(self, now, last, keys, values):
+        with self._lock:
+            self._filters = {
+                int(key.rsplit(b":", 1)[1]): self._new_filter(value)
+                for key, value in zip(keys, values)
+                if value
+            }
+            self._log_id = last[0][0] if last else b"0-0"
+            self._synced_at = now
+
+    def _apply(self, now, entries):
+        """Новые jti из журнала в локальные фильтры, без чтения фильтров."""
+        expired = int(time.time()) // self.window
+        with self._lock:
+            for entry_id, fields in entries:
+                window = int(fields[b"exp"]) // self.window
+                bloom = self._filters.setdefault(window, self._new_filter())
+                bloom.add(fields[b"jti"].decode())
+                self._log_id = entry_id
+            for window in [w for w in self._filters if w < expired]:
+                del self._filters[window]
+            self._synced_at = now
+
+    def _sync(self):
+        """Обновление локальных фильтров раз в refresh_interval секунд."""
+        now = time.monotonic()
+        if self._is_fresh(now):
+            return
+        client = get_redis()
+        if self._needs_reload(now):
+            # Позиция журнала берётся до чтения фильтров: записи, пришедшие
+            # во время загрузки, просто применятся повторно.
+            last = client.xrevrange(self._key("log"), count=1)
+            keys = list(client.scan_iter(match=self._key("bloom", "*")))
+            values = client.mget(keys) if keys else []
+            self._load(now, last, keys, values)
+        else:
+            entries = client.xrange(self._key("log"), b"(" + self._log_id)
+            self._apply(now, entries)
+
+    async def _async_sync(self):
+        now = time.monotonic()
+        if self._is_fresh(now):
+            return
+        client = get_async_redis()
+        if self._needs_reload(now):
+            last = await client.xrevrange(self._key("log"), count=1)
+            keys = [
+                key
+                async for key in client.scan_iter(
+                    match=self._key("bloom", "*")
+                )
+            ]
+            values = await client.mget(keys) if keys else []
+            self._load(now, last, keys, values)
+        else:
+            entries = await client.xrange(
+                self._key("log"), b"(" + self._log_id
+            )
+            self._apply(now, entries)
+
+
+@lru_cache(maxsize=None)
+def get_blacklist():
+    return import_string(settings.TOKEN_BLACKLIST_BACKEND)()
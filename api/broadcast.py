@@ -0,0 +1,70 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from redis.exceptions import RedisError
+
+from .connections import get_redis
+
+logger = logging.getLogger(__name__)
+
+_handlers = {}
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def subscribe(channel, handler):
+    """
+    Подписка на канал Redis pub/sub для сброса локальных кэшей воркера.
+    Регистрировать обработчики нужно при импорте модуля. При потере
+    соединения обработчик вызывается с None: кэш мог устареть целиком.
+    """
+    _handlers.setdefault(channel, []).append(handler)
+
+
+def channel_name(channel):
+    return settings.BROADCAST_CHANNEL_PREFIX + channel
+
+
+def publish(channel, message):
+    try:
+        get_redis().publish(channel_name(channel), message)
+    except RedisError:
+        logger.warning("Could not publish %s to %s", message, channel)
+
+
+def _dispatch(channel, message):
+    for handler in _handlers.get(channel, ()):
+        handler(message)
+
+
+def _listen():
+    while True:
+        try:
+            pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(*map(channel_name, _handlers))
+            prefix = len(settings.BROADCAST_CHANNEL_PREFIX)
+            for message in pubsub.listen():
+                _dispatch(
+                    message["channel"].decode()[prefix:],
+                    message["data"].decode(),
+                )
+        except RedisError:
+            logger.warning("Broadcast listener lost Redis")
+            for channel in _handlers:
+                _dispatch(channel, None)
+            time.sleep(1)
+
+
+def start_listener():
+    """Запуск подписки после fork, при первом запросе в воркере."""
+    global _listener
+    if _listener is not None or not _handlers:
+        return
+    with _listener_lock:
+        if _listener is None:
+            _listener = threading.Thread(
+                target=_listen, name="auth-broadcast", daemon=True
+            )
+            _listener.start()
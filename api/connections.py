@@ -0,0 +1,79 @@
+import asyncio
+import weakref
+from functools import lru_cache
+
+import redis
+import redis.asyncio
+from django.conf import settings
+
+from . import metrics
+
+_async_clients = weakref.WeakKeyDictionary()
+
+
+class TimedConnection(redis.Connection):
+    """Подключение, учитывающее ожидание ответов Redis в метриках запроса."""
+
+    def read_response(self, *args, **kwargs):
+        with metrics.timed("redis"):
+            return super().read_response(*args, **kwargs)
+
+
+class TimedAsyncConnection(redis.asyncio.Connection):
+    async def read_response(self, *args, **kwargs):
+        with metrics.timed("redis"):
+            return await super().read_response(*args, **kwargs)
+
+
+def _client(**options):
+    return redis.Redis(
+        connection_pool=redis.ConnectionPool(
+            connection_class=TimedConnection,
+            **settings.CONSTANCE_REDIS_CONNECTION,
+            **options,
+        )
+    )
+
+
+@lru_cache(maxsize=None)
+def get_redis():
+    """Общее подключение к Redis, который уже используется constance."""
+    return _client()
+
+
+@lru_cache(maxsize=None)
+def get_config_redis():
+    """Подключение с коротким таймаутом для чтения настроек constance."""
+    return _client(
+        socket_timeout=settings.LIVE_CONFIG_TIMEOUT,
+        socket_connect_timeout=settings.LIVE_CONFIG_TIMEOUT,
+    )
+
+
+@lru_cache(maxsize=None)
+def get_script(source):
+    """Lua-скрипт, вызываемый через EVALSHA с откатом на EVAL."""
+    return get_redis().register_script(source)
+
+
+def reset():
+    """Новые подключения после смены CONSTANCE_REDIS_CONNECTION."""
+    get_redis.cache_clear()
+    get_config_redis.cache_clear()
+    get_script.cache_clear()
+    _async_clients.clear()
+
+
+def get_async_redis():
+    """Асинхронный клиент Redis, свой для каждого event loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = redis.asyncio.Redis(
+            connection_pool=redis.asyncio.ConnectionPool(
+                connection_class=TimedAsyncConnection,
+                **settings.CONSTANCE_REDIS_CONNECTION,
+            )
+        )
+        _async_clients[loop] = client
+    return client
@@ -0,0 +1,398 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager, contextmanager
+
+import django
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model, hashers
+from django.db import connections
+from redis.exceptions import RedisError
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from . import metrics
+from .connections import get_async_redis, get_redis, get_script
+from .tenants import use_tenant
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_upgrader = None
+_upgrading = set()
+_lock = threading.Lock()
+_freed = threading.Condition(_lock)
+_pending = 0
+
+# KEYS[1] — занятые места хоста (вес — срок места в мс), ARGV — текущее
+# время, срок новых мест, предел, затем сами места.
+TAKE_SLOTS = """
+redis.call("ZREMRANGEBYSCORE", KEYS[1], "-inf", ARGV[1])
+if redis.call("ZCARD", KEYS[1]) + #ARGV - 3 > tonumber(ARGV[3]) then
+    return 0
+end
+for i = 4, #ARGV do
+    redis.call("ZADD", KEYS[1], ARGV[2], ARGV[i])
+end
+redis.call("PEXPIREAT", KEYS[1], ARGV[2])
+return 1
+"""
+
+HOST_POLL_INTERVAL = 0.05
+
+
+class HashingOverloaded(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Too many password operations in progress."
+    default_code = "hashing_overloaded"
+
+    def __init__(self, wait):
+        super().__init__()
+        self.wait = wait
+
+
+class Timing:
+    """Счётчик, сумма и максимум длительностей в секундах."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def as_dict(self):
+        return {"count": self.count, "total": self.total, "max": self.max}
+
+
+class HashingStats:
+    """Метрики очереди хеширования в текущем процессе."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.rejected = 0
+            self.queue_wait = Timing()
+            self.hash_time = Timing()
+
+    def observe(self, queue_wait, hash_time):
+        with self._lock:
+            self.queue_wait.observe(queue_wait)
+            self.hash_time.observe(hash_time)
+
+    def reject(self):
+        with self._lock:
+            self.rejected += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "pending": _pending,
+                "rejected": self.rejected,
+                "queue_wait": self.queue_wait.as_dict(),
+                "hash_time": self.hash_time.as_dict(),
+            }
+
+
+stats = HashingStats()
+
+
+def _init_worker():
+    os.environ.setdefault(
+        "DJANGO_SETTINGS_MODULE", "authentication_api.settings"
+    )
+    django.setup()
+
+
+def _timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ProcessPoolExecutor(
+                    max_workers=settings.PASSWORD_HASHING_WORKERS,
+                    initializer=_init_worker,
+                )
+    return _executor
+
+
+def _take_local(count, wait):
+    global _pending
+    limit = (
+        settings.PASSWORD_HASHING_WORKERS + settings.PASSWORD_HASHING_MAX_QUEUE
+    )
+    with _freed:
+        while _pending + count > limit:
+            if not wait:
+                return False
+            _freed.wait()
+        _pending += count
+    return True
+
+
+def _give_local(count):
+    global _pending
+    with _freed:
+        _pending -= count
+        _freed.notify_all()
+
+
+def _host_args(members):
+    now = int(time.time() * 1000)
+    limit = (
+        settings.PASSWORD_HASHING_HOST_WORKERS
+        + settings.PASSWORD_HASHING_MAX_QUEUE
+    )
+    deadline = now + settings.PASSWORD_HASHING_SLOT_TTL * 1000
+    key = f"hashing:slots:{settings.PASSWORD_HASHING_HOST}"
+    return [key], [now, deadline, limit, *members]
+
+
+def _take_host(members):
+    """
+    Места в очереди всего хоста, общей для воркеров gunicorn. Без Redis
+    остаётся только предел процесса.
+    """
+    try:
+        return bool(get_script(TAKE_SLOTS)(*_host_args(members)))
+    except RedisError:
+        logger.warning("Host hashing queue skipped, Redis unavailable")
+        return True
+
+
+def _give_host(members):
+    keys, _ = _host_args(members)
+    try:
+        get_redis().zrem(keys[0], *members)
+    except RedisError:
+        # Места освободятся сами через PASSWORD_HASHING_SLOT_TTL.
+        pass
+
+
+async def _atake_host(members):
+    keys, args = _host_args(members)
+    try:
+        script = get_async_redis().register_script(TAKE_SLOTS)
+        return bool(await script(keys=keys, args=args))
+    except RedisError:
+        logger.warning("Host hashing queue skipped, Redis unavailable")
+        return True
+
+
+async def _agive_host(members):
+    keys, _ = _host_args(members)
+    try:
+        await get_async_redis().zrem(keys[0], *members)
+    except RedisError:
+        pass
+
+
+def _overloaded():
+    stats.reject()
+    return HashingOverloaded(settings.PASSWORD_HASHING_RETRY_AFTER)
+
+
+def _forget_executor():
+    global _executor
+    with _lock:
+        _executor = None
+
+
+@contextmanager
+def _slot(count=1, wait=False):
+    """
+    count мест в очереди хеширования процесса и хоста. Если очередь
+    заполнена, сразу отдаём 503, чтобы не занимать воркер дольше
+    необходимого; импорт (wait) дожидается освобождения мест.
+    """
+    if not _take_local(count, wait):
+        raise _overloaded()
+    members = [uuid.uuid4().hex for _ in range(count)]
+    try:
+        while not _take_host(members):
+            if not wait:
+                raise _overloaded()
+            time.sleep(HOST_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            _give_host(members)
+    except BrokenProcessPool:
+        _forget_executor()
+        raise
+    finally:
+        _give_local(count)
+
+
+@asynccontextmanager
+async def _aslot():
+    if not _take_local(1, wait=False):
+        raise _overloaded()
+    members = [uuid.uuid4().hex]
+    try:
+        if not await _atake_host(members):
+            raise _overloaded()
+        try:
+            yield
+        finally:
+            await _agive_host(members)
+    except BrokenProcessPool:
+        _forget_executor()
+        raise
+    finally:
+        _give_local(1)
+
+
+@metrics.timed("hashing")
+def submit(func, *args):
+    """Выполнение func в пуле процессов хеширования."""
+    with _slot():
+        started = time.perf_counter()
+        if settings.PASSWORD_HASHING_WORKERS:
+            future = get_executor().submit(_timed, func, *args)
+            result, hash_time = future.result()
+        else:
+            result, hash_time = _timed(func, *args)
+    stats.observe(time.perf_counter() - started - hash_time, hash_time)
+    return result
+
+
+@metrics.timed("hashing")
+async def asubmit(func, *args):
+    """То же, что submit, но без блокировки event loop."""
+    async with _aslot():
+        started = time.perf_counter()
+        if settings.PASSWORD_HASHING_WORKERS:
+            future = get_executor().submit(_timed, func, *args)
+            result, hash_time = await asyncio.wrap_future(future)
+        else:
+            result, hash_time = await sync_to_async(
+                _timed, thread_sensitive=False
+            )(func, *args)
+    stats.observe(time.perf_counter() - started - hash_time, hash_time)
+    return result
+
+
+@metrics.timed("hashing")
+def make_passwords(passwords):
+    """
+    Хеширование пачки паролей для массового импорта. Каждый пароль
+    занимает место в очереди, а одновременно хешируется не больше
+    BULK_IMPORT_HASHING_SHARE паролей, чтобы входу оставались процессы.
+    """
+    if not settings.PASSWORD_HASHING_WORKERS:
+        return [hashers.make_password(password) for password in passwords]
+    share = settings.BULK_IMPORT_HASHING_SHARE
+    hashed = []
+    for start in range(0, len(passwords), share):
+        group = passwords[start:start + share]
+        with _slot(len(group), wait=True):
+            hashed.extend(get_executor().map(hashers.make_password, group))
+    return hashed
+
+
+def check_password(password, encoded):
+    return submit(hashers.check_password, password, encoded)
+
+
+def make_password(password):
+    return submit(hashers.make_password, password)
+
+
+async def acheck_password(password, encoded):
+    return await asubmit(hashers.check_password, password, encoded)
+
+
+async def amake_password(password):
+    return await asubmit(hashers.make_password, password)
+
+
+def needs_upgrade(encoded):
+    """Устарел ли алгоритм или параметры хеша. Само хеширование не нужно."""
+    preferred = hashers.get_hasher("default")
+    try:
+        hasher = hashers.identify_hasher(encoded)
+    except ValueError:
+        return False
+    return (
+        hasher.algorithm != preferred.algorithm
+        or preferred.must_update(encoded)
+    )
+
+
+def upgrade_password(user_id, password, encoded):
+    """Перехеширование текущим профилем, если пароль не сменили."""
+    try:
+        new = make_password(password)
+    except HashingOverloaded:
+        # Хеш обновится при одном из следующих входов.
+        return False
+    updated = (
+        get_user_model()
+        .objects.filter(pk=user_id, password=encoded)
+        .update(password=new)
+    )
+    return bool(updated)
+
+
+def _run_upgrade(user_id, password, encoded, tenant):
+    # В фоновом потоке нет арендатора запроса, без него TenantRouter
+    # отправил бы пользователя выделенной базы в default.
+    try:
+        with use_tenant(tenant):
+            upgrade_password(user_id, password, encoded)
+    except Exception:
+        logger.exception("Password hash upgrade failed for user %s", user_id)
+    finally:
+        with _lock:
+            _upgrading.discard(user_id)
+        connections.close_all()
+
+
+def get_upgrader():
+    global _upgrader
+    if _upgrader is None:
+        with _lock:
+            if _upgrader is None:
+                _upgrader = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix="password-upgrade"
+                )
+    return _upgrader
+
+
+def upgrade_later(user, password):
+    """
+    Перехеширование после успешного входа в фоновом потоке, чтобы смена
+    профиля или его параметров не замедляла ответ на /login/.
+    """
+    if not needs_upgrade(user.password):
+        return False
+    with _lock:
+        if (
+            user.pk in _upgrading
+            or len(_upgrading) >= settings.PASSWORD_HASHING_MAX_QUEUE
+        ):
+            return False
+        _upgrading.add(user.pk)
+    get_upgrader().submit(
+        _run_upgrade, user.pk, password, user.password, user.tenant
+    )
+    return True
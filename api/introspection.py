@@ -0,0 +1,130 @@
+import hmac
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from rest_framework.permissions import BasePermission
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+
+from . import revocation
+from .authentication import access_token_cache
+from .blacklist import get_blacklist
+from .routers import replica_reads
+from .tenants import token_tenant, use_tenant
+from .tokens import UntypedToken
+
+User = get_user_model()
+
+INACTIVE = {"active": False}
+
+
+class HasIntrospectionSecret(BasePermission):
+    """Доступ по общему секрету шлюза в заголовке X-Introspection-Secret."""
+
+    def has_permission(self, request, view):
+        secret = settings.INTROSPECTION_SECRET
+        provided = request.headers.get("X-Introspection-Secret", "")
+        return bool(secret) and hmac.compare_digest(
+            provided.encode(), secret.encode()
+        )
+
+
+class Batch:
+    """
+    Пачка токенов на проверку. Подписи проверяются локально, а отзыв и
+    пользователи запрашиваются сразу для всей пачки.
+    """
+
+    def __init__(self, raw_tokens):
+        self.raw_tokens = raw_tokens
+        self.cached = {}
+        self.tokens = {}
+        for raw_token in raw_tokens:
+            # Access-токены, уже проверенные CachedJWTAuthentication.
+            entry = access_token_cache.get(raw_token)
+            if entry is not None:
+                self.cached[raw_token] = entry
+                continue
+            try:
+                self.tokens[raw_token] = UntypedToken(raw_token)
+            except TokenError:
+                pass
+
+    def revocable(self):
+        return [
+            token
+            for token in self.tokens.values()
+            if token.get(api_settings.TOKEN_TYPE_CLAIM) == "refresh"
+        ]
+
+    def user_ids(self):
+        """id пользователей по арендаторам: у каждого своя нумерация."""
+        grouped = {}
+        for token in self.tokens.values():
+            if api_settings.USER_ID_CLAIM in token:
+                grouped.setdefault(token_tenant(token), set()).add(
+                    token[api_settings.USER_ID_CLAIM]
+                )
+        return grouped
+
+    def describe(self, token, user):
+        if user is None or (
+            api_settings.CHECK_USER_IS_ACTIVE and not user.is_active
+        ):
+            return INACTIVE
+        return {
+            "active": True,
+            **token.payload,
+            "sub": str(user.pk),
+            "username": user.username,
+            "email": user.email,
+        }
+
+    def results(self, revoked, users):
+        results = []
+        for raw_token in self.raw_tokens:
+            if raw_token in self.cached:
+                user, token = self.cached[raw_token]
+                results.append(self.describe(token, user))
+                continue
+            token = self.tokens.get(raw_token)
+            if (
+                token is None
+                or token.get(api_settings.JTI_CLAIM) in revoked
+            ):
+                results.append(INACTIVE)
+                continue
+            user = users.get(
+                (token_tenant(token), token.get(api_settings.USER_ID_CLAIM))
+            )
+            if user is not None and not revocation.is_current(token, user):
+                user = None
+            results.append(self.describe(token, user))
+        return results
+
+
+def introspect(raw_tokens):
+    """Результаты в духе RFC 7662 в порядке переданных токенов."""
+    batch = Batch(raw_tokens)
+    revoked = get_blacklist().blacklisted_many(batch.revocable())
+    users = {}
+    for tenant, user_ids in batch.user_ids().items():
+        with use_tenant(tenant), replica_reads(user_ids=user_ids):
+            found = User.objects.in_bulk(
+                user_ids, field_name=api_settings.USER_ID_FIELD
+            )
+        users.update(((tenant, pk), user) for pk, user in found.items())
+    return batch.results(revoked, users)
+
+
+async def aintrospect(raw_tokens):
+    batch = Batch(raw_tokens)
+    revoked = await get_blacklist().ablacklisted_many(batch.revocable())
+    users = {}
+    for tenant, user_ids in batch.user_ids().items():
+        async with use_tenant(tenant), replica_reads(user_ids=user_ids):
+            found = await User.objects.ain_bulk(
+                user_ids, field_name=api_settings.USER_ID_FIELD
+            )
+        users.update(((tenant, pk), user) for pk, user in found.items())
+    return batch.results(revoked, users)
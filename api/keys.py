@@ -0,0 +1,265 @@
+import asyncio
+import hashlib
+import json
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+import jwt
+from asgiref.sync import sync_to_async
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+from django.conf import settings
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from jwt.algorithms import OKPAlgorithm, RSAAlgorithm
+from rest_framework_simplejwt.backends import TokenBackend
+from rest_framework_simplejwt.exceptions import TokenBackendError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.state import token_backend
+
+from . import metrics
+from .live_config import live_config
+from .models import SigningKey
+
+JWK_ALGORITHMS = {"RS256": RSAAlgorithm, "EdDSA": OKPAlgorithm}
+
+
+def generate_private_key(algorithm):
+    if algorithm == "RS256":
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    elif algorithm == "EdDSA":
+        key = ed25519.Ed25519PrivateKey.generate()
+    else:
+        raise ValueError(f"Unsupported signing algorithm {algorithm}")
+    return key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ).decode()
+
+
+def create_key(algorithm, activates_at):
+    return SigningKey.objects.create(
+        kid=uuid.uuid4().hex,
+        algorithm=algorithm,
+        private_key=generate_private_key(algorithm),
+        activates_at=activates_at,
+    )
+
+
+def rotate(algorithm):
+    """
+    Новый ключ публикуется в JWKS сразу, а подписывать начинает через
+    JWT_KEY_PUBLISH_AHEAD, когда кэши JWKS у потребителей уже обновятся.
+    Ключи, вытесненные раньше срока жизни refresh-токенов, удаляются.
+    """
+    now = timezone.now()
+    key = create_key(algorithm, now + settings.JWT_KEY_PUBLISH_AHEAD)
+    retired_before = now - timedelta(
+        days=live_config.get("REFRESH_TOKEN_LIFETIME")
+    )
+    successors = SigningKey.objects.filter(activates_at__lte=retired_before)
+    latest = successors.order_by("-activates_at").first()
+    deleted = 0
+    if latest is not None:
+        deleted, _ = SigningKey.objects.filter(
+            activates_at__lt=latest.activates_at
+        ).delete()
+    return key, deleted
+
+
+class LoadedKey:
+    __slots__ = ("kid", "algorithm", "activates_at", "private", "public")
+
+    def __init__(self, signing_key):
+        self.kid = signing_key.kid
+        self.algorithm = signing_key.algorithm
+        self.activates_at = signing_key.activates_at
+        self.private = serialization.load_pem_private_key(
+            signing_key.private_key.encode(), password=None
+        )
+        self.public = self.private.public_key()
+
+    def jwk(self):
+        jwk = JWK_ALGORITHMS[self.algorithm].to_jwk(self.public, as_dict=True)
+        jwk.update(kid=self.kid, alg=self.algorithm, use="sig")
+        return jwk
+
+
+def _in_event_loop():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+class Keyring:
+    """Ключи подписи из БД, закэшированные в памяти воркера."""
+
+    def __init__(self):
+        self._keys = {}
+        self._loaded_at = None
+        self._document = None
+        self._missed = False
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self._keys = {}
+            self._loaded_at = None
+            self._document = None
+            self._missed = False
+
+    def load(self):
+        now = timezone.now()
+        keys = {key.kid: LoadedKey(key) for key in SigningKey.objects.all()}
+        if not any(key.activates_at <= now for key in keys.values()):
+            key = create_key(settings.JWT_SIGNING_ALGORITHM, now)
+            keys[key.kid] = LoadedKey(key)
+        with self._lock:
+            self._keys = keys
+            self._loaded_at = time.monotonic()
+            self._document = None
+            self._missed = False
+
+    def expired(self):
+        if self._loaded_at is None:
+            return True
+        age = time.monotonic() - self._loaded_at
+        return age > settings.JWT_KEYRING_TTL or (self._missed and age > 1)
+
+    async def aload(self):
+        """
+        Загрузка перед async-вью: ORM нельзя вызывать из event loop, поэтому
+        внутри него keys и verifying_key БД не читают.
+        """
+        if self.expired():
+            await sync_to_async(self.load)()
+
+    def keys(self):
+        if self.expired() and not _in_event_loop():
+            self.load()
+        return self._keys
+
+    def signing_key(self):
+        keys = self.keys()
+        now = timezone.now()
+        active = [key for key in keys.values() if key.activates_at <= now]
+        return max(active, key=lambda key: key.activates_at)
+
+    def verifying_key(self, kid):
+        key = self.keys().get(kid)
+        # Неизвестный kid мог появиться после последней загрузки, но
+        # перечитываем БД не чаще раза в секунду.
+        if key is None and time.monotonic() - self._loaded_at > 1:
+            if _in_event_loop():
+                # Ключ подхватит aload следующего запроса.
+                self._missed = True
+            else:
+                self.load()
+                key = self._keys.get(kid)
+        return key
+
+    def jwks_document(self):
+        """Готовое тело JWKS и его ETag."""
+        keys = self.keys()
+        document = self._document
+        if document is None:
+            body = json.dumps(
+                {"keys": [key.jwk() for key in keys.values()]},
+                separators=(",", ":"),
+                sort_keys=True,
+            ).encode()
+            etag = '"%s"' % hashlib.sha256(body).hexdigest()[:32]
+            document = self._document = (body, etag)
+        return document
+
+
+keyring = Keyring()
+
+
+class KeyringTokenBackend(TokenBackend):
+    """TokenBackend, подписывающий активным ключом и выбирающий ключ по kid."""
+
+    def encode(self, payload):
+        key = keyring.signing_key()
+        jwt_payload = payload.copy()
+        if self.audience is not None:
+            jwt_payload["aud"] = self.audience
+        if self.issuer is not None:
+            jwt_payload["iss"] = self.issuer
+        return jwt.encode(
+            jwt_payload,
+            key.private,
+            algorithm=key.algorithm,
+            headers={"kid": key.kid},
+            json_encoder=self.json_encoder,
+        )
+
+    def decode(self, token, verify=True):
+        try:
+            kid = jwt.get_unverified_header(token).get("kid")
+        except jwt.InvalidTokenError as ex:
+            raise TokenBackendError(_("Token is invalid or expired")) from ex
+        key = keyring.verifying_key(kid) if verify else None
+        if verify and key is None:
+            raise TokenBackendError(_("Token is invalid or expired"))
+        try:
+            return jwt.decode(
+                token,
+                key.public if key else None,
+                algorithms=[key.algorithm if key else self.algorithm],
+                audience=self.audience,
+                issuer=self.issuer,
+                leeway=self.get_leeway(),
+                options={
+                    "verify_aud": self.audience is not None,
+                    "verify_signature": verify,
+                },
+            )
+        except jwt.InvalidTokenError as ex:
+            raise TokenBackendError(_("Token is invalid or expired")) from ex
+
+
+class TimedTokenBackend:
+    """Обёртка бэкенда, учитывающая encode/decode в метриках запроса."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    @metrics.timed("jwt")
+    def encode(self, payload):
+        return self.backend.encode(payload)
+
+    @metrics.timed("jwt")
+    def decode(self, token, verify=True):
+        return self.backend.decode(token, verify)
+
+
+_secret_backend = TimedTokenBackend(token_backend)
+_keyring_backend = None
+
+
+def get_token_backend():
+    """HS* подписываются SECRET_KEY как раньше, остальное через keyring."""
+    global _keyring_backend
+    algorithm = settings.JWT_SIGNING_ALGORITHM
+    if algorithm.startswith("HS"):
+        return _secret_backend
+    if _keyring_backend is None or _keyring_backend.algorithm != algorithm:
+        _keyring_backend = TimedTokenBackend(
+            KeyringTokenBackend(
+                algorithm,
+                audience=api_settings.AUDIENCE,
+                issuer=api_settings.ISSUER,
+                leeway=api_settings.LEEWAY,
+                json_encoder=api_settings.JSON_ENCODER,
+            )
+        )
+    return _keyring_backend
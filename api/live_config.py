@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import threading
+import time
+
+from constance import settings as constance_settings
+from constance.codecs import loads
+from django.conf import settings
+from redis.exceptions import RedisError
+
+from . import broadcast
+from .connections import get_async_redis, get_config_redis
+
+logger = logging.getLogger(__name__)
+
+UPDATED_CHANNEL = "auth:config-updated"
+
+
+class LiveConfig:
+    """
+    Значения CONSTANCE_CONFIG в памяти воркера. Обновляются одним MGET не
+    чаще раза в LIVE_CONFIG_TTL секунд или сразу после изменения в админке.
+    Если Redis недоступен или медлит, остаются последние известные значения.
+    """
+
+    def __init__(self):
+        self._values = {
+            name: options[0]
+            for name, options in settings.CONSTANCE_CONFIG.items()
+        }
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def _keys(self):
+        return [
+            f"{constance_settings.REDIS_PREFIX}{name}" for name in self._values
+        ]
+
+    def _is_fresh(self):
+        return (
+            self._loaded_at is not None
+            and time.monotonic() - self._loaded_at < settings.LIVE_CONFIG_TTL
+        )
+
+    def _store(self, raw_values):
+        for name, raw in zip(list(self._values), raw_values):
+            if raw:
+                self._values[name] = loads(raw)
+
+    def invalidate(self, message=None):
+        self._loaded_at = None
+
+    def refresh(self):
+        # Пока один поток обновляет значения, остальные не ждут его.
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._store(get_config_redis().mget(self._keys()))
+        except RedisError:
+            logger.warning("Using last known config, Redis unavailable")
+        finally:
+            self._loaded_at = time.monotonic()
+            self._lock.release()
+
+    async def arefresh(self):
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._store(
+                await asyncio.wait_for(
+                    get_async_redis().mget(self._keys()),
+                    settings.LIVE_CONFIG_TIMEOUT,
+                )
+            )
+        except (RedisError, asyncio.TimeoutError):
+            logger.warning("Using last known config, Redis unavailable")
+        finally:
+            self._loaded_at = time.monotonic()
+            self._lock.release()
+
+    def snapshot(self):
+        broadcast.start_listener()
+        if not self._is_fresh():
+            self.refresh()
+        return dict(self._values)
+
+    async def asnapshot(self):
+        broadcast.start_listener()
+        if not self._is_fresh():
+            await self.arefresh()
+        return dict(self._values)
+
+    def get(self, name):
+        return self.snapshot()[name]
+
+
+live_config = LiveConfig()
+
+broadcast.subscribe(UPDATED_CHANNEL, live_config.invalidate)
+
+
+def config_changed(key):
+    live_config.invalidate()
+    broadcast.publish(UPDATED_CHANNEL, key)
@@ -0,0 +1,218 @@
+import hashlib
+import logging
+import time
+
+from django.conf import settings
+from redis.exceptions import RedisError
+
+from . import broadcast
+from .cache import TTLCache
+from .connections import get_async_redis, get_redis, get_script
+from .live_config import live_config
+from .lookup import normalize_email
+from .tenants import scoped
+from .throttling import client_ip, normalize_ip
+
+logger = logging.getLogger(__name__)
+
+# KEYS — пары (счётчик неудач, блокировка), ARGV — окно сброса, первая и
+# наибольшая блокировка в мс, затем порог каждой пары.
+FAILED_LOGIN = """
+local reset = tonumber(ARGV[1])
+local base = tonumber(ARGV[2])
+local longest = tonumber(ARGV[3])
+local locks = {}
+for i = 1, #KEYS / 2 do
+    local threshold = tonumber(ARGV[i + 3])
+    local failures = redis.call("INCR", KEYS[i * 2 - 1])
+    local duration = 0
+    if failures >= threshold then
+        duration = math.floor(
+            math.min(base * 2 ^ (failures - threshold), longest)
+        )
+        redis.call("SET", KEYS[i * 2], 1, "PX", duration)
+    end
+    redis.call("PEXPIRE", KEYS[i * 2 - 1], reset + duration)
+    locks[i] = duration
+end
+return locks
+"""
+
+LOCKOUT_CHANNEL = "auth:lockout"
+
+SCOPES = (
+    ("LOCKOUT_ACCOUNT_THRESHOLD", "account"),
+    ("LOCKOUT_SOURCE_THRESHOLD", "source"),
+)
+
+# Срок каждой записи — конец блокировки, его задаёт set.
+local_locks = TTLCache(maxsize=settings.LOCKOUT_LOCAL_SIZE, ttl=0)
+
+
+def _on_unlocked(message):
+    if message is None:
+        local_locks.clear()
+    else:
+        local_locks.pop(message)
+
+
+broadcast.subscribe(LOCKOUT_CHANNEL, _on_unlocked)
+
+
+def _digest(value):
+    return hashlib.blake2b(value.encode(), digest_size=12).hexdigest()
+
+
+def _key(kind, ident):
+    return f"{settings.LOCKOUT_KEY_PREFIX}:{kind}:{ident}"
+
+
+def account_ident(email, tenant=None):
+    return _digest(scoped(tenant, normalize_email(email)))
+
+
+def source_ident(request):
+    return client_ip(request)
+
+
+def get_rules(request, email, values):
+    """Ключи счётчиков и пороги; нулевой порог отключает область."""
+    idents = {"account": account_ident(email), "source": source_ident(request)}
+    rules = []
+    for name, kind in SCOPES:
+        if values[name] and idents[kind]:
+            rules.append((_key(kind, idents[kind]), values[name]))
+    return rules
+
+
+def _local_wait(rules):
+    now = time.time()
+    return max(local_locks.get(key, now) - now for key, _ in rules)
+
+
+def _remember(rules, durations_ms):
+    """Блокировки в кэш воркера: следующие попытки не дойдут до Redis."""
+    now = time.time()
+    wait = 0
+    for (key, _), duration in zip(rules, durations_ms):
+        if duration > 0:
+            local_locks.set(key, now + duration / 1000, ttl=duration / 1000)
+            wait = max(wait, duration / 1000)
+    return wait
+
+
+def _script_args(rules, values):
+    keys = []
+    for key, _ in rules:
+        keys.extend((key, f"{key}:lock"))
+    args = [
+        values["LOCKOUT_RESET_SECONDS"] * 1000,
+        values["LOCKOUT_BASE_SECONDS"] * 1000,
+        values["LOCKOUT_MAX_SECONDS"] * 1000,
+        *(threshold for _, threshold in rules),
+    ]
+    return keys, args
+
+
+def check(request, email):
+    """
+    Секунды до конца блокировки аккаунта или источника, 0 — вход разрешён.
+    Проверка идёт до поиска пользователя и хеширования пароля.
+    """
+    broadcast.start_listener()
+    rules = get_rules(request, email, live_config.snapshot())
+    if not rules:
+        return 0
+    wait = _local_wait(rules)
+    if wait > 0:
+        return wait
+    pipe = get_redis().pipeline(transaction=False)
+    for key, _ in rules:
+        pipe.pttl(f"{key}:lock")
+    try:
+        return _remember(rules, pipe.execute())
+    except RedisError:
+        logger.warning("Lockout check skipped, Redis unavailable")
+        return 0
+
+
+async def acheck(request, email):
+    broadcast.start_listener()
+    rules = get_rules(request, email, await live_config.asnapshot())
+    if not rules:
+        return 0
+    wait = _local_wait(rules)
+    if wait > 0:
+        return wait
+    pipe = get_async_redis().pipeline(transaction=False)
+    for key, _ in rules:
+        pipe.pttl(f"{key}:lock")
+    try:
+        return _remember(rules, await pipe.execute())
+    except RedisError:
+        logger.warning("Lockout check skipped, Redis unavailable")
+        return 0
+
+
+def failed(request, email):
+    """
+    Неудачная попытка: после порога блокировка удваивается с каждой
+    следующей неудачей, но не дольше LOCKOUT_MAX_SECONDS.
+    """
+    values = live_config.snapshot()
+    rules = get_rules(request, email, values)
+    if not rules:
+        return 0
+    try:
+        durations = get_script(FAILED_LOGIN)(*_script_args(rules, values))
+    except RedisError:
+        logger.warning("Failed login not counted, Redis unavailable")
+        return 0
+    return _remember(rules, durations)
+
+
+async def afailed(request, email):
+    values = await live_config.asnapshot()
+    rules = get_rules(request, email, values)
+    if not rules:
+        return 0
+    keys, args = _script_args(rules, values)
+    try:
+        script = get_async_redis().register_script(FAILED_LOGIN)
+        durations = await script(keys=keys, args=args)
+    except RedisError:
+        logger.warning("Failed login not counted, Redis unavailable")
+        return 0
+    return _remember(rules, durations)
+
+
+def succeeded(email):
+    # Счётчик источника не сбрасывается: иначе удачный вход в свой
+    # аккаунт обнулял бы перебор чужих с того же адреса.
+    try:
+        get_redis().delete(_key("account", account_ident(email)))
+    except RedisError:
+        pass
+
+
+async def asucceeded(email):
+    try:
+        await get_async_redis().delete(_key("account", account_ident(email)))
+    except RedisError:
+        pass
+
+
+def unlock(email=None, ip=None, tenant=None):
+    """Снятие блокировки и счётчика неудач во всех воркерах."""
+    keys = []
+    if email:
+        keys.append(_key("account", account_ident(email, tenant)))
+    source = normalize_ip(ip) if ip else None
+    if source:
+        keys.append(_key("source", source))
+    if not keys:
+        return
+    get_redis().delete(*keys, *(f"{key}:lock" for key in keys))
+    for key in keys:
+        local_locks.pop(key)
+        broadcast.publish(LOCKOUT_CHANNEL, key)
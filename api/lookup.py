@@ -0,0 +1,178 @@
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db.models.functions import Lower
+from django.utils.crypto import get_random_string
+from redis.exceptions import RedisError
+
+from . import broadcast, hashing
+from .cache import TTLCache
+from .connections import get_async_redis, get_redis
+from .routers import replica_reads
+from .tenants import current_tenant, scoped
+
+REGISTERED_CHANNEL = "auth:email-registered"
+
+absent_emails = TTLCache(
+    maxsize=settings.LOGIN_NEGATIVE_CACHE_SIZE,
+    ttl=settings.LOGIN_NEGATIVE_CACHE_LOCAL_TTL,
+)
+
+_dummy_hash = None
+
+
+def normalize_email(email):
+    return email.strip().lower()
+
+
+def _redis_key(key):
+    digest = hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+    return f"login:absent:{digest}"
+
+
+def dummy_hash():
+    """Хеш той же стоимости, что и настоящие, для выравнивания времени."""
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = make_password(get_random_string(32))
+    return _dummy_hash
+
+
+def _users(email, tenant):
+    return (
+        get_user_model()
+        .objects.alias(email_lower=Lower("email"))
+        .filter(tenant=tenant, email_lower=email)
+        .order_by("pk")
+    )
+
+
+def email_taken(email, tenant=None):
+    return _users(normalize_email(email), tenant or current_tenant()).exists()
+
+
+def _on_registered(message):
+    if message is None:
+        absent_emails.clear()
+    else:
+        absent_emails.pop(message)
+
+
+def forget_absent(email, tenant=None):
+    """Вызывается при создании пользователя или смене его email."""
+    key = scoped(tenant, normalize_email(email))
+    absent_emails.pop(key)
+    try:
+        get_redis().delete(_redis_key(key))
+    except RedisError:
+        pass
+    broadcast.publish(REGISTERED_CHANNEL, key)
+
+
+def forget_absent_many(emails, tenant=None):
+    """forget_absent для пачки адресов за один запрос к Redis."""
+    keys = [scoped(tenant, normalize_email(email)) for email in emails]
+    if not keys:
+        return
+    for key in keys:
+        absent_emails.pop(key)
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.delete(*map(_redis_key, keys))
+        for key in keys:
+            pipe.publish(broadcast.channel_name(REGISTERED_CHANNEL), key)
+        pipe.execute()
+    except RedisError:
+        pass
+
+
+broadcast.subscribe(REGISTERED_CHANNEL, _on_registered)
+
+
+def find_user(email):
+    """
+    Поиск пользователя текущего арендатора по email с кэшем заведомо
+    отсутствующих адресов.
+    """
+    email = normalize_email(email)
+    tenant = current_tenant()
+    key = scoped(tenant, email)
+    broadcast.start_listener()
+    if absent_emails.get(key):
+        return None
+    client = get_redis()
+    try:
+        if client.exists(_redis_key(key)):
+            absent_emails.set(key, True)
+            return None
+    except RedisError:
+        pass
+    with replica_reads(emails=[email]):
+        user = _users(email, tenant).first()
+    if user is None:
+        absent_emails.set(key, True)
+        try:
+            client.set(
+                _redis_key(key), 1, ex=settings.LOGIN_NEGATIVE_CACHE_TTL
+            )
+        except RedisError:
+            pass
+    return user
+
+
+async def afind_user(email):
+    email = normalize_email(email)
+    tenant = current_tenant()
+    key = scoped(tenant, email)
+    broadcast.start_listener()
+    if absent_emails.get(key):
+        return None
+    client = get_async_redis()
+    try:
+        if await client.exists(_redis_key(key)):
+            absent_emails.set(key, True)
+            return None
+    except RedisError:
+        pass
+    async with replica_reads(emails=[email]):
+        user = await _users(email, tenant).afirst()
+    if user is None:
+        absent_emails.set(key, True)
+        try:
+            await client.set(
+                _redis_key(key), 1, ex=settings.LOGIN_NEGATIVE_CACHE_TTL
+            )
+        except RedisError:
+            pass
+    return user
+
+
+def can_authenticate(user):
+    """Как ModelBackend.user_can_authenticate: неактивные не входят."""
+    return user is not None and getattr(user, "is_active", True)
+
+
+def authenticate(email, password):
+    """
+    Проверка учётных данных. Для несуществующего email тоже считается
+    хеш, а неактивному пользователю пароль проверяется как обычно, поэтому
+    время ответа не выдаёт ни наличие аккаунта, ни его состояние.
+    """
+    user = find_user(email)
+    encoded = user.password if user else dummy_hash()
+    if hashing.check_password(password, encoded) and can_authenticate(user):
+        hashing.upgrade_later(user, password)
+        return user
+    return None
+
+
+async def aauthenticate(email, password):
+    user = await afind_user(email)
+    encoded = user.password if user else dummy_hash()
+    valid = await hashing.acheck_password(password, encoded)
+    if valid and can_authenticate(user):
+        hashing.upgrade_later(user, password)
+        return user
+    return None
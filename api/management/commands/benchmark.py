@@ -0,0 +1,200 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from api import benchmarks
+
+MANAGE_PY = Path(__file__).resolve().parents[3] / "manage.py"
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs micro benchmarks of token, hashing and serializer code and "
+        "load scenarios against a local server, reporting p50/p95/p99 and "
+        "throughput, optionally compared with a stored baseline"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--mode", choices=("micro", "macro", "all"), default="all"
+        )
+        parser.add_argument(
+            "--only",
+            nargs="+",
+            help="Names of micro benchmarks or load scenarios to run",
+        )
+        parser.add_argument("--iterations", type=int, default=500)
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=50,
+            help="Requests per concurrent client in each scenario",
+        )
+        parser.add_argument(
+            "--url",
+            help=(
+                "Server to load; by default runserver is started locally "
+                "on a throwaway database"
+            ),
+        )
+        parser.add_argument(
+            "--allow-live-server",
+            action="store_true",
+            help=(
+                "Confirm --url: bench users are created in the configured "
+                "database and the server keeps its throttles"
+            ),
+        )
+        parser.add_argument(
+            "--redis-db",
+            type=int,
+            default=settings.BENCHMARK_REDIS_DB,
+            help="Empty Redis database for the local server, flushed after",
+        )
+        parser.add_argument("--output", help="Write results as JSON")
+        parser.add_argument("--baseline", help="Baseline JSON to compare")
+        parser.add_argument(
+            "--save-baseline",
+            action="store_true",
+            help="Store results in the baseline file instead of comparing",
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.2,
+            help="Allowed p95 growth and throughput drop, as a fraction",
+        )
+
+    def handle(self, *args, **options):
+        results = {"micro": {}, "macro": {}}
+        if options["mode"] in ("micro", "all"):
+            results["micro"] = benchmarks.run_micro(
+                options["iterations"], options["only"]
+            )
+        if options["mode"] in ("macro", "all"):
+            results["macro"] = self.load(options)
+        self.report(results)
+        if options["output"]:
+            Path(options["output"]).write_text(json.dumps(results, indent=2))
+        if options["baseline"]:
+            self.check_baseline(results, options)
+
+    def load(self, options):
+        url = options["url"]
+        if url:
+            if not options["allow_live_server"]:
+                raise CommandError(
+                    "--url writes bench users to the configured database, "
+                    "pass --allow-live-server to confirm"
+                )
+            return self.run_scenarios(url, options)
+        try:
+            redis_db = benchmarks.throwaway_redis(options["redis_db"])
+            with redis_db, benchmarks.throwaway_database() as database:
+                server = self.start_server(database)
+                try:
+                    return self.run_scenarios(server.url, options)
+                finally:
+                    server.terminate()
+                    server.wait()
+        except ValueError as exc:
+            raise CommandError(f"{exc}, pass another --redis-db")
+
+    def run_scenarios(self, url, options):
+        return benchmarks.run_macro(
+            url,
+            options["concurrency"],
+            options["requests"],
+            options["only"],
+        )
+
+    def start_server(self, database):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        # Лимиты выключаются только у этого процесса, общий constance
+        # и другие воркеры не затрагиваются. Redis — та же отдельная база,
+        # что у throwaway_redis в этом процессе.
+        env = {
+            **os.environ,
+            "ALLOWED_HOSTS": "127.0.0.1",
+            "BENCHMARK_DATABASE_NAME": database,
+            "BENCHMARK_REDIS_DB": str(
+                settings.CONSTANCE_REDIS_CONNECTION["db"]
+            ),
+            "BROADCAST_CHANNEL_PREFIX": benchmarks.BENCH_CHANNEL_PREFIX,
+            "DATABASE_REPLICA_URLS": "",
+            "TENANT_DATABASE_URLS": "",
+            "THROTTLE_ENABLED": "false",
+        }
+        server = subprocess.Popen(
+            [
+                sys.executable,
+                str(MANAGE_PY),
+                "runserver",
+                f"127.0.0.1:{port}",
+                "--noreload",
+            ],
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        server.url = f"http://127.0.0.1:{port}"
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                urllib.request.urlopen(server.url + "/.well-known/jwks.json")
+                return server
+            except urllib.error.HTTPError:
+                return server
+            except OSError:
+                time.sleep(0.2)
+        server.terminate()
+        raise CommandError("Benchmark server did not start")
+
+    def report(self, results):
+        self.stdout.write(f"Database: {connection.vendor}")
+        for kind, rows in results.items():
+            for name, stats in rows.items():
+                line = (
+                    f"{kind:5} {name:18} p50 {stats['p50_ms']:>9} ms  "
+                    f"p95 {stats['p95_ms']:>9} ms  "
+                    f"p99 {stats['p99_ms']:>9} ms  "
+                    f"{stats['per_second']:>9}/s"
+                )
+                if stats.get("errors"):
+                    line += f"  {stats['errors']} errors"
+                self.stdout.write(line)
+
+    def check_baseline(self, results, options):
+        # Базовые прогоны хранятся отдельно для каждой СУБД.
+        path = Path(options["baseline"])
+        stored = json.loads(path.read_text()) if path.exists() else {}
+        if options["save_baseline"]:
+            stored[connection.vendor] = results
+            path.write_text(json.dumps(stored, indent=2))
+            self.stdout.write(self.style.SUCCESS(f"Baseline saved to {path}"))
+            return
+        baseline = stored.get(connection.vendor)
+        if not baseline:
+            raise CommandError(
+                f"No {connection.vendor} baseline in {path}, "
+                "run with --save-baseline first"
+            )
+        regressions = benchmarks.compare(
+            results, baseline, options["tolerance"]
+        )
+        if regressions:
+            raise CommandError("Regressions:\n" + "\n".join(regressions))
+        self.stdout.write(self.style.SUCCESS("No regressions"))
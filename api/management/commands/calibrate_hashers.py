@@ -0,0 +1,97 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.core.management.base import BaseCommand
+from django.utils.crypto import get_random_string
+
+# Нижняя граница памяти argon2id по рекомендациям OWASP, KiB.
+ARGON2_MIN_MEMORY_COST = 19_456
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures password hashing time on this machine and recommends "
+        "hasher parameters for the target login latency"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--target-ms",
+            type=float,
+            default=250,
+            help="Desired time of one hash on one core",
+        )
+        parser.add_argument("--rounds", type=int, default=5)
+
+    def measure(self, hasher, rounds, **params):
+        password = get_random_string(16)
+        salt = hasher.salt()
+        timings = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            hasher.encode(password, salt, **params)
+            timings.append(time.perf_counter() - started)
+        return statistics.median(timings) * 1000
+
+    def report(self, name, current_ms, recommendation, expected_ms):
+        workers = settings.PASSWORD_HASHING_WORKERS or 1
+        self.stdout.write(f"{name}: {current_ms:.0f} ms per hash now")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"  {recommendation} (~{expected_ms:.0f} ms, "
+                f"~{workers * 1000 / expected_ms:.0f} logins/s "
+                f"with PASSWORD_HASHING_WORKERS={workers})"
+            )
+        )
+
+    def calibrate_pbkdf2(self, target_ms, rounds):
+        iterations = settings.PASSWORD_PBKDF2_ITERATIONS
+        current_ms = self.measure(
+            hashers.PBKDF2PasswordHasher(), rounds, iterations=iterations
+        )
+        recommended = max(1000, round(iterations * target_ms / current_ms, -3))
+        self.report(
+            "pbkdf2",
+            current_ms,
+            f"PASSWORD_PBKDF2_ITERATIONS={recommended:.0f}",
+            current_ms * recommended / iterations,
+        )
+
+    def calibrate_argon2(self, target_ms, rounds):
+        hasher = hashers.Argon2PasswordHasher()
+        try:
+            hasher._load_library()
+        except ValueError:
+            self.stdout.write("argon2: skipped, argon2-cffi is not installed")
+            return
+        hasher.time_cost = settings.PASSWORD_ARGON2_TIME_COST
+        hasher.memory_cost = settings.PASSWORD_ARGON2_MEMORY_COST
+        hasher.parallelism = settings.PASSWORD_ARGON2_PARALLELISM
+        current_ms = self.measure(hasher, rounds)
+        # Время argon2 растёт линейно и по проходам, и по памяти.
+        per_pass = current_ms / hasher.time_cost
+        time_cost = max(1, int(target_ms // per_pass))
+        memory_cost = hasher.memory_cost
+        if per_pass > target_ms:
+            memory_cost = max(
+                ARGON2_MIN_MEMORY_COST,
+                int(memory_cost * target_ms / per_pass),
+            )
+        expected_ms = per_pass * time_cost * memory_cost / hasher.memory_cost
+        self.report(
+            "argon2",
+            current_ms,
+            f"PASSWORD_ARGON2_TIME_COST={time_cost} "
+            f"PASSWORD_ARGON2_MEMORY_COST={memory_cost}",
+            expected_ms,
+        )
+
+    def handle(self, *args, **options):
+        self.calibrate_pbkdf2(options["target_ms"], options["rounds"])
+        self.calibrate_argon2(options["target_ms"], options["rounds"])
+        self.stdout.write(
+            f"Active profile: {settings.PASSWORD_HASHER_PROFILE}. Existing "
+            "hashes are upgraded in the background on the next login."
+        )
@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api import schema
+
+
+class Command(BaseCommand):
+    help = (
+        "Writes the OpenAPI schema as openapi.json and openapi.yaml so "
+        "workers serve it without generating it on startup"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--output-dir",
+            help="Directory for the files, OPENAPI_SCHEMA_DIR by default",
+        )
+
+    def handle(self, *args, **options):
+        directory = options["output_dir"] or settings.OPENAPI_SCHEMA_DIR
+        if not directory:
+            raise CommandError("Set OPENAPI_SCHEMA_DIR or pass --output-dir")
+        for path in schema.write(directory):
+            self.stdout.write(self.style.SUCCESS(f"Wrote {path}"))
@@ -0,0 +1,57 @@
+import json
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.bulk import FORMATS, UserImporter, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Creates users from a CSV or JSONL file in batches and reports "
+        "the result of every row"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Input file, or - for stdin")
+        parser.add_argument(
+            "--format",
+            choices=FORMATS,
+            help="Input format, guessed from the file extension by default",
+        )
+        parser.add_argument("--chunk-size", type=int)
+        parser.add_argument(
+            "--report",
+            help="Write a JSONL report line for every row to this file",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or os.path.splitext(path)[1].lstrip(".")
+        if fmt not in FORMATS:
+            raise CommandError("Pass --format csv or --format jsonl")
+        importer = UserImporter(options["chunk_size"])
+        source = (
+            sys.stdin
+            if path == "-"
+            else open(path, newline="", encoding="utf-8-sig")
+        )
+        report = open(options["report"], "w") if options["report"] else None
+        try:
+            for line in importer.run(read_rows(source, fmt)):
+                if report:
+                    report.write(json.dumps(line) + "\n")
+                elif line["status"] == "error":
+                    self.stdout.write(json.dumps(line))
+        finally:
+            if source is not sys.stdin:
+                source.close()
+            if report:
+                report.close()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Created {importer.created} users, "
+                f"{importer.failed} rows failed."
+            )
+        )
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from rest_framework_simplejwt.utils import aware_utcnow
+
+from api.blacklist import get_blacklist
+
+
+class Command(BaseCommand):
+    help = (
+        "Copies unexpired blacklisted tokens from the token_blacklist tables "
+        "into the configured blacklist backend"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        backend = get_blacklist()
+        if not hasattr(backend, "revoke_many"):
+            raise CommandError(
+                f"{type(backend).__name__} does not support bulk revocation"
+            )
+        rows = (
+            BlacklistedToken.objects.filter(
+                token__expires_at__gt=aware_utcnow()
+            )
+            .order_by("pk")
+            .values_list("token__jti", "token__expires_at")
+        )
+        batch, total = [], 0
+        for jti, expires_at in rows.iterator(chunk_size=options["batch_size"]):
+            batch.append((jti, int(expires_at.timestamp())))
+            if len(batch) >= options["batch_size"]:
+                backend.revoke_many(batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            backend.revoke_many(batch)
+            total += len(batch)
+        self.stdout.write(self.style.SUCCESS(f"Migrated {total} tokens."))
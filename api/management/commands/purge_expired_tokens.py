@@ -0,0 +1,72 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.purge import ExpiredTokenPurger
+
+# Наименьшие допустимые значения числовых параметров.
+MINIMUMS = (
+    ("batch_size", 1),
+    ("pause", 0),
+    ("max_batches", 1),
+    ("report_every", 1),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes expired rows from the token_blacklist tables in small "
+        "batches, resuming where an interrupted run stopped"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int)
+        parser.add_argument(
+            "--pause",
+            type=float,
+            help="Seconds to sleep between batches",
+        )
+        parser.add_argument("--max-batches", type=int)
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Ignore the saved cursor and start from the first row",
+        )
+        parser.add_argument(
+            "--report-every",
+            type=int,
+            default=10,
+            help="Print progress every N batches",
+        )
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep running, one pass every TOKEN_PURGE_INTERVAL seconds",
+        )
+
+    def handle(self, *args, **options):
+        for name, minimum in MINIMUMS:
+            if options[name] is not None and options[name] < minimum:
+                option = name.replace("_", "-")
+                raise CommandError(f"--{option} must be at least {minimum}")
+        purger = ExpiredTokenPurger(options["batch_size"], options["pause"])
+        while True:
+            self.purge(purger, options)
+            if not options["loop"]:
+                return
+            time.sleep(settings.TOKEN_PURGE_INTERVAL)
+
+    def purge(self, purger, options):
+        for progress in purger.run(options["max_batches"], options["restart"]):
+            if progress.batches % options["report_every"] == 0:
+                self.stdout.write(self.format(progress))
+        self.stdout.write(self.style.SUCCESS(self.format(purger.progress)))
+
+    def format(self, progress):
+        stats = progress.as_dict()
+        return (
+            "Deleted {outstanding} outstanding and {blacklisted} "
+            "blacklisted tokens in {batches} batches "
+            "({rate}/s, cursor {cursor}).".format(**stats)
+        )
@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api.keys import rotate
+from api.models import SigningKey
+
+
+class Command(BaseCommand):
+    help = (
+        "Creates the next JWT signing key and removes keys that can no "
+        "longer verify any issued token"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--if-due",
+            action="store_true",
+            help="Rotate only when JWT_KEY_ROTATION_INTERVAL has passed",
+        )
+
+    def handle(self, *args, **options):
+        algorithm = settings.JWT_SIGNING_ALGORITHM
+        if algorithm.startswith("HS"):
+            raise CommandError(f"{algorithm} tokens are signed by SECRET_KEY")
+        latest = SigningKey.objects.order_by("-activates_at").first()
+        if (
+            options["if_due"]
+            and latest is not None
+            and latest.activates_at
+            > timezone.now() - settings.JWT_KEY_ROTATION_INTERVAL
+        ):
+            self.stdout.write("Rotation is not due yet.")
+            return
+        key, deleted = rotate(algorithm)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Created key {key.kid} active from {key.activates_at:%c}, "
+                f"removed {deleted} retired keys."
+            )
+        )
@@ -0,0 +1,94 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+# То же, что делает воркер gunicorn до первого запроса.
+STARTUP = """
+import django
+from django.core.wsgi import get_wsgi_application
+from django.urls import get_resolver
+
+django.setup()
+get_wsgi_application()
+get_resolver().url_patterns
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures cold start of a worker process in a fresh interpreter "
+        "and lists the packages whose imports cost the most"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=5)
+        parser.add_argument("--top", type=int, default=15)
+        parser.add_argument(
+            "--api-only",
+            action="store_true",
+            help="Measure with API_ONLY=true",
+        )
+        parser.add_argument("--output", help="Write results as JSON")
+
+    def start(self, env):
+        started = time.perf_counter()
+        process = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", STARTUP],
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        elapsed = time.perf_counter() - started
+        if process.returncode:
+            raise CommandError(process.stderr.strip().splitlines()[-1])
+        return elapsed, process.stderr
+
+    def packages(self, importtime):
+        """Суммарное время импортов верхнего уровня по пакетам, мс."""
+        totals = defaultdict(float)
+        for line in importtime.splitlines():
+            if not line.startswith("import time:"):
+                continue
+            _, cumulative, name = line[len("import time:"):].split("|")
+            if name.startswith("  ") or not cumulative.strip().isdigit():
+                continue
+            package = name.strip().split(".")[0]
+            totals[package] += int(cumulative) / 1000
+        return dict(sorted(totals.items(), key=lambda item: -item[1]))
+
+    def handle(self, *args, **options):
+        env = dict(os.environ)
+        if options["api_only"]:
+            env["API_ONLY"] = "true"
+        runs = [self.start(env) for _ in range(options["runs"])]
+        startup_ms = statistics.median(elapsed for elapsed, _ in runs) * 1000
+        packages = self.packages(runs[-1][1])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Startup: {startup_ms:.0f} ms (median of "
+                f"{options['runs']}, API_ONLY={env.get('API_ONLY', 'false')})"
+            )
+        )
+        for package, ms in list(packages.items())[: options["top"]]:
+            self.stdout.write(f"  {package:28} {ms:8.1f} ms")
+        if options["output"]:
+            Path(options["output"]).write_text(
+                json.dumps(
+                    {
+                        "startup_ms": round(startup_ms, 1),
+                        "api_only": options["api_only"],
+                        "imports_ms": {
+                            package: round(ms, 1)
+                            for package, ms in packages.items()
+                        },
+                    },
+                    indent=2,
+                )
+            )
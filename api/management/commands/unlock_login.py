@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import lockout
+from api.throttling import normalize_ip
+
+
+class Command(BaseCommand):
+    help = (
+        "Lifts a login lockout and resets the failed attempt count for an "
+        "account or a client IP"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--email")
+        parser.add_argument("--ip")
+        parser.add_argument("--tenant")
+
+    def handle(self, *args, **options):
+        if not options["email"] and not options["ip"]:
+            raise CommandError("Pass --email, --ip or both")
+        if options["ip"] and not normalize_ip(options["ip"]):
+            raise CommandError(f"{options['ip']} is not an IP address")
+        lockout.unlock(options["email"], options["ip"], options["tenant"])
+        self.stdout.write(self.style.SUCCESS("Lockout lifted."))
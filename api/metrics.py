@@ -0,0 +1,182 @@
+import contextvars
+import functools
+import os
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter,
+                               Histogram, generate_latest, multiprocess)
+from prometheus_client.registry import REGISTRY
+
+PHASES = ("hashing", "jwt", "db", "redis")
+
+REQUEST_DURATION = Histogram(
+    "auth_request_duration_seconds",
+    "Request latency by endpoint",
+    ["endpoint", "method", "status"],
+)
+PHASE_DURATION = Histogram(
+    "auth_phase_duration_seconds",
+    "Time spent per request in password hashing, JWT, DB and Redis",
+    ["endpoint", "phase"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0),
+)
+DB_QUERIES = Counter(
+    "auth_db_queries", "Database queries by endpoint", ["endpoint"]
+)
+AUDIT_EVENTS = Counter(
+    "auth_audit_events", "Audit events by outcome", ["outcome"]
+)
+
+_current = contextvars.ContextVar("auth_request_timings", default=None)
+
+
+class Timings:
+    """Накопленное время фаз одного запроса."""
+
+    __slots__ = ("phases", "queries")
+
+    def __init__(self):
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.queries = 0
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+
+def record(phase, seconds):
+    """Добавление времени фазы к текущему запросу, если он есть."""
+    timings = _current.get()
+    if timings is not None:
+        timings.add(phase, seconds)
+
+
+class timed:
+    """
+    Учёт времени фазы в текущем запросе. Работает как контекстный
+    менеджер и как декоратор синхронных и асинхронных функций.
+    Вне запроса ничего не записывает.
+    """
+
+    def __init__(self, phase):
+        self.phase = phase
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.phase, time.perf_counter() - self.started)
+        return False
+
+    def __call__(self, func):
+        phase = self.phase
+        if iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    record(phase, time.perf_counter() - started)
+
+        else:
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    record(phase, time.perf_counter() - started)
+
+        return wrapper
+
+
+def query_wrapper(execute, sql, params, many, context):
+    """execute_wrapper для всех подключений к БД, см. ApiConfig.ready."""
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.add("db", time.perf_counter() - started)
+        timings.queries += 1
+
+
+def install_query_wrapper(sender, connection, **kwargs):
+    if query_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_wrapper)
+
+
+def endpoint_name(request):
+    match = getattr(request, "resolver_match", None)
+    return match.url_name or match.view_name if match else "unmatched"
+
+
+def observe(request, response, timings, started):
+    endpoint = endpoint_name(request)
+    REQUEST_DURATION.labels(
+        endpoint, request.method, response.status_code
+    ).observe(time.perf_counter() - started)
+    for phase, seconds in timings.phases.items():
+        PHASE_DURATION.labels(endpoint, phase).observe(seconds)
+    if timings.queries:
+        DB_QUERIES.labels(endpoint).inc(timings.queries)
+
+
+class MetricsMiddleware:
+    """Гистограммы длительности запросов и их фаз для /metrics."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        timings = Timings()
+        token = _current.set(timings)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        observe(request, response, timings, started)
+        return response
+
+    async def __acall__(self, request):
+        timings = Timings()
+        token = _current.set(timings)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        observe(request, response, timings, started)
+        return response
+
+
+def get_registry():
+    """
+    Под gunicorn с PROMETHEUS_MULTIPROC_DIR метрики всех воркеров
+    собираются из файлов в этом каталоге.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def render():
+    return generate_latest(get_registry()), CONTENT_TYPE_LATEST
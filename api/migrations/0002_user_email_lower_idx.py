@@ -0,0 +1,21 @@
+# Generated by Django 4.2.18 on 2026-10-18 11:23
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="user",
+            index=models.Index(
+                django.db.models.functions.text.Lower("email"),
+                name="api_user_email_lower_idx",
+            ),
+        ),
+    ]
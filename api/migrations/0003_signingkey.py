@@ -0,0 +1,35 @@
+# Generated by Django 4.2.18 on 2026-10-18 11:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0002_user_email_lower_idx"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SigningKey",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("kid", models.CharField(max_length=64, unique=True)),
+                ("algorithm", models.CharField(max_length=16)),
+                ("private_key", models.TextField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("activates_at", models.DateTimeField()),
+            ],
+            options={
+                "ordering": ["activates_at"],
+            },
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 4.2.18 on 2026-10-18 12:11
+
+import django.db.models.functions.text
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import Lower
+
+
+def check_email_case_duplicates(apps, schema_editor):
+    """
+    До уникального индекса по lower(email): адреса, различающиеся только
+    регистром, нужно объединить вручную, иначе индекс не создастся.
+    """
+    User = apps.get_model("api", "User")
+    duplicates = list(
+        User.objects.using(schema_editor.connection.alias)
+        .values(email_lower=Lower("email"))
+        .annotate(count=Count("id"))
+        .filter(count__gt=1)
+        .values_list("email_lower", flat=True)[:20]
+    )
+    if duplicates:
+        raise RuntimeError(
+            "Users whose emails differ only by case must be merged or "
+            "renamed before this migration (see README, Tenants): "
+            + ", ".join(duplicates)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0004_user_token_version"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            check_email_case_duplicates, migrations.RunPython.noop
+        ),
+        migrations.RemoveIndex(
+            model_name="user",
+            name="api_user_email_lower_idx",
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="tenant",
+            field=models.CharField(default="default", max_length=63),
+        ),
+        migrations.AlterField(
+            model_name="user",
+            name="email",
+            field=models.EmailField(max_length=254),
+        ),
+        migrations.AlterField(
+            model_name="user",
+            name="username",
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name="user",
+            constraint=models.UniqueConstraint(
+                models.F("tenant"),
+                django.db.models.functions.text.Lower("email"),
+                name="api_user_tenant_email_uniq",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="user",
+            constraint=models.UniqueConstraint(
+                fields=("tenant", "username"), name="api_user_tenant_username_uniq"
+            ),
+        ),
+    ]
@@ -0,0 +1,46 @@
+from django.db import migrations
+
+# Индексы для поиска в админке: btree по началу строки и GIN-триграммы
+# по подстроке. Выражение UPPER(...::text) совпадает с тем, что Django
+# строит для istartswith и icontains, иначе индекс не используется.
+INDEXES = {
+    "api_user_email_prefix_idx": (
+        "btree (UPPER(email::text) text_pattern_ops)"
+    ),
+    "api_user_username_prefix_idx": (
+        "btree (UPPER(username::text) text_pattern_ops)"
+    ),
+    "api_user_email_trgm_idx": "gin (UPPER(email::text) gin_trgm_ops)",
+    "api_user_username_trgm_idx": "gin (UPPER(username::text) gin_trgm_ops)",
+}
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for name, definition in INDEXES.items():
+        schema_editor.execute(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} "
+            f"ON api_user USING {definition}"
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name in INDEXES:
+        schema_editor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY не выполняется внутри транзакции.
+    atomic = False
+
+    dependencies = [
+        ("api", "0005_user_tenant"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
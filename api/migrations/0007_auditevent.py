@@ -0,0 +1,32 @@
+# Generated by Django 4.2.18 on 2026-10-18 12:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0006_user_search_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AuditEvent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(db_index=True)),
+                ("event", models.CharField(max_length=32)),
+                ("user_id", models.BigIntegerField(null=True)),
+                ("tenant", models.CharField(max_length=63)),
+                ("ip", models.GenericIPAddressField(null=True)),
+            ],
+        ),
+    ]
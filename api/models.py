@@ -1,5 +1,10 @@
+from django.conf import settings
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager
 from django.db import models
+from django.db.models.functions import Lower
+
+from . import hashing
+from .tenants import current_tenant
 
 
 class CustomUserManager(BaseUserManager):
@@ -8,11 +13,25 @@ class CustomUserManager(BaseUserManager):
         if not email:
             raise ValueError("The Email field must be set")
         email = self.normalize_email(email)
+        extra_fields.setdefault("tenant", current_tenant())
         user = self.model(email=email, username=username, **extra_fields)
-        user.set_password(password)
+        user.password = hashing.make_password(password)
         user.save(using=self._db)
         return user
 
+    async def acreate_user(
+        self, email, password=None, username=None, **extra_fields
+    ):
+        """Асинхронное создание пользователя."""
+        if not email:
+            raise ValueError("The Email field must be set")
+        email = self.normalize_email(email)
+        extra_fields.setdefault("tenant", current_tenant())
+        user = self.model(email=email, username=username, **extra_fields)
+        user.password = await hashing.amake_password(password)
+        await user.asave(using=self._db)
+        return user
+
     def create_superuser(
         self, email, password=None, username=None, **extra_fields
     ):
@@ -21,22 +40,45 @@ class CustomUserManager(BaseUserManager):
         extra_fields.setdefault("is_superuser", True)
         return self.create_user(email, password, username, **extra_fields)
 
+    def get_by_natural_key(self, email):
+        """Email уникален только внутри арендатора."""
+        return self.get(tenant=current_tenant(), email=email)
+
 
 class User(AbstractBaseUser):
-    email = models.EmailField(unique=True)
-    username = models.CharField(
-        max_length=255, unique=True, blank=True, null=True
-    )
+    tenant = models.CharField(max_length=63, default=settings.DEFAULT_TENANT)
+    email = models.EmailField()
+    username = models.CharField(max_length=255, blank=True, null=True)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
     is_superuser = models.BooleanField(default=False)
+    # Поколение токенов: увеличение отзывает все выпущенные токены.
+    token_version = models.PositiveIntegerField(default=0)
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = []
     objects = CustomUserManager()
 
+    class Meta:
+        # Вход ищет пользователя по арендатору и email без учёта регистра.
+        constraints = [
+            models.UniqueConstraint(
+                "tenant", Lower("email"), name="api_user_tenant_email_uniq"
+            ),
+            models.UniqueConstraint(
+                fields=["tenant", "username"],
+                name="api_user_tenant_username_uniq",
+            ),
+        ]
+
     def __str__(self):
         return self.email
 
+    def set_password(self, raw_password):
+        """Смена пароля завершает все сессии пользователя."""
+        super().set_password(raw_password)
+        if self.pk is not None:
+            self.token_version += 1
+
     def has_perm(self, perm, obj=None):
         """Пользователь всегда имеет разрешения, если он суперпользователь."""
         return self.is_superuser
@@ -47,3 +89,31 @@ class User(AbstractBaseUser):
         если он суперпользователь.
         """
         return self.is_superuser
+
+
+class SigningKey(models.Model):
+    kid = models.CharField(max_length=64, unique=True)
+    algorithm = models.CharField(max_length=16)
+    private_key = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    activates_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ["activates_at"]
+
+    def __str__(self):
+        return f"{self.algorithm} {self.kid}"
+
+
+class AuditEvent(models.Model):
+    """Событие входа, обновления токенов или профиля, см. api.audit."""
+
+    created_at = models.DateTimeField(db_index=True)
+    event = models.CharField(max_length=32)
+    # Без внешнего ключа: пользователь может жить в базе арендатора.
+    user_id = models.BigIntegerField(null=True)
+    tenant = models.CharField(max_length=63)
+    ip = models.GenericIPAddressField(null=True)
+
+    def __str__(self):
+        return f"{self.event} {self.user_id}"
@@ -0,0 +1,101 @@
+import logging
+import time
+
+from django.conf import settings
+from redis.exceptions import RedisError
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+from rest_framework_simplejwt.utils import aware_utcnow
+
+from .connections import get_redis
+
+logger = logging.getLogger(__name__)
+
+CURSOR_KEY = "purge:outstanding-tokens:cursor"
+
+
+class Progress:
+    """Счётчики одного прохода очистки."""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.batches = 0
+        self.outstanding = 0
+        self.blacklisted = 0
+        self.started = time.monotonic()
+
+    @property
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return self.outstanding / elapsed if elapsed else 0.0
+
+    def as_dict(self):
+        return {
+            "cursor": self.cursor,
+            "batches": self.batches,
+            "outstanding": self.outstanding,
+            "blacklisted": self.blacklisted,
+            "rate": round(self.rate, 1),
+        }
+
+
+class ExpiredTokenPurger:
+    """
+    Удаление истёкших строк token_blacklist короткими пачками по первичному
+    ключу. Курсор сохраняется в Redis после каждой пачки, поэтому прерванный
+    проход продолжается с того же места, а полный проход его сбрасывает.
+    """
+
+    def __init__(self, batch_size=None, pause=None):
+        self.batch_size = batch_size or settings.TOKEN_PURGE_BATCH_SIZE
+        self.pause = settings.TOKEN_PURGE_PAUSE if pause is None else pause
+        self.progress = None
+
+    def load_cursor(self):
+        try:
+            return int(get_redis().get(CURSOR_KEY) or 0)
+        except RedisError:
+            return 0
+
+    def save_cursor(self, cursor):
+        try:
+            if cursor:
+                get_redis().set(CURSOR_KEY, cursor)
+            else:
+                get_redis().delete(CURSOR_KEY)
+        except RedisError:
+            logger.warning("Could not save purge cursor %s", cursor)
+
+    def purge_batch(self, progress, now):
+        pks = list(
+            OutstandingToken.objects.filter(
+                pk__gt=progress.cursor, expires_at__lt=now
+            )
+            .order_by("pk")
+            .values_list("pk", flat=True)[: self.batch_size]
+        )
+        if not pks:
+            return False
+        # BlacklistedToken удаляется каскадом одним DELETE ... IN.
+        _, deleted = OutstandingToken.objects.filter(pk__in=pks).delete()
+        progress.outstanding += deleted.get(OutstandingToken._meta.label, 0)
+        progress.blacklisted += deleted.get(
+            "token_blacklist.BlacklistedToken", 0
+        )
+        progress.batches += 1
+        progress.cursor = pks[-1]
+        self.save_cursor(progress.cursor)
+        return True
+
+    def run(self, max_batches=None, restart=False):
+        """Проход по таблице; после каждой пачки отдаёт Progress."""
+        progress = self.progress = Progress(
+            0 if restart else self.load_cursor()
+        )
+        now = aware_utcnow()
+        while max_batches is None or progress.batches < max_batches:
+            if not self.purge_batch(progress, now):
+                self.save_cursor(0)
+                return
+            yield progress
+            if self.pause:
+                time.sleep(self.pause)
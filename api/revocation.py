@@ -0,0 +1,189 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import F
+from django.utils.translation import gettext_lazy as _
+from redis.exceptions import RedisError
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+
+from . import broadcast
+from .cache import TTLCache
+from .connections import get_async_redis, get_redis
+from .routers import mark_written
+from .tenants import current_tenant, scoped, token_tenant, use_tenant
+
+VERSION_CLAIM = "ver"
+
+VERSION_CHANNEL = "auth:token-version"
+
+User = get_user_model()
+
+local_versions = TTLCache(
+    maxsize=settings.TOKEN_VERSION_CACHE_SIZE,
+    ttl=settings.TOKEN_VERSION_CACHE_TTL,
+)
+
+
+def _redis_key(key):
+    return f"token-version:{key}"
+
+
+def _on_version_changed(message):
+    if message is None:
+        local_versions.clear()
+    else:
+        local_versions.pop(message)
+
+
+broadcast.subscribe(VERSION_CHANNEL, _on_version_changed)
+
+
+def token_version(token):
+    """Поколение, с которым выпущен токен; у старых токенов его нет."""
+    return token.get(VERSION_CLAIM, 0)
+
+
+def is_current(token, user):
+    return token_version(token) == user.token_version
+
+
+def _stored_version(user_id, tenant=None):
+    with use_tenant(tenant or current_tenant()):
+        version = (
+            User.objects.filter(pk=user_id)
+            .values_list("token_version", flat=True)
+            .first()
+        )
+    return version or 0
+
+
+def current_version(user_id, tenant=None):
+    """
+    Текущее поколение токенов пользователя: кэш процесса, затем Redis,
+    затем БД. Изменение рассылается всем воркерам через broadcast.
+    id пользователей уникальны только внутри арендатора.
+    """
+    broadcast.start_listener()
+    key = scoped(tenant, user_id)
+    version = local_versions.get(key)
+    if version is not None:
+        return version
+    client = get_redis()
+    try:
+        version = client.get(_redis_key(key))
+    except RedisError:
+        version = None
+    if version is None:
+        version = _stored_version(user_id, tenant)
+        try:
+            client.set(
+                _redis_key(key),
+                version,
+                ex=settings.TOKEN_VERSION_REDIS_TTL,
+                nx=True,
+            )
+        except RedisError:
+            pass
+    version = int(version)
+    local_versions.set(key, version)
+    return version
+
+
+async def acurrent_version(user_id, tenant=None):
+    broadcast.start_listener()
+    key = scoped(tenant, user_id)
+    version = local_versions.get(key)
+    if version is not None:
+        return version
+    client = get_async_redis()
+    try:
+        version = await client.get(_redis_key(key))
+    except RedisError:
+        version = None
+    if version is None:
+        async with use_tenant(tenant or current_tenant()):
+            version = (
+                await User.objects.filter(pk=user_id)
+                .values_list("token_version", flat=True)
+                .afirst()
+            ) or 0
+        try:
+            await client.set(
+                _redis_key(key),
+                version,
+                ex=settings.TOKEN_VERSION_REDIS_TTL,
+                nx=True,
+            )
+        except RedisError:
+            pass
+    version = int(version)
+    local_versions.set(key, version)
+    return version
+
+
+def check(token, version):
+    if token_version(token) != version:
+        raise TokenError(_("Token has been revoked"))
+
+
+def check_refresh(token):
+    user_id = token[api_settings.USER_ID_CLAIM]
+    check(token, current_version(user_id, token_tenant(token)))
+
+
+async def acheck_refresh(token):
+    user_id = token[api_settings.USER_ID_CLAIM]
+    check(token, await acurrent_version(user_id, token_tenant(token)))
+
+
+def prime(user, pipe):
+    """
+    Поколение только что прочитанного пользователя, если в Redis его ещё
+    нет: первая ротация непрозрачного токена тогда обходится без БД.
+    """
+    pipe.set(
+        _redis_key(scoped(user.tenant, user.pk)),
+        user.token_version,
+        ex=settings.TOKEN_VERSION_REDIS_TTL,
+        nx=True,
+    )
+
+
+def remember_version(user_id, version, tenant=None):
+    """Новое поколение после изменения в БД, для всех воркеров."""
+    key = scoped(tenant, user_id)
+    local_versions.set(key, version)
+    try:
+        get_redis().set(
+            _redis_key(key), version, ex=settings.TOKEN_VERSION_REDIS_TTL
+        )
+    except RedisError:
+        pass
+    broadcast.publish(VERSION_CHANNEL, key)
+
+
+def forget_version(user_id, tenant=None):
+    """Удалённый пользователь: его id может достаться новому."""
+    key = scoped(tenant, user_id)
+    local_versions.pop(key)
+    try:
+        get_redis().delete(_redis_key(key))
+    except RedisError:
+        pass
+    broadcast.publish(VERSION_CHANNEL, key)
+
+
+def revoke_all(user_id, tenant=None):
+    """
+    Выход на всех устройствах: одно увеличение счётчика делает
+    недействительными все выпущенные токены пользователя.
+    """
+    from .authentication import invalidate_user
+
+    with use_tenant(tenant or current_tenant()):
+        User.objects.filter(pk=user_id).update(
+            token_version=F("token_version") + 1
+        )
+    mark_written(user_ids=[user_id])
+    remember_version(user_id, _stored_version(user_id, tenant), tenant)
+    invalidate_user(user_id)
@@ -0,0 +1,132 @@
+import contextvars
+import random
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from redis.exceptions import RedisError
+
+from .connections import get_async_redis, get_redis
+from .tenants import current_tenant, database_for
+
+WRITTEN_KEY_PREFIX = "db:written"
+
+_replica = contextvars.ContextVar("db_replica", default=None)
+
+
+def get_replicas():
+    primaries = {DEFAULT_DB_ALIAS, *settings.TENANT_DATABASES.values()}
+    return [alias for alias in settings.DATABASES if alias not in primaries]
+
+
+def _written_keys(user_ids, emails):
+    return [f"{WRITTEN_KEY_PREFIX}:user:{pk}" for pk in user_ids] + [
+        f"{WRITTEN_KEY_PREFIX}:email:{email.lower()}" for email in emails
+    ]
+
+
+def mark_written(user_ids=(), emails=()):
+    """
+    Пользователи, изменённые за последние DATABASE_REPLICA_LAG секунд,
+    читаются только с основной базы, пока реплики их не догнали.
+    """
+    keys = _written_keys(user_ids, emails)
+    if not keys or not get_replicas():
+        return
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for key in keys:
+            pipe.set(key, 1, ex=settings.DATABASE_REPLICA_LAG)
+        pipe.execute()
+    except RedisError:
+        pass
+
+
+class replica_reads:
+    """
+    Чтения внутри блока уходят на случайную реплику, если они настроены,
+    нет открытой транзакции и никто из перечисленных пользователей не
+    изменялся недавно. Поддерживает with и async with.
+    """
+
+    def __init__(self, user_ids=(), emails=()):
+        self.keys = _written_keys(user_ids, emails)
+        self.token = None
+
+    def choose(self, written):
+        replicas = get_replicas()
+        if not replicas or written:
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return random.choice(replicas)
+
+    def __enter__(self):
+        written = False
+        if self.keys and get_replicas():
+            try:
+                written = get_redis().exists(*self.keys)
+            except RedisError:
+                written = True
+        self.token = _replica.set(self.choose(written))
+        return self
+
+    async def __aenter__(self):
+        written = False
+        if self.keys and get_replicas():
+            try:
+                written = await get_async_redis().exists(*self.keys)
+            except RedisError:
+                written = True
+        self.token = _replica.set(self.choose(written))
+        return self
+
+    def __exit__(self, *exc_info):
+        _replica.reset(self.token)
+        return False
+
+    async def __aexit__(self, *exc_info):
+        return self.__exit__(*exc_info)
+
+
+class TenantRouter:
+    """
+    Пользователи арендаторов из TENANT_DATABASES читаются и пишутся в их
+    собственную базу; для остальных решает следующий роутер.
+    """
+
+    def route(self, model, hints):
+        if model._meta.label != settings.AUTH_USER_MODEL:
+            return None
+        tenant = getattr(hints.get("instance"), "tenant", None)
+        alias = database_for(tenant or current_tenant())
+        return None if alias == DEFAULT_DB_ALIAS else alias
+
+    def db_for_read(self, model, **hints):
+        return self.route(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self.route(model, hints)
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.TENANT_DATABASES.values():
+            return True
+        return None
+
+
+class PrimaryReplicaRouter:
+    """
+    Записи и все чтения по умолчанию идут в default; на реплики попадают
+    только чтения внутри replica_reads.
+    """
+
+    def db_for_read(self, model, **hints):
+        return _replica.get() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -0,0 +1,117 @@
+import gzip
+import hashlib
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+from drf_yasg import openapi
+from drf_yasg.codecs import OpenAPICodecJson, OpenAPICodecYaml
+from drf_yasg.generators import OpenAPISchemaGenerator
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+INFO = openapi.Info(
+    title="Authentication API",
+    default_version="v1",
+    description="API documentation",
+    contact=openapi.Contact(email="karpova.el.m@gmail.com"),
+)
+
+CODECS = {".json": OpenAPICodecJson, ".yaml": OpenAPICodecYaml}
+
+
+def quality(params):
+    """q из параметров кодировки; без q — 1, нечитаемое значение — 0."""
+    for param in params.split(";"):
+        name, _, value = param.partition("=")
+        if name.strip() == "q":
+            try:
+                return float(value)
+            except ValueError:
+                return 0
+    return 1
+
+
+def generate():
+    """Схема всех публичных эндпоинтов, без привязки к запросу."""
+    schema = OpenAPISchemaGenerator(INFO).get_schema(request=None, public=True)
+    return {
+        fmt: codec(validators=[]).encode(schema)
+        for fmt, codec in CODECS.items()
+    }
+
+
+def stored_path(fmt):
+    return Path(settings.OPENAPI_SCHEMA_DIR) / f"openapi{fmt}"
+
+
+def write(directory=None):
+    """Сохранение схемы для загрузки воркерами без генерации."""
+    directory = Path(directory or settings.OPENAPI_SCHEMA_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for fmt, body in generate().items():
+        path = directory / f"openapi{fmt}"
+        path.write_bytes(body)
+        paths.append(path)
+    return paths
+
+
+class Document:
+    """Тело схемы в одном формате вместе со сжатыми вариантами и ETag."""
+
+    def __init__(self, body, content_type):
+        self.content_type = content_type
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.variants = {None: (body, f'"{digest}"')}
+        self.variants["gzip"] = (
+            gzip.compress(body, mtime=0),
+            f'"{digest}-gzip"',
+        )
+        if brotli is not None:
+            self.variants["br"] = (brotli.compress(body), f'"{digest}-br"')
+
+    def negotiate(self, accept_encoding):
+        """
+        Кодировка, тело и ETag лучшего варианта для Accept-Encoding: с
+        наибольшим q, при равном — br, gzip, без сжатия. q=0 запрещает
+        кодировку.
+        """
+        weights = {}
+        for part in accept_encoding.lower().split(","):
+            coding, _, params = part.partition(";")
+            weights[coding.strip()] = quality(params)
+        candidates = [
+            (weights.get(encoding, weights.get("*", 0)), encoding)
+            for encoding in ("br", "gzip")
+            if encoding in self.variants
+        ]
+        # Без сжатия можно всегда, если его не запретили, но не в ущерб
+        # кодировкам из заголовка: 0.001 — наименьший ненулевой q.
+        identity = weights.get("identity", weights.get("*", 0.001))
+        candidates.append((identity, None))
+        weight, encoding = max(candidates, key=lambda candidate: candidate[0])
+        if weight <= 0:
+            encoding = None
+        return (encoding, *self.variants[encoding])
+
+
+@lru_cache(maxsize=None)
+def get_documents():
+    """
+    Схема, заранее сохранённая командой generate_schema, или, если файлов
+    нет, сгенерированная один раз на процесс.
+    """
+    if settings.OPENAPI_SCHEMA_DIR and all(
+        stored_path(fmt).exists() for fmt in CODECS
+    ):
+        bodies = {fmt: stored_path(fmt).read_bytes() for fmt in CODECS}
+    else:
+        bodies = generate()
+    return {
+        ".json": Document(bodies[".json"], "application/json"),
+        ".yaml": Document(bodies[".yaml"], "application/yaml"),
+    }
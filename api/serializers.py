@@ -1,7 +1,12 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import identify_hasher
 from rest_framework import serializers, status
 from rest_framework.response import Response
 
+from . import lookup
+from .tenants import current_tenant
+
 User = get_user_model()
 
 
@@ -27,7 +32,13 @@ class RegisterSerializer(serializers.ModelSerializer):
 
     def validate_username(self, value):
         if not value:
-            return self.initial_data.get("email")
+            value = self.initial_data.get("email")
+        if User.objects.filter(
+            tenant=current_tenant(), username=value
+        ).exists():
+            raise serializers.ValidationError(
+                "user with this username already exists."
+            )
         return value
 
     def validate_email(self, value):
@@ -35,6 +46,11 @@ class RegisterSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 {"email": "This field is required."}
             )
+        # Уникальность в паре с арендатором, DRF сам её не проверит.
+        if lookup.email_taken(value):
+            raise serializers.ValidationError(
+                "user with this email already exists."
+            )
         return value
 
     def to_representation(self, instance):
@@ -48,6 +64,31 @@ class LoginSerializer(serializers.Serializer):
     password = serializers.CharField(write_only=True)
 
 
+class BulkUserSerializer(serializers.Serializer):
+    email = serializers.EmailField()
+    username = serializers.CharField(
+        max_length=255, required=False, allow_blank=True
+    )
+    password = serializers.CharField(required=False)
+    password_hash = serializers.CharField(required=False)
+
+    def validate_password_hash(self, value):
+        try:
+            identify_hasher(value)
+        except ValueError:
+            raise serializers.ValidationError(
+                "Unsupported password hash format."
+            )
+        return value
+
+    def validate(self, attrs):
+        if ("password" in attrs) == ("password_hash" in attrs):
+            raise serializers.ValidationError(
+                "Provide either password or password_hash."
+            )
+        return attrs
+
+
 class TokenRefreshSerializer(serializers.Serializer):
     refresh_token = serializers.CharField()
 
@@ -56,6 +97,23 @@ class LogoutSerializer(serializers.Serializer):
     refresh_token = serializers.CharField()
 
 
+class IntrospectionSerializer(serializers.Serializer):
+    token = serializers.CharField(required=False)
+    tokens = serializers.ListField(
+        child=serializers.CharField(),
+        required=False,
+        allow_empty=False,
+        max_length=settings.INTROSPECTION_BATCH_SIZE,
+    )
+
+    def validate(self, attrs):
+        if ("token" in attrs) == ("tokens" in attrs):
+            raise serializers.ValidationError(
+                "Provide either token or tokens."
+            )
+        return attrs
+
+
 class UserDetailSerializer(serializers.ModelSerializer):
 
     def get(self, request):
@@ -71,3 +129,34 @@ class UserDetailSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ["id", "email", "username"]
+
+    # Уникальность в пределах арендатора: ограничения модели составные,
+    # и DRF не строит для них валидаторы полей.
+    def validate_email(self, value):
+        own = lookup.normalize_email(self.instance.email)
+        if lookup.normalize_email(value) != own and lookup.email_taken(
+            value, self.instance.tenant
+        ):
+            raise serializers.ValidationError(
+                "user with this email already exists."
+            )
+        return value
+
+    def validate_username(self, value):
+        if (
+            User.objects.filter(tenant=self.instance.tenant, username=value)
+            .exclude(pk=self.instance.pk)
+            .exists()
+        ):
+            raise serializers.ValidationError(
+                "user with this username already exists."
+            )
+        return value
+
+
+def user_payload(user):
+    """То же, что UserDetailSerializer(user).data, без сборки полей."""
+    return {
+        field: getattr(user, field)
+        for field in UserDetailSerializer.Meta.fields
+    }
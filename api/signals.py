@@ -0,0 +1,48 @@
+from constance.signals import config_updated
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .authentication import invalidate_user
+from .live_config import config_changed
+from .lookup import forget_absent
+from .revocation import forget_version, remember_version
+from .routers import mark_written
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+
+
+@receiver(post_save, sender=User)
+def forget_absent_email(sender, instance, **kwargs):
+    forget_absent(instance.email, instance.tenant)
+
+
+@receiver(post_save, sender=User)
+def publish_token_version(sender, instance, created, update_fields, **kwargs):
+    if created or (update_fields and "token_version" not in update_fields):
+        return
+    remember_version(instance.pk, instance.token_version, instance.tenant)
+
+
+@receiver(post_delete, sender=User)
+def forget_token_version(sender, instance, **kwargs):
+    forget_version(instance.pk, instance.tenant)
+
+
+@receiver(post_save, sender=User)
+def pin_to_primary(sender, instance, update_fields=None, **kwargs):
+    # Обновление last_login при входе не должно уводить чтения с реплик.
+    if update_fields and set(update_fields) == {"last_login"}:
+        return
+    mark_written(user_ids=[instance.pk], emails=[instance.email])
+
+
+@receiver(config_updated)
+def publish_config_update(sender, key, **kwargs):
+    config_changed(key)
@@ -0,0 +1,113 @@
+import contextvars
+import re
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.http import JsonResponse
+
+TENANT_CLAIM = "tid"
+
+TENANT_PATTERN = re.compile(r"^[a-z0-9][a-z0-9-]{0,62}$")
+
+_tenant = contextvars.ContextVar("tenant", default=None)
+
+
+def current_tenant():
+    return _tenant.get() or settings.DEFAULT_TENANT
+
+
+def activate(tenant):
+    """
+    Арендатор до конца запроса: аутентифицированный запрос работает в
+    арендаторе токена, а не заголовка. Сбрасывает TenantMiddleware.
+    """
+    _tenant.set(tenant)
+
+
+def database_for(tenant):
+    """Отдельная база крупного арендатора или default для остальных."""
+    return settings.TENANT_DATABASES.get(tenant, DEFAULT_DB_ALIAS)
+
+
+def scoped(tenant, key):
+    """Ключ кэша, различающий одинаковые email и id разных арендаторов."""
+    return f"{tenant or current_tenant()}:{key}"
+
+
+def token_tenant(token):
+    # У токенов, выпущенных до появления арендаторов, claim нет.
+    return token.get(TENANT_CLAIM) or settings.DEFAULT_TENANT
+
+
+def from_request(request):
+    tenant = request.headers.get(settings.TENANT_HEADER)
+    if not tenant:
+        return settings.DEFAULT_TENANT
+    tenant = tenant.strip().lower()
+    if not TENANT_PATTERN.match(tenant):
+        raise ValueError(tenant)
+    return tenant
+
+
+class use_tenant:
+    """Запросы к пользователям внутри блока идут в базу арендатора."""
+
+    def __init__(self, tenant):
+        self.tenant = tenant
+        self.token = None
+
+    def __enter__(self):
+        self.token = _tenant.set(self.tenant)
+        return self
+
+    def __exit__(self, *exc_info):
+        _tenant.reset(self.token)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, *exc_info):
+        return self.__exit__(*exc_info)
+
+
+class TenantMiddleware:
+    """Арендатор анонимного запроса из заголовка TENANT_HEADER."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    @staticmethod
+    def invalid():
+        return JsonResponse({"error": "Invalid tenant"}, status=400)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        try:
+            tenant = from_request(request)
+        except ValueError:
+            return self.invalid()
+        token = _tenant.set(tenant)
+        try:
+            return self.get_response(request)
+        finally:
+            _tenant.reset(token)
+
+    async def __acall__(self, request):
+        try:
+            tenant = from_request(request)
+        except ValueError:
+            return self.invalid()
+        token = _tenant.set(tenant)
+        try:
+            return await self.get_response(request)
+        finally:
+            _tenant.reset(token)
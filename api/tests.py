@@ -1,14 +1,83 @@
+import contextvars
+import gzip
+import json
+import multiprocessing
+import tempfile
 from datetime import timedelta
+from io import StringIO
+from pathlib import Path
 from time import sleep
+from unittest import mock
 
+import jwt
+import redis
+from constance.test import override_config
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import (AsyncRequestFactory, RequestFactory, SimpleTestCase,
+                         TestCase, TransactionTestCase, override_settings)
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from prometheus_client import REGISTRY
+from redis.exceptions import RedisError
 from rest_framework import status
 from rest_framework.test import APITestCase
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.token_blacklist.models import (BlacklistedToken,
+                                                             OutstandingToken)
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from . import (audit, benchmarks, hashing, lockout, lookup, purge, renderers,
+               revocation, schema, throttling, tokens)
+from .admin import CustomUserAdmin
+from .async_views import (AsyncLoginView, AsyncLogoutView,
+                          AsyncRegisterAPIView, AsyncTokenRefreshView,
+                          AsyncUserDetailView)
+from .authentication import access_token_cache
+from .blacklist import BloomFilter, RedisBlacklist, get_blacklist
+from .connections import get_redis
+from .keys import keyring
+from .live_config import live_config
+from .management.commands import benchmark as benchmark_command
+from .models import AuditEvent, SigningKey
+from .routers import (PrimaryReplicaRouter, TenantRouter, mark_written,
+                      replica_reads)
+from .tenants import use_tenant
+from .tokens import RefreshToken as BlacklistRefreshToken
 
 User = get_user_model()
 
 
+def reset_throttles():
+    throttling.local_buckets.clear()
+    keys = list(get_redis().scan_iter(match="throttle:*"))
+    if keys:
+        get_redis().delete(*keys)
+
+
+def reset_token_versions():
+    revocation.local_versions.clear()
+    keys = list(get_redis().scan_iter(match="token-version:*"))
+    if keys:
+        get_redis().delete(*keys)
+
+
+def reset_lockouts():
+    lockout.local_locks.clear()
+    keys = list(get_redis().scan_iter(match="lockout:*"))
+    if keys:
+        get_redis().delete(*keys)
+
+
+def setUpModule():
+    reset_throttles()
+    reset_lockouts()
+
+
 class UserAPITest(APITestCase):
 
     def setUp(self):
@@ -139,3 +208,1624 @@ class UserAPITest(APITestCase):
             self.me_url, HTTP_AUTHORIZATION=f"Bearer {access_token}"
         )
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class TokenBlacklistTest(APITestCase):
+
+    def setUp(self):
+        self.refresh_url = "/api/refresh/"
+        self.logout_url = "/api/logout/"
+        self.user = User.objects.create_user(
+            email="blacklist@example.com", password="password123"
+        )
+
+    def test_bloom_filter_membership(self):
+        bloom = BloomFilter(capacity=100, error_rate=0.01)
+        bloom.add("revoked")
+        restored = BloomFilter(100, 0.01, bytes(bloom.bits).rstrip(b"\0"))
+        self.assertIn("revoked", restored)
+        self.assertNotIn("active", restored)
+
+    def test_workers_receive_revocations_from_log(self):
+        worker, other = RedisBlacklist(), RedisBlacklist()
+        first = BlacklistRefreshToken.for_user(self.user)
+        second = BlacklistRefreshToken.for_user(self.user)
+        for token in (first, second):
+            token["iat"] -= 60
+        self.assertFalse(worker.is_blacklisted(first))
+        other.blacklist(first)
+        # Отзыв старого токена другим воркером виден после синхронизации.
+        self.assertFalse(worker.is_blacklisted(first))
+        worker._synced_at -= worker.refresh_interval
+        self.assertTrue(worker.is_blacklisted(first))
+        other.blacklist(second)
+        worker._synced_at -= worker.refresh_interval
+        # Между полными загрузками читаются только новые записи журнала.
+        with mock.patch.object(get_redis(), "scan_iter") as scan_iter:
+            self.assertTrue(worker.is_blacklisted(second))
+        scan_iter.assert_not_called()
+
+    def test_fresh_token_revoked_elsewhere_is_seen_at_once(self):
+        worker, other = RedisBlacklist(), RedisBlacklist()
+        token = BlacklistRefreshToken.for_user(self.user)
+        self.assertFalse(worker.is_blacklisted(token))
+        other.blacklist(token)
+        self.assertTrue(worker.is_blacklisted(token))
+
+    @override_settings(REFRESH_COALESCE_WINDOW=0)
+    def test_refresh_rotates_and_revokes_previous_token(self):
+        refresh = str(BlacklistRefreshToken.for_user(self.user))
+        response = self.client.post(
+            self.refresh_url, {"refresh_token": refresh}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response.data["refresh_token"], refresh)
+        response = self.client.post(
+            self.refresh_url, {"refresh_token": refresh}
+        )
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_duplicate_refresh_returns_same_pair(self):
+        refresh = str(BlacklistRefreshToken.for_user(self.user))
+        first = self.client.post(self.refresh_url, {"refresh_token": refresh})
+        retry = self.client.post(self.refresh_url, {"refresh_token": refresh})
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry.json(), first.json())
+        response = self.client.post(
+            self.refresh_url, {"refresh_token": first.json()["refresh_token"]}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_refresh_survives_failed_coalescing_write(self):
+        refresh = str(BlacklistRefreshToken.for_user(self.user))
+        client = get_redis()
+        real_set = client.set
+
+        def set_pair(key, value, **options):
+            # Метка ожидания ставится, а сохранить пару Redis не даёт.
+            if options.get("nx"):
+                return real_set(key, value, **options)
+            raise RedisError("down")
+
+        with mock.patch.object(client, "set", side_effect=set_pair):
+            response = self.client.post(
+                self.refresh_url, {"refresh_token": refresh}
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response.json()["refresh_token"], refresh)
+        client.delete(tokens._coalesce_key(refresh))
+
+    def test_verified_payload_is_memoized(self):
+        refresh = str(BlacklistRefreshToken.for_user(self.user))
+        tokens.verified_payloads.clear()
+        backend = tokens.get_token_backend()
+        with mock.patch.object(
+            backend, "decode", wraps=backend.decode
+        ) as decode:
+            BlacklistRefreshToken(refresh)
+            token = BlacklistRefreshToken(refresh)
+        decode.assert_called_once()
+        token.rotate()
+        with self.assertRaises(TokenError):
+            BlacklistRefreshToken(refresh)
+
+    def test_logged_out_token_cannot_refresh(self):
+        refresh = str(BlacklistRefreshToken.for_user(self.user))
+        self.client.post(self.logout_url, {"refresh_token": refresh})
+        response = self.client.post(
+            self.refresh_url, {"refresh_token": refresh}
+        )
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_migrate_blacklist_command(self):
+        token = RefreshToken.for_user(self.user)
+        BlacklistedToken.objects.create(
+            token=OutstandingToken.objects.get(jti=token["jti"])
+        )
+        migrated = BlacklistRefreshToken(str(token), verify=False)
+        self.assertFalse(get_blacklist().is_blacklisted(migrated))
+        call_command("migrate_blacklist", stdout=StringIO())
+        self.assertTrue(get_blacklist().is_blacklisted(migrated))
+
+
+class AccessTokenCacheTest(APITestCase):
+
+    def setUp(self):
+        self.me_url = "/api/me/"
+        self.user = User.objects.create_user(
+            email="cache@example.com", password="password123"
+        )
+        access_token = BlacklistRefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {access_token}")
+        access_token_cache.clear()
+
+    def test_repeat_request_skips_database(self):
+        self.client.get(self.me_url)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.me_url)
+        self.assertEqual(response.data["email"], self.user.email)
+
+    def test_update_invalidates_cached_user(self):
+        self.client.get(self.me_url)
+        self.client.put(self.me_url, {"username": "Cached"})
+        response = self.client.get(self.me_url)
+        self.assertEqual(response.data["username"], "Cached")
+
+    def test_update_rejects_names_taken_in_tenant(self):
+        User.objects.create_user(
+            email="other@example.com", password="x", username="Taken"
+        )
+        response = self.client.put(
+            self.me_url, {"username": "Taken"}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("username", response.json())
+        response = self.client.put(
+            self.me_url, {"email": "OTHER@example.com"}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("email", response.json())
+        response = self.client.put(
+            self.me_url, {"email": "CACHE@example.com"}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_deactivated_user_is_rejected(self):
+        self.client.get(self.me_url)
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get(self.me_url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+def _hold_hashing_slot(started, release):
+    with hashing._slot():
+        started.set()
+        release.wait(5)
+
+
+class PasswordHashingTest(APITestCase):
+
+    def setUp(self):
+        self.login_url = "/api/login/"
+        self.credentials = {
+            "email": "hashing@example.com",
+            "password": "password123",
+        }
+        User.objects.create_user(**self.credentials)
+        hashing.stats.reset()
+
+    def test_login_records_hashing_metrics(self):
+        response = self.client.post(self.login_url, self.credentials)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        snapshot = hashing.stats.snapshot()
+        self.assertEqual(snapshot["hash_time"]["count"], 1)
+        self.assertEqual(snapshot["pending"], 0)
+
+    @override_settings(
+        PASSWORD_HASHING_WORKERS=0, PASSWORD_HASHING_MAX_QUEUE=0
+    )
+    def test_full_queue_returns_service_unavailable(self):
+        response = self.client.post(self.login_url, self.credentials)
+        self.assertEqual(
+            response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+        self.assertEqual(response["Retry-After"], "1")
+        self.assertEqual(hashing.stats.snapshot()["rejected"], 1)
+
+    @override_settings(
+        PASSWORD_HASHING_HOST_WORKERS=1, PASSWORD_HASHING_MAX_QUEUE=1
+    )
+    def test_host_queue_is_shared_by_workers(self):
+        # Два воркера gunicorn на том же хосте держат по месту в очереди.
+        context = multiprocessing.get_context("fork")
+        started = [context.Event() for _ in range(2)]
+        release = context.Event()
+        workers = [
+            context.Process(target=_hold_hashing_slot, args=(event, release))
+            for event in started
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            for event in started:
+                self.assertTrue(event.wait(5))
+            response = self.client.post(self.login_url, self.credentials)
+        finally:
+            release.set()
+            for worker in workers:
+                worker.join(5)
+        self.assertEqual(
+            response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+        self.assertEqual(response["Retry-After"], "1")
+        self.assertEqual(hashing.stats.snapshot()["pending"], 0)
+        response = self.client.post(self.login_url, self.credentials)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class AsyncViewsTest(TestCase):
+
+    def setUp(self):
+        self.factory = AsyncRequestFactory()
+        self.credentials = {
+            "email": "async@example.com",
+            "password": "password123",
+        }
+        self.user = User.objects.create_user(**self.credentials)
+
+    async def call(self, view, method, data=None, headers=None):
+        request = getattr(self.factory, method)(
+            "/", data, content_type="application/json", headers=headers
+        )
+        response = await view.as_view()(request)
+        return response.status_code, json.loads(response.content)
+
+    async def test_register(self):
+        code, data = await self.call(
+            AsyncRegisterAPIView,
+            "post",
+            {"email": "async2@example.com", "password": "password"},
+        )
+        self.assertEqual(code, status.HTTP_201_CREATED)
+        self.assertEqual(data["email"], "async2@example.com")
+        user = await User.objects.aget(email="async2@example.com")
+        self.assertTrue(user.check_password("password"))
+
+    async def test_login_refresh_logout(self):
+        code, tokens = await self.call(
+            AsyncLoginView, "post", self.credentials
+        )
+        self.assertEqual(code, status.HTTP_200_OK)
+        code, rotated = await self.call(
+            AsyncTokenRefreshView,
+            "post",
+            {"refresh_token": tokens["refresh_token"]},
+        )
+        self.assertEqual(code, status.HTTP_200_OK)
+        code, data = await self.call(
+            AsyncLogoutView,
+            "post",
+            {"refresh_token": rotated["refresh_token"]},
+        )
+        self.assertEqual(data["success"], "User logged out.")
+        code, data = await self.call(
+            AsyncTokenRefreshView,
+            "post",
+            {"refresh_token": rotated["refresh_token"]},
+        )
+        self.assertEqual(code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(
+        JWT_SIGNING_ALGORITHM="RS256",
+        ROOT_URLCONF="api.async_urls",
+        INTROSPECTION_SECRET="gateway",
+    )
+    async def test_keyring_tokens_in_async_views(self):
+        keyring.reset()
+        self.addCleanup(keyring.reset)
+        response = await self.async_client.post(
+            "/login/", self.credentials, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        tokens = response.json()
+        self.assertEqual(
+            jwt.get_unverified_header(tokens["access_token"])["alg"], "RS256"
+        )
+        response = await self.async_client.post(
+            "/refresh/",
+            {"refresh_token": tokens["refresh_token"]},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = await self.async_client.post(
+            "/introspect/",
+            {"token": response.json()["access_token"]},
+            content_type="application/json",
+            headers={"X-Introspection-Secret": "gateway"},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.json()["active"])
+
+    async def test_user_detail(self):
+        code, tokens = await self.call(
+            AsyncLoginView, "post", self.credentials
+        )
+        auth = {"Authorization": f"Bearer {tokens['access_token']}"}
+        code, data = await self.call(
+            AsyncUserDetailView, "put", {"username": "Async"}, auth
+        )
+        self.assertEqual(code, status.HTTP_200_OK)
+        code, data = await self.call(
+            AsyncUserDetailView, "get", headers=auth
+        )
+        self.assertEqual(data["username"], "Async")
+
+    async def test_user_detail_requires_authentication(self):
+        code, data = await self.call(AsyncUserDetailView, "get")
+        self.assertEqual(code, status.HTTP_401_UNAUTHORIZED)
+
+
+class LoginLookupTest(APITestCase):
+
+    def setUp(self):
+        self.login_url = "/api/login/"
+        self.register_url = "/api/register/"
+        lookup.absent_emails.clear()
+        hashing.stats.reset()
+
+    def test_unknown_email_is_cached_and_still_hashed(self):
+        credentials = {"email": "ghost@example.com", "password": "password"}
+        self.client.post(self.login_url, credentials)
+        with self.assertNumQueries(0):
+            response = self.client.post(self.login_url, credentials)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(hashing.stats.snapshot()["hash_time"]["count"], 2)
+
+    def test_registration_clears_negative_cache(self):
+        credentials = {"email": "late@example.com", "password": "password"}
+        self.client.post(self.login_url, credentials)
+        self.client.post(self.register_url, credentials)
+        response = self.client.post(self.login_url, credentials)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_login_ignores_email_case(self):
+        User.objects.create_user(
+            email="case@example.com", password="password123"
+        )
+        response = self.client.post(
+            self.login_url,
+            {"email": "Case@Example.com", "password": "password123"},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(
+        STATICFILES_STORAGE=(
+            "django.contrib.staticfiles.storage.StaticFilesStorage"
+        )
+    )
+    def test_user_deactivated_in_admin_cannot_log_in(self):
+        credentials = {"email": "leaver@example.com", "password": "password"}
+        user = User.objects.create_user(**credentials)
+        self.addCleanup(reset_token_versions)
+        admin = User.objects.create_superuser(
+            email="staff@example.com", password="password123"
+        )
+        self.client.force_login(admin)
+        response = self.client.post(
+            f"/admin/api/user/{user.pk}/change/",
+            {
+                "tenant": user.tenant,
+                "email": user.email,
+                "username": "leaver",
+                "last_login_0": "",
+                "last_login_1": "",
+            },
+        )
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.client.logout()
+        self.assertFalse(User.objects.get(pk=user.pk).is_active)
+        hashing.stats.reset()
+        response = self.client.post(self.login_url, credentials)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(hashing.stats.snapshot()["hash_time"]["count"], 1)
+
+
+class TenantMigrationTest(TransactionTestCase):
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.migrate([("api", target)])
+        return executor.loader.project_state([("api", target)]).apps
+
+    def test_email_case_duplicates_stop_migration(self):
+        self.addCleanup(call_command, "migrate", "api", verbosity=0)
+        apps = self.migrate("0004_user_token_version")
+        OldUser = apps.get_model("api", "User")
+        OldUser.objects.create(email="Twin@example.com", password="x")
+        OldUser.objects.create(email="twin@example.com", password="x")
+        with self.assertRaisesMessage(RuntimeError, "twin@example.com"):
+            self.migrate("0005_user_tenant")
+        OldUser.objects.filter(email="Twin@example.com").delete()
+        self.migrate("0005_user_tenant")
+
+
+class ThrottlingTest(APITestCase):
+
+    def setUp(self):
+        self.login_url = "/api/login/"
+        self.refresh_url = "/api/refresh/"
+        self.user = User.objects.create_user(
+            email="throttle@example.com", password="password123"
+        )
+        reset_throttles()
+
+    def tearDown(self):
+        reset_throttles()
+
+    @override_config(THROTTLE_LOGIN_EMAIL="2/min")
+    def test_login_limited_per_email(self):
+        credentials = {"email": self.user.email, "password": "wrong"}
+        for _ in range(2):
+            self.client.post(self.login_url, credentials)
+        response = self.client.post(self.login_url, credentials)
+        self.assertEqual(
+            response.status_code, status.HTTP_429_TOO_MANY_REQUESTS
+        )
+        self.assertIn("Retry-After", response)
+        response = self.client.post(
+            self.login_url, {"email": "other@example.com", "password": "x"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_config(THROTTLE_REFRESH_FAMILY="1/min")
+    def test_refresh_limited_per_family(self):
+        refresh = BlacklistRefreshToken.for_user(self.user)
+        response = self.client.post(
+            self.refresh_url, {"refresh_token": str(refresh)}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.post(
+            self.refresh_url,
+            {"refresh_token": response.data["refresh_token"]},
+        )
+        self.assertEqual(
+            response.status_code, status.HTTP_429_TOO_MANY_REQUESTS
+        )
+
+    @override_config(THROTTLE_LOGIN_IP="0/min")
+    def test_zero_rate_blocks_every_request(self):
+        response = self.client.post(
+            self.login_url, {"email": self.user.email, "password": "x"}
+        )
+        self.assertEqual(
+            response.status_code, status.HTTP_429_TOO_MANY_REQUESTS
+        )
+        self.assertEqual(response["Retry-After"], "60")
+
+    @override_settings(REFRESH_TOKEN_FORMAT="jwt")
+    def test_family_taken_only_from_verified_token(self):
+        refresh = BlacklistRefreshToken.for_user(self.user)
+        forged = jwt.encode(
+            {"fam": refresh["fam"], "token_type": "refresh"}, "other-key"
+        )
+        throttle = throttling.RefreshThrottle()
+        request = AsyncRequestFactory().post(self.refresh_url)
+        values = live_config.snapshot()
+        rules = throttle.get_rules(
+            request, {"refresh_token": forged}, values
+        )
+        self.assertNotIn(refresh["fam"], str(rules))
+        rules = throttle.get_rules(
+            request, {"refresh_token": str(refresh)}, values
+        )
+        self.assertIn(refresh["fam"], str(rules))
+
+    @override_settings(
+        REFRESH_TOKEN_FORMAT="opaque", REFRESH_COALESCE_WINDOW=0
+    )
+    @override_config(THROTTLE_REFRESH_FAMILY="1/min")
+    def test_forged_opaque_token_spares_family_limit(self):
+        refresh = str(tokens.OpaqueRefreshToken.for_user(self.user))
+        family = tokens.OpaqueRefreshToken.family_of(refresh)
+        for _ in range(2):
+            response = self.client.post(
+                self.refresh_url, {"refresh_token": f"{family}.forged"}
+            )
+            self.assertEqual(
+                response.status_code, status.HTTP_401_UNAUTHORIZED
+            )
+        response = self.client.post(
+            self.refresh_url, {"refresh_token": refresh}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_script_gets_every_key_it_reads(self):
+        throttle = throttling.RefreshThrottle()
+        rules = [
+            ("throttle:test:ip", 5, 60, ""),
+            ("throttle:test:family", 1, 60, "refresh:test:token"),
+        ]
+        keys, args = throttle.script_args(rules)
+        self.assertEqual(
+            keys,
+            ["throttle:test:ip", "throttle:test:family", "refresh:test:token"],
+        )
+        self.assertEqual(args[2:], [5, 60000, 0, 1, 60000, 3])
+
+    def test_local_bucket_rejects_without_redis(self):
+        throttle = throttling.LoginThrottle()
+        rules = [("throttle:test:local", 2, 60, "")]
+        self.assertTrue(throttle.check_local(rules))
+        self.assertTrue(throttle.check_local(rules))
+        self.assertFalse(throttle.check_local(rules))
+        self.assertAlmostEqual(throttle.wait(), 30)
+
+
+class LiveConfigTest(APITestCase):
+
+    def setUp(self):
+        self.login_url = "/api/login/"
+        self.credentials = {
+            "email": "config@example.com",
+            "password": "password123",
+        }
+        User.objects.create_user(**self.credentials)
+
+    def token_lifetimes(self):
+        response = self.client.post(self.login_url, self.credentials)
+        access = AccessToken(response.data["access_token"])
+        refresh = BlacklistRefreshToken(response.data["refresh_token"])
+        return (
+            access["exp"] - access["iat"],
+            refresh["exp"] - refresh["iat"],
+        )
+
+    @override_config(ACCESS_TOKEN_LIFETIME=120, REFRESH_TOKEN_LIFETIME=2)
+    def test_lifetimes_are_read_at_mint_time(self):
+        self.assertEqual(self.token_lifetimes(), (120, 2 * 24 * 60 * 60))
+
+    def test_last_known_values_used_when_redis_fails(self):
+        with override_config(ACCESS_TOKEN_LIFETIME=90):
+            live_config.snapshot()
+            client = mock.Mock()
+            client.mget.side_effect = RedisError
+            with mock.patch(
+                "api.live_config.get_config_redis", return_value=client
+            ):
+                live_config.invalidate()
+                self.assertEqual(live_config.get("ACCESS_TOKEN_LIFETIME"), 90)
+        live_config.invalidate()
+
+
+@override_settings(JWT_SIGNING_ALGORITHM="RS256")
+class SigningKeyTest(APITestCase):
+
+    def setUp(self):
+        self.login_url = "/api/login/"
+        self.me_url = "/api/me/"
+        self.jwks_url = "/.well-known/jwks.json"
+        self.credentials = {
+            "email": "keys@example.com",
+            "password": "password123",
+        }
+        User.objects.create_user(**self.credentials)
+        keyring.reset()
+
+    def tearDown(self):
+        keyring.reset()
+
+    def test_tokens_verify_offline_with_jwks(self):
+        access_token = self.client.post(
+            self.login_url, self.credentials
+        ).data["access_token"]
+        header = jwt.get_unverified_header(access_token)
+        self.assertEqual(header["alg"], "RS256")
+        jwks = self.client.get(self.jwks_url).json()
+        jwk = next(key for key in jwks["keys"] if key["kid"] == header["kid"])
+        payload = jwt.decode(
+            access_token,
+            jwt.PyJWK(jwk).key,
+            algorithms=["RS256"],
+        )
+        self.assertEqual(payload["user_id"], User.objects.get().pk)
+        response = self.client.get(
+            self.me_url, HTTP_AUTHORIZATION=f"Bearer {access_token}"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_jwks_conditional_get(self):
+        response = self.client.get(self.jwks_url)
+        self.assertIn("max-age", response["Cache-Control"])
+        response = self.client.get(
+            self.jwks_url, HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_rotation_publishes_key_before_signing_with_it(self):
+        active = keyring.signing_key().kid
+        call_command("rotate_signing_keys", stdout=StringIO())
+        keyring.reset()
+        kids = [key["kid"] for key in self.client.get(self.jwks_url).json()[
+            "keys"
+        ]]
+        self.assertEqual(len(kids), 2)
+        self.assertEqual(keyring.signing_key().kid, active)
+
+
+@override_settings(INTROSPECTION_SECRET="gateway")
+class IntrospectionTest(APITestCase):
+
+    def setUp(self):
+        self.introspect_url = "/api/introspect/"
+        self.client.credentials(HTTP_X_INTROSPECTION_SECRET="gateway")
+        self.user = User.objects.create_user(
+            email="introspect@example.com", password="password123"
+        )
+        access_token_cache.clear()
+
+    def test_batch_reports_each_token(self):
+        refresh = BlacklistRefreshToken.for_user(self.user)
+        revoked = BlacklistRefreshToken.for_user(self.user)
+        revoked.blacklist()
+        tokens = [
+            str(refresh.access_token),
+            str(refresh),
+            str(revoked),
+            "garbage",
+        ]
+        with self.assertNumQueries(1):
+            response = self.client.post(
+                self.introspect_url, {"tokens": tokens}, format="json"
+            )
+        results = response.data["results"]
+        self.assertEqual(
+            [result["active"] for result in results],
+            [True, True, False, False],
+        )
+        self.assertEqual(results[0]["token_type"], "access")
+        self.assertEqual(results[1]["email"], self.user.email)
+
+    def test_token_cached_by_authentication_skips_decode(self):
+        access_token = str(
+            BlacklistRefreshToken.for_user(self.user).access_token
+        )
+        self.client.get(
+            "/api/me/", HTTP_AUTHORIZATION=f"Bearer {access_token}"
+        )
+        with mock.patch("api.introspection.UntypedToken") as untyped:
+            response = self.client.post(
+                self.introspect_url, {"token": access_token}
+            )
+        untyped.assert_not_called()
+        self.assertEqual(response.json()["email"], self.user.email)
+
+    def test_single_token_and_inactive_user(self):
+        access_token = BlacklistRefreshToken.for_user(self.user).access_token
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.post(
+            self.introspect_url, {"token": str(access_token)}
+        )
+        self.assertEqual(response.data, {"active": False})
+
+    def test_requires_gateway_secret(self):
+        self.client.credentials()
+        response = self.client.post(
+            self.introspect_url, {"token": "anything"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class BulkImportTest(APITestCase):
+
+    def setUp(self):
+        self.bulk_url = "/api/register/bulk/"
+        User.objects.create_user(
+            email="taken@example.com", password="password123"
+        )
+
+    def test_command_reports_every_row(self):
+        prehashed = make_password("prehashed")
+        source = StringIO(
+            "email,username,password,password_hash\n"
+            "one@example.com,,password1,\n"
+            f"two@example.com,two,,{prehashed}\n"
+            "TAKEN@example.com,,password1,\n"
+            "one@example.com,,password1,\n"
+            "not-an-email,,password1,\n"
+            "three@example.com,,,plain\n"
+        )
+        report = StringIO()
+        with mock.patch("sys.stdin", source):
+            call_command(
+                "import_users", "-", format="csv", chunk_size=2, stdout=report
+            )
+        lines = report.getvalue().splitlines()
+        failed = [json.loads(line)["row"] for line in lines[:-1]]
+        self.assertEqual(failed, [3, 4, 5, 6])
+        self.assertIn("Created 2 users, 4 rows failed.", lines[-1])
+        self.assertTrue(
+            User.objects.get(username="two").check_password("prehashed")
+        )
+        self.assertTrue(
+            User.objects.get(email="one@example.com").check_password(
+                "password1"
+            )
+        )
+
+    def test_endpoint_streams_jsonl_report(self):
+        admin = User.objects.create_user(
+            email="admin@example.com", password="password123", is_staff=True
+        )
+        self.client.force_authenticate(admin)
+        body = (
+            '{"email": "bulk@example.com", "password": "password1"}\n'
+            "not json\n"
+        )
+        response = self.client.post(
+            self.bulk_url, body, content_type="application/x-ndjson"
+        )
+        report = [
+            json.loads(line)
+            for line in b"".join(response.streaming_content).splitlines()
+        ]
+        self.assertEqual(
+            [line["status"] for line in report], ["created", "error"]
+        )
+        self.assertEqual(
+            report[0]["id"], User.objects.get(email="bulk@example.com").pk
+        )
+
+    def test_endpoint_accepts_staff_login_token(self):
+        credentials = {"email": "staff@example.com", "password": "password1"}
+        User.objects.create_user(**credentials, is_staff=True)
+        access = self.client.post("/api/login/", credentials).json()[
+            "access_token"
+        ]
+        auth = {"HTTP_AUTHORIZATION": f"Bearer {access}"}
+        # Второй запрос берёт пользователя из кэша токенов.
+        self.client.get("/api/me/", **auth)
+        response = self.client.post(
+            self.bulk_url, "email\n", content_type="text/csv", **auth
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_streamed_chunks_keep_request_tenant(self):
+        admin = User.objects.create_user(
+            email="admin@example.com", password="password123", is_staff=True
+        )
+        self.client.force_authenticate(admin)
+        response = self.client.post(
+            self.bulk_url,
+            '{"email": "tenant@example.com", "password": "password1"}\n',
+            content_type="application/x-ndjson",
+            HTTP_X_TENANT="acme",
+        )
+        routed = []
+
+        def database_for(tenant):
+            routed.append(tenant)
+            return "default"
+
+        with mock.patch("api.routers.database_for", database_for):
+            b"".join(response.streaming_content)
+        self.assertEqual(set(routed), {"acme"})
+        self.assertEqual(
+            User.objects.get(email="tenant@example.com").tenant, "acme"
+        )
+
+    @override_settings(
+        PASSWORD_HASHING_WORKERS=2,
+        PASSWORD_HASHING_MAX_QUEUE=0,
+        BULK_IMPORT_HASHING_SHARE=1,
+    )
+    def test_import_takes_a_slot_per_password(self):
+        pending = []
+
+        def make_password(password):
+            pending.append(hashing.stats.snapshot()["pending"])
+            return password
+
+        executor = mock.Mock()
+        executor.map.side_effect = lambda func, group: map(
+            make_password, group
+        )
+        with mock.patch.object(hashing, "get_executor", lambda: executor):
+            hashed = hashing.make_passwords(["one", "two", "three"])
+        self.assertEqual(hashed, ["one", "two", "three"])
+        self.assertEqual(executor.map.call_count, 3)
+        self.assertEqual(pending, [1, 1, 1])
+
+    def test_endpoint_requires_admin(self):
+        response = self.client.post(
+            self.bulk_url, "email\n", content_type="text/csv"
+        )
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PasswordUpgradeTest(APITestCase):
+
+    def setUp(self):
+        self.login_url = "/api/login/"
+        self.credentials = {
+            "email": "upgrade@example.com",
+            "password": "password123",
+        }
+        self.user = User.objects.create_user(**self.credentials)
+        self.user.password = make_password(
+            "password123", hasher="pbkdf2_sha1"
+        )
+        self.user.save()
+        hashing._upgrading.clear()
+
+    def test_login_upgrades_hash_in_background(self):
+        old = self.user.password
+        with mock.patch.object(hashing, "get_upgrader") as upgrader:
+            response = self.client.post(self.login_url, self.credentials)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        upgrader.return_value.submit.assert_called_once_with(
+            hashing._run_upgrade, self.user.pk, "password123", old, "default"
+        )
+        self.assertTrue(
+            hashing.upgrade_password(self.user.pk, "password123", old)
+        )
+        self.user.refresh_from_db()
+        self.assertFalse(hashing.needs_upgrade(self.user.password))
+        self.assertTrue(self.user.check_password("password123"))
+
+    def test_upgrade_runs_in_user_tenant_database(self):
+        user = User.objects.create_user(
+            email="sharded@example.com", password="x", tenant="acme"
+        )
+        user.password = make_password("password123", hasher="pbkdf2_sha1")
+        user.save()
+        routed = []
+
+        def database_for(tenant):
+            routed.append(tenant)
+            return "default"
+
+        # Поток пула начинает с пустого контекста, без арендатора запроса.
+        upgrader = mock.Mock()
+        upgrader.submit.side_effect = (
+            lambda func, *args: contextvars.Context().run(func, *args)
+        )
+        with mock.patch.object(hashing, "get_upgrader", lambda: upgrader):
+            with mock.patch("api.routers.database_for", database_for):
+                self.assertTrue(hashing.upgrade_later(user, "password123"))
+        self.assertEqual(set(routed), {"acme"})
+        user.refresh_from_db()
+        self.assertFalse(hashing.needs_upgrade(user.password))
+
+    def test_changed_cost_marks_hash_outdated(self):
+        encoded = make_password("password123")
+        self.assertFalse(hashing.needs_upgrade(encoded))
+        with override_settings(PASSWORD_PBKDF2_ITERATIONS=700_000):
+            self.assertTrue(hashing.needs_upgrade(encoded))
+
+    def test_upgrade_skips_changed_password(self):
+        self.assertFalse(
+            hashing.upgrade_password(self.user.pk, "password123", "stale")
+        )
+
+    def test_calibrate_command(self):
+        out = StringIO()
+        call_command("calibrate_hashers", rounds=1, stdout=out)
+        self.assertIn("PASSWORD_PBKDF2_ITERATIONS=", out.getvalue())
+
+
+@override_settings(REFRESH_TOKEN_FORMAT="opaque")
+class OpaqueRefreshTokenTest(APITestCase):
+
+    def setUp(self):
+        self.refresh_url = "/api/refresh/"
+        self.logout_url = "/api/logout/"
+        self.me_url = "/api/me/"
+        self.credentials = {
+            "email": "opaque@example.com",
+            "password": "password123",
+        }
+        self.user = User.objects.create_user(**self.credentials)
+        response = self.client.post("/api/login/", self.credentials)
+        self.refresh = response.data["refresh_token"]
+
+    def refresh_with(self, token):
+        return self.client.post(self.refresh_url, {"refresh_token": token})
+
+    def test_refresh_rotates_without_database(self):
+        self.assertEqual(self.refresh.count("."), 1)
+        with self.assertNumQueries(0):
+            response = self.refresh_with(self.refresh)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response.data["refresh_token"], self.refresh)
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f"Bearer {response.data['access_token']}"
+        )
+        self.assertEqual(
+            self.client.get(self.me_url).data["email"], self.user.email
+        )
+
+    @override_settings(REFRESH_COALESCE_WINDOW=0)
+    def test_reuse_revokes_family(self):
+        rotated = self.refresh_with(self.refresh).data["refresh_token"]
+        response = self.refresh_with(self.refresh)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.refresh_with(rotated)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_logout_and_garbage_tokens(self):
+        response = self.client.post(
+            self.logout_url, {"refresh_token": self.refresh}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.refresh_with(self.refresh)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.refresh_with("garbage")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PurgeExpiredTokensTest(APITestCase):
+
+    def setUp(self):
+        get_redis().delete(purge.CURSOR_KEY)
+        user = User.objects.create_user(
+            email="purge@example.com", password="password123"
+        )
+        now = timezone.now()
+        for number in range(5):
+            expires_at = now + timedelta(days=-1 if number < 4 else 1)
+            token = OutstandingToken.objects.create(
+                user=user,
+                jti=f"purge-{number}",
+                token="token",
+                expires_at=expires_at,
+            )
+            BlacklistedToken.objects.create(token=token)
+
+    def purge(self, **options):
+        out = StringIO()
+        call_command(
+            "purge_expired_tokens",
+            batch_size=2,
+            pause=0,
+            stdout=out,
+            **options,
+        )
+        return out.getvalue()
+
+    def test_purge_resumes_from_saved_cursor(self):
+        self.purge(max_batches=1)
+        self.assertEqual(OutstandingToken.objects.count(), 3)
+        self.assertTrue(get_redis().exists(purge.CURSOR_KEY))
+        output = self.purge()
+        self.assertIn("Deleted 2 outstanding and 2 blacklisted", output)
+        self.assertEqual(
+            list(OutstandingToken.objects.values_list("jti", flat=True)),
+            ["purge-4"],
+        )
+        self.assertEqual(BlacklistedToken.objects.count(), 1)
+        self.assertFalse(get_redis().exists(purge.CURSOR_KEY))
+
+    def test_rejects_out_of_range_options(self):
+        for options in ({"report_every": 0}, {"batch_size": -1}):
+            with self.assertRaisesMessage(CommandError, "at least 1"):
+                call_command("purge_expired_tokens", **options)
+        with self.assertRaisesMessage(CommandError, "--pause"):
+            call_command("purge_expired_tokens", pause=-1)
+        self.assertEqual(OutstandingToken.objects.count(), 5)
+
+
+class MetricsTest(APITestCase):
+
+    def setUp(self):
+        self.credentials = {
+            "email": "metrics@example.com",
+            "password": "password123",
+        }
+        User.objects.create_user(**self.credentials)
+
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_login_phases_are_exported(self):
+        labels = {"endpoint": "login", "method": "POST", "status": "200"}
+        requests = self.sample("auth_request_duration_seconds_count", **labels)
+        hashing = self.sample(
+            "auth_phase_duration_seconds_sum",
+            endpoint="login",
+            phase="hashing",
+        )
+        queries = self.sample("auth_db_queries_total", endpoint="login")
+        self.client.post("/api/login/", self.credentials)
+        self.assertEqual(
+            self.sample("auth_request_duration_seconds_count", **labels),
+            requests + 1,
+        )
+        self.assertGreater(
+            self.sample(
+                "auth_phase_duration_seconds_sum",
+                endpoint="login",
+                phase="hashing",
+            ),
+            hashing,
+        )
+        self.assertGreater(
+            self.sample("auth_db_queries_total", endpoint="login"), queries
+        )
+        with self.settings(METRICS_SECRET="scraper"):
+            response = self.client.get(
+                "/metrics", HTTP_AUTHORIZATION="Bearer scraper"
+            )
+        self.assertIn(
+            b'auth_phase_duration_seconds_count{endpoint="login",phase="jwt"}',
+            response.content,
+        )
+
+    @override_settings(
+        METRICS_SECRET="scraper", METRICS_ALLOWED_NETWORKS=["10.0.0.0/8"]
+    )
+    def test_metrics_require_secret_or_allowed_network(self):
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.get(
+            "/metrics", HTTP_AUTHORIZATION="Bearer wrong"
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.get("/metrics", REMOTE_ADDR="10.1.2.3")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(METRICS_SECRET=None, METRICS_ALLOWED_NETWORKS=[])
+    def test_metrics_open_without_settings_only_in_debug(self):
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        with self.settings(DEBUG=True):
+            response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class BenchmarkTest(APITestCase):
+
+    def run_benchmark(self, **options):
+        call_command(
+            "benchmark",
+            mode="micro",
+            only=["access_verify"],
+            iterations=20,
+            stdout=StringIO(),
+            **options,
+        )
+
+    def test_regression_against_baseline(self):
+        with tempfile.TemporaryDirectory() as directory:
+            baseline = Path(directory) / "baseline.json"
+            self.run_benchmark(baseline=baseline, save_baseline=True)
+            stored = json.loads(baseline.read_text())
+            self.assertIn("access_verify", stored["sqlite"]["micro"])
+            self.run_benchmark(baseline=baseline, tolerance=100)
+            stats = stored["sqlite"]["micro"]["access_verify"]
+            stats.update(p95_ms=0.0001, per_second=10**9)
+            baseline.write_text(json.dumps(stored))
+            with self.assertRaisesMessage(CommandError, "access_verify"):
+                self.run_benchmark(baseline=baseline)
+
+    def test_live_server_requires_opt_in(self):
+        with self.assertRaisesMessage(CommandError, "--allow-live-server"):
+            call_command(
+                "benchmark",
+                mode="macro",
+                url="http://127.0.0.1:1",
+                stdout=StringIO(),
+            )
+        self.assertFalse(User.objects.filter(email__startswith="bench-"))
+
+    def test_throttles_off_only_in_benchmark_server(self):
+        command = benchmark_command.Command()
+        with mock.patch.object(
+            benchmark_command.subprocess, "Popen"
+        ) as popen, mock.patch.object(
+            benchmark_command.urllib.request, "urlopen"
+        ), benchmarks.throwaway_redis(14):
+            command.start_server("bench_db")
+        env = popen.call_args.kwargs["env"]
+        self.assertEqual(env["THROTTLE_ENABLED"], "false")
+        self.assertEqual(env["BENCHMARK_DATABASE_NAME"], "bench_db")
+        self.assertEqual(env["BENCHMARK_REDIS_DB"], "14")
+        self.assertEqual(env["BROADCAST_CHANNEL_PREFIX"], "bench:")
+        self.assertTrue(settings.THROTTLE_ENABLED)
+
+    def test_scenarios_use_throwaway_redis(self):
+        with benchmarks.throwaway_redis(14):
+            get_redis().set("bench:probe", 1)
+            pool = get_redis().connection_pool
+            self.assertEqual(pool.connection_kwargs["db"], 14)
+        self.assertFalse(get_redis().exists("bench:probe"))
+        client = redis.Redis(
+            **{**settings.CONSTANCE_REDIS_CONNECTION, "db": 14}
+        )
+        self.assertEqual(client.dbsize(), 0)
+        client.set("taken", 1)
+        try:
+            with self.assertRaisesMessage(ValueError, "not empty"):
+                with benchmarks.throwaway_redis(14):
+                    pass
+            self.assertTrue(client.exists("taken"))
+        finally:
+            client.flushdb()
+
+    def test_summary_percentiles(self):
+        stats = benchmarks.summarize([i / 1000 for i in range(1, 101)], 2)
+        self.assertEqual(stats["count"], 100)
+        self.assertEqual(stats["per_second"], 50)
+        self.assertAlmostEqual(stats["p50_ms"], 50.5)
+        self.assertAlmostEqual(stats["p99_ms"], 99.01)
+
+
+class ReplicaRoutingTest(SimpleTestCase):
+
+    def setUp(self):
+        patcher = mock.patch(
+            "api.routers.get_replicas", return_value=["replica_0"]
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(
+            lambda: get_redis().delete(
+                "db:written:user:42", "db:written:email:pinned@example.com"
+            )
+        )
+        self.router = PrimaryReplicaRouter()
+
+    def test_only_marked_reads_use_replica(self):
+        self.assertEqual(self.router.db_for_read(User), "default")
+        with replica_reads(user_ids=[43]):
+            self.assertEqual(self.router.db_for_read(User), "replica_0")
+            self.assertEqual(self.router.db_for_write(User), "default")
+        self.assertEqual(self.router.db_for_read(User), "default")
+        self.assertFalse(self.router.allow_migrate("replica_0", "api"))
+
+    def test_recently_written_user_stays_on_primary(self):
+        mark_written(user_ids=[42], emails=["Pinned@example.com"])
+        with replica_reads(user_ids=[42]):
+            self.assertEqual(self.router.db_for_read(User), "default")
+        with replica_reads(emails=["pinned@example.com"]):
+            self.assertEqual(self.router.db_for_read(User), "default")
+        with replica_reads(user_ids=[43]):
+            self.assertEqual(self.router.db_for_read(User), "replica_0")
+
+
+class TenantTest(APITestCase):
+
+    def setUp(self):
+        self.credentials = {
+            "email": "Shared@example.com",
+            "password": "password123",
+        }
+        for tenant in ("acme", "globex"):
+            response = self.client.post(
+                "/api/register/", self.credentials, HTTP_X_TENANT=tenant
+            )
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def login(self, tenant):
+        return self.client.post(
+            "/api/login/", self.credentials, HTTP_X_TENANT=tenant
+        )
+
+    def test_same_email_in_different_tenants(self):
+        self.assertEqual(
+            set(User.objects.values_list("tenant", flat=True)),
+            {"acme", "globex"},
+        )
+        response = self.client.post(
+            "/api/register/",
+            {**self.credentials, "email": "shared@EXAMPLE.com"},
+            HTTP_X_TENANT="acme",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            self.login("default").status_code, status.HTTP_401_UNAUTHORIZED
+        )
+
+    def test_tokens_carry_tenant(self):
+        access = self.login("globex").json()["access_token"]
+        claims = jwt.decode(access, options={"verify_signature": False})
+        self.assertEqual(claims["tid"], "globex")
+        # /me/ берёт арендатора из токена, а не из заголовка.
+        response = self.client.get(
+            "/api/me/",
+            HTTP_AUTHORIZATION=f"Bearer {access}",
+            HTTP_X_TENANT="acme",
+        )
+        self.assertEqual(
+            response.json()["id"],
+            User.objects.get(tenant="globex").pk,
+        )
+
+    def test_invalid_tenant_header(self):
+        response = self.login("no such tenant")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(TENANT_DATABASES={"acme": "tenant_acme"})
+    def test_router_sends_sharded_tenant_to_its_database(self):
+        router = TenantRouter()
+        self.assertIsNone(router.db_for_read(User))
+        with use_tenant("acme"):
+            self.assertEqual(router.db_for_read(User), "tenant_acme")
+            self.assertIsNone(router.db_for_write(SigningKey))
+        user = User(tenant="acme")
+        self.assertEqual(
+            router.db_for_write(User, instance=user), "tenant_acme"
+        )
+        self.assertTrue(router.allow_migrate("tenant_acme", "api"))
+
+
+@override_settings(
+    STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage"
+)
+class AdminUserSearchTest(TestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(
+            email="staff@example.com", password="password123"
+        )
+        self.client.force_login(self.admin)
+        User.objects.bulk_create(
+            User(email=f"member-{index}@example.com", username=f"m{index}")
+            for index in range(5)
+        )
+        patcher = mock.patch.object(CustomUserAdmin, "list_per_page", 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def changelist(self, **params):
+        return self.client.get("/admin/api/user/", params)
+
+    def test_keyset_pages(self):
+        seen = []
+        response = self.changelist()
+        self.assertContains(response, "Next page")
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen += [user.pk for user in response.context["cl"].result_list]
+            next_url = response.context["cl"].next_url
+            if next_url is None:
+                break
+            self.assertIn("after=", next_url)
+            response = self.client.get("/admin/api/user/" + next_url)
+        self.assertEqual(
+            seen, sorted(User.objects.values_list("pk", flat=True))
+        )
+        self.assertEqual(response.context["cl"].result_count, 6)
+
+    def test_only_estimated_counts_are_marked(self):
+        response = self.changelist()
+        self.assertFalse(response.context["cl"].is_estimate)
+        self.assertContains(response, "6 users")
+        self.assertNotContains(response, "~6")
+        with mock.patch(
+            "api.admin.estimated_count", return_value=(5000, True)
+        ):
+            response = self.changelist()
+        self.assertContains(response, "~5000 users")
+
+    def test_prefix_search(self):
+        response = self.changelist(q="MEMBER-3")
+        self.assertEqual(
+            [user.email for user in response.context["cl"].result_list],
+            ["member-3@example.com"],
+        )
+        response = self.changelist(q="3@example")
+        self.assertFalse(response.context["cl"].result_list)
+        with override_settings(ADMIN_USER_SEARCH="trigram"):
+            response = self.changelist(q="3@example")
+        self.assertEqual(len(response.context["cl"].result_list), 1)
+
+
+class AuditTest(APITestCase):
+
+    def setUp(self):
+        self.credentials = {
+            "email": "audited@example.com",
+            "password": "password123",
+        }
+        self.user = User.objects.create_user(**self.credentials)
+        # События предыдущих тестов уходят в обычный приёмник.
+        audit.flush()
+
+    def events(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = Path(directory.name) / "audit.jsonl"
+        with override_settings(
+            AUDIT_SINK="api.audit.JSONLinesSink", AUDIT_LOG_PATH=path
+        ):
+            session = self.client.post("/api/login/", self.credentials).json()
+            self.client.post(
+                "/api/login/", {**self.credentials, "password": "wrong"}
+            )
+            self.client.post(
+                "/api/refresh/", {"refresh_token": session["refresh_token"]}
+            )
+            audit.flush()
+        return [json.loads(line) for line in path.read_text().splitlines()]
+
+    def test_events_are_written_in_background_batches(self):
+        events = self.events()
+        self.assertEqual(
+            [event["event"] for event in events],
+            ["login", "login_failed", "refresh"],
+        )
+        self.assertEqual(events[0]["user"], self.user.pk)
+        self.assertEqual(events[0]["tenant"], "default")
+        self.assertIsNone(events[1]["user"])
+        self.assertEqual(events[2]["user"], self.user.pk)
+
+    @override_settings(
+        REST_FRAMEWORK={**settings.REST_FRAMEWORK, "NUM_PROXIES": 1}
+    )
+    def test_client_address_taken_from_trusted_proxy(self):
+        self.client.defaults.update(
+            REMOTE_ADDR="10.0.0.1", HTTP_X_FORWARDED_FOR="203.0.113.7"
+        )
+        events = self.events()
+        self.assertEqual({event["ip"] for event in events}, {"203.0.113.7"})
+
+    def test_full_buffer_drops_events(self):
+        def dropped():
+            return REGISTRY.get_sample_value(
+                "auth_audit_events_total", {"outcome": "dropped"}
+            ) or 0
+
+        before = dropped()
+        with override_settings(AUDIT_BUFFER_SIZE=0):
+            response = self.client.post("/api/login/", self.credentials)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(dropped(), before + 1)
+
+    def test_database_sink(self):
+        audit.DatabaseSink().write(
+            [(1.5, "profile_update", self.user.pk, "default", "127.0.0.1")]
+        )
+        event = AuditEvent.objects.get()
+        self.assertEqual(event.event, "profile_update")
+        self.assertEqual(event.user_id, self.user.pk)
+
+
+class OpenAPISchemaTest(APITestCase):
+
+    def setUp(self):
+        schema.get_documents.cache_clear()
+        self.addCleanup(schema.get_documents.cache_clear)
+
+    def test_schema_is_generated_once(self):
+        with mock.patch(
+            "api.schema.generate", wraps=schema.generate
+        ) as generate:
+            first = self.client.get("/swagger.json")
+            second = self.client.get(
+                "/swagger.json", HTTP_IF_NONE_MATCH=first["ETag"]
+            )
+            zipped = self.client.get(
+                "/swagger.yaml", HTTP_ACCEPT_ENCODING="gzip, deflate"
+            )
+        generate.assert_called_once()
+        self.assertIn("/login/", json.loads(first.content)["paths"])
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(zipped["Content-Encoding"], "gzip")
+        self.assertIn(b"/login/:", gzip.decompress(zipped.content))
+
+    def test_encoding_follows_q_values(self):
+        document = schema.Document(b"{}" * 100, "application/json")
+        cases = {
+            "gzip;q=0, identity": None,
+            "gzip;q=0.5, br;q=0.1": "gzip",
+            "*;q=0": None,
+            "gzip, *;q=0": "gzip",
+        }
+        for accept_encoding, expected in cases.items():
+            encoding, *_ = document.negotiate(accept_encoding)
+            self.assertEqual(encoding, expected, accept_encoding)
+
+    def test_stored_schema_is_served_without_generation(self):
+        with tempfile.TemporaryDirectory() as directory:
+            call_command(
+                "generate_schema", output_dir=directory, stdout=StringIO()
+            )
+            stored = (Path(directory) / "openapi.json").read_bytes()
+            with override_settings(OPENAPI_SCHEMA_DIR=directory), mock.patch(
+                "api.schema.generate"
+            ) as generate:
+                response = self.client.get("/swagger.json")
+        generate.assert_not_called()
+        self.assertEqual(response.content, stored)
+
+
+class StartupTimeTest(SimpleTestCase):
+
+    def test_reports_import_cost_per_package(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = Path(directory) / "startup.json"
+            call_command(
+                "startup_time",
+                runs=1,
+                api_only=True,
+                output=output,
+                stdout=StringIO(),
+            )
+            result = json.loads(output.read_text())
+        self.assertTrue(result["api_only"])
+        self.assertGreater(result["startup_ms"], 0)
+        self.assertIn("django", result["imports_ms"])
+        self.assertNotIn("drf_yasg", result["imports_ms"])
+
+
+class FastJSONTest(APITestCase):
+
+    def setUp(self):
+        self.credentials = {
+            "email": "fast@example.com",
+            "password": "password123",
+        }
+        User.objects.create_user(username="Фёдор", **self.credentials)
+
+    def test_json_login_and_me_ignore_accept(self):
+        response = self.client.post(
+            "/api/login/", self.credentials, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        access = response.json()["access_token"]
+        response = self.client.get(
+            "/api/me/",
+            HTTP_AUTHORIZATION=f"Bearer {access}",
+            HTTP_ACCEPT="text/html",
+        )
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertEqual(response.json()["username"], "Фёдор")
+
+    def test_malformed_json_is_rejected(self):
+        response = self.client.post(
+            "/api/refresh/", "{", content_type="application/json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("JSON parse error", response.json()["detail"])
+
+    def test_stdlib_fallback_matches_orjson(self):
+        data = {"username": "Фёдор", "detail": gettext_lazy("Not found.")}
+        with mock.patch("api.renderers.orjson", None):
+            fallback = renderers.dumps(data)
+        self.assertEqual(renderers.dumps(data), fallback)
+
+
+class TokenVersionTest(APITestCase):
+
+    def setUp(self):
+        self.credentials = {
+            "email": "sessions@example.com",
+            "password": "password123",
+        }
+        self.user = User.objects.create_user(**self.credentials)
+        self.addCleanup(reset_token_versions)
+
+    def login(self):
+        return self.client.post("/api/login/", self.credentials).json()
+
+    def me(self, session):
+        return self.client.get(
+            "/api/me/",
+            HTTP_AUTHORIZATION=f"Bearer {session['access_token']}",
+        )
+
+    def refresh(self, session):
+        return self.client.post(
+            "/api/refresh/", {"refresh_token": session["refresh_token"]}
+        )
+
+    def test_logout_everywhere_revokes_all_sessions(self):
+        phone, laptop = self.login(), self.login()
+        self.assertEqual(self.me(phone).status_code, status.HTTP_200_OK)
+        response = self.client.post(
+            "/api/logout/all/",
+            HTTP_AUTHORIZATION=f"Bearer {laptop['access_token']}",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for session in (phone, laptop):
+            self.assertEqual(
+                self.me(session).status_code, status.HTTP_401_UNAUTHORIZED
+            )
+            self.assertEqual(
+                self.refresh(session).status_code,
+                status.HTTP_401_UNAUTHORIZED,
+            )
+        self.assertEqual(self.me(self.login()).status_code, status.HTTP_200_OK)
+
+    def test_password_change_revokes_refresh_tokens(self):
+        session = self.login()
+        self.credentials["password"] = "new-password-456"
+        self.user.set_password(self.credentials["password"])
+        self.user.save()
+        self.assertEqual(
+            self.refresh(session).status_code, status.HTTP_401_UNAUTHORIZED
+        )
+        self.assertEqual(
+            self.refresh(self.login()).status_code, status.HTTP_200_OK
+        )
+
+    @override_settings(
+        REFRESH_TOKEN_FORMAT="opaque", INTROSPECTION_SECRET="gateway"
+    )
+    def test_opaque_tokens_and_introspection_follow_revocation(self):
+        session = self.login()
+        access = jwt.decode(
+            session["access_token"], options={"verify_signature": False}
+        )
+        self.assertEqual(access["ver"], 0)
+        revocation.revoke_all(self.user.pk)
+        self.assertEqual(
+            self.refresh(session).status_code, status.HTTP_401_UNAUTHORIZED
+        )
+        response = self.client.post(
+            "/api/introspect/",
+            {"token": session["access_token"]},
+            HTTP_X_INTROSPECTION_SECRET="gateway",
+        )
+        self.assertFalse(response.json()["active"])
+
+
+class LockoutTest(APITestCase):
+
+    def setUp(self):
+        self.url = "/api/login/"
+        self.credentials = {
+            "email": "locked@example.com",
+            "password": "password123",
+        }
+        self.user = User.objects.create_user(**self.credentials)
+        self.wrong = {**self.credentials, "password": "wrong"}
+        reset_throttles()
+        reset_lockouts()
+        self.addCleanup(reset_lockouts)
+
+    @override_config(LOCKOUT_ACCOUNT_THRESHOLD=2, LOCKOUT_BASE_SECONDS=60)
+    def test_account_locked_before_password_check(self):
+        for _ in range(2):
+            response = self.client.post(self.url, self.wrong)
+            self.assertEqual(
+                response.status_code, status.HTTP_401_UNAUTHORIZED
+            )
+        with mock.patch.object(lookup, "authenticate") as authenticate:
+            response = self.client.post(self.url, self.credentials)
+            # Другой воркер узнаёт о блокировке из Redis.
+            lockout.local_locks.clear()
+            self.client.post(self.url, self.credentials)
+        authenticate.assert_not_called()
+        self.assertEqual(
+            response.status_code, status.HTTP_429_TOO_MANY_REQUESTS
+        )
+        self.assertEqual(response["Retry-After"], "60")
+        lockout.unlock(self.credentials["email"])
+        response = self.client.post(self.url, self.credentials)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_config(LOCKOUT_ACCOUNT_THRESHOLD=2, LOCKOUT_BASE_SECONDS=60)
+    def test_lockout_doubles_and_success_resets(self):
+        request = AsyncRequestFactory().post(self.url)
+        email = self.credentials["email"]
+        self.assertEqual(lockout.failed(request, email), 0)
+        lockout.succeeded(email)
+        self.assertEqual(lockout.failed(request, email), 0)
+        self.assertEqual(lockout.failed(request, email), 60)
+        self.assertEqual(lockout.failed(request, email), 120)
+        self.assertGreater(lockout.check(request, email), 100)
+
+    @override_config(LOCKOUT_ACCOUNT_THRESHOLD=0, LOCKOUT_SOURCE_THRESHOLD=1)
+    def test_source_locked_across_accounts(self):
+        self.client.post(self.url, self.wrong, HTTP_X_FORWARDED_FOR="1.2.3.4")
+        # Без доверенных прокси X-Forwarded-For не меняет адрес клиента.
+        response = self.client.post(
+            self.url,
+            {"email": "other@example.com", "password": "x"},
+            HTTP_X_FORWARDED_FOR="5.6.7.8",
+        )
+        self.assertEqual(
+            response.status_code, status.HTTP_429_TOO_MANY_REQUESTS
+        )
+        call_command("unlock_login", ip="127.0.0.1", stdout=StringIO())
+        response = self.client.post(self.url, self.credentials)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_client_ip_trusts_only_configured_proxies(self):
+        request = RequestFactory().post(
+            self.url,
+            REMOTE_ADDR="10.0.0.1",
+            HTTP_X_FORWARDED_FOR="6.6.6.6, 203.0.113.7",
+        )
+        self.assertEqual(throttling.client_ip(request), "10.0.0.1")
+        rest_framework = {**settings.REST_FRAMEWORK, "NUM_PROXIES": 1}
+        with override_settings(REST_FRAMEWORK=rest_framework):
+            self.assertEqual(throttling.client_ip(request), "203.0.113.7")
+            request.META["HTTP_X_FORWARDED_FOR"] = "lockout:*"
+            self.assertEqual(throttling.client_ip(request), "10.0.0.1")
+        self.assertEqual(
+            throttling.normalize_ip("2001:db8::1"), "2001:db8::/64"
+        )
@@ -0,0 +1,274 @@
+import hashlib
+import ipaddress
+import logging
+import time
+import uuid
+
+from django.conf import settings
+from redis.exceptions import RedisError
+from rest_framework.throttling import BaseThrottle
+from rest_framework_simplejwt.exceptions import TokenBackendError
+
+from .cache import TTLCache
+from .connections import get_async_redis, get_script
+from .keys import get_token_backend
+from .live_config import live_config
+from .lookup import normalize_email
+from .tenants import scoped
+from .tokens import FAMILY_CLAIM, MemoizedTokenBackend, OpaqueRefreshToken
+
+logger = logging.getLogger(__name__)
+
+# Правило с guard учитывается, только если ключ guard есть в Redis: так
+# семейство непрозрачного токена считается лишь для настоящего токена.
+# KEYS — окна правил, за ними ключи guard; ARGV — время, член окна, затем
+# для каждого правила лимит, окно в мс и номер его guard в KEYS (0 — нет).
+SLIDING_WINDOW = """
+local now = tonumber(ARGV[1])
+local member = ARGV[2]
+local active = {}
+for i = 1, (#ARGV - 2) / 3 do
+    local guard = tonumber(ARGV[i * 3 + 2])
+    if guard == 0 or redis.call("EXISTS", KEYS[guard]) == 1 then
+        table.insert(active, i)
+    end
+end
+for _, i in ipairs(active) do
+    local key = KEYS[i]
+    local limit = tonumber(ARGV[i * 3])
+    local window = tonumber(ARGV[i * 3 + 1])
+    redis.call("ZREMRANGEBYSCORE", key, "-inf", now - window)
+    if redis.call("ZCARD", key) >= limit then
+        local oldest = redis.call("ZRANGE", key, 0, 0, "WITHSCORES")
+        if not oldest[2] then
+            return window
+        end
+        return tonumber(oldest[2]) + window - now
+    end
+end
+for _, i in ipairs(active) do
+    redis.call("ZADD", KEYS[i], now, member)
+    redis.call("PEXPIRE", KEYS[i], ARGV[i * 3 + 1])
+end
+return 0
+"""
+
+PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+local_buckets = TTLCache(
+    maxsize=settings.THROTTLE_LOCAL_BUCKETS, ttl=PERIODS["h"]
+)
+
+
+def parse_rate(rate):
+    """'10/min' -> (10, 60); пустая строка отключает ограничение."""
+    if not rate:
+        return None
+    num, period = rate.split("/")
+    return int(num), PERIODS[period[0]]
+
+
+def normalize_ip(value):
+    """
+    Адрес для ключей Redis: канонический IPv4 или сеть /64 для IPv6,
+    которую клиент получает целиком. Не адрес — None.
+    """
+    try:
+        address = ipaddress.ip_address(str(value).strip())
+    except ValueError:
+        return None
+    if address.version == 6:
+        return str(ipaddress.ip_network(f"{address}/64", strict=False))
+    return str(address)
+
+
+def client_ip(request):
+    """
+    Адрес клиента для лимитов и блокировок. X-Forwarded-For учитывается
+    только на NUM_PROXIES доверенных прокси, подделать его клиент не может.
+    """
+    return normalize_ip(BaseThrottle().get_ident(request)) or normalize_ip(
+        request.META.get("REMOTE_ADDR")
+    )
+
+
+def _digest(value):
+    return hashlib.blake2b(value.encode(), digest_size=12).hexdigest()
+
+
+class TokenBucket:
+    """Локальное ведро токенов воркера для отсечения явного флуда."""
+
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, capacity):
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, capacity, rate):
+        now = time.monotonic()
+        self.tokens = min(capacity, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class SlidingWindowThrottle(BaseThrottle):
+    """
+    Скользящее окно в Redis, проверяемое одним Lua-скриптом сразу для всех
+    областей (IP, email, семейство refresh-токенов). Лимиты берутся из
+    CONSTANCE_CONFIG через live_config.
+    """
+
+    scopes = ()
+
+    def __init__(self):
+        self._wait = None
+
+    def get_rules(self, request, data, values):
+        if not settings.THROTTLE_ENABLED:
+            return []
+        if not isinstance(data, dict):
+            data = {}
+        rules = []
+        for name, kind in self.scopes:
+            rate = parse_rate(values[name])
+            ident = getattr(self, f"get_{kind}_ident")(request, data)
+            if rate and ident:
+                key = f"{settings.THROTTLE_KEY_PREFIX}:{name}:{ident}"
+                rules.append((key, *rate, self.get_guard(kind, data)))
+        return rules
+
+    def get_ip_ident(self, request, data):
+        return client_ip(request)
+
+    def get_email_ident(self, request, data):
+        email = data.get("email")
+        if isinstance(email, str) and email:
+            return _digest(scoped(None, normalize_email(email)))
+        return None
+
+    def get_family_ident(self, request, data):
+        """
+        Семейство только из проверенного токена: иначе клиент мог бы
+        подставить чужое семейство и исчерпать его лимит. Непрозрачный
+        токен проверяется в Redis через guard, JWT — по подписи, с
+        запоминанием payload для последующей проверки во view.
+        """
+        raw_token = data.get("refresh_token")
+        if not isinstance(raw_token, str):
+            return None
+        if settings.REFRESH_TOKEN_FORMAT == "opaque":
+            return OpaqueRefreshToken.family_of(raw_token)
+        try:
+            payload = MemoizedTokenBackend(get_token_backend()).decode(
+                raw_token
+            )
+        except TokenBackendError:
+            return None
+        family = payload.get(FAMILY_CLAIM)
+        return str(family) if family else None
+
+    def get_guard(self, kind, data):
+        if kind != "family" or settings.REFRESH_TOKEN_FORMAT != "opaque":
+            return ""
+        raw_token = data["refresh_token"]
+        family = OpaqueRefreshToken.family_of(raw_token)
+        return OpaqueRefreshToken.token_key(family, raw_token)
+
+    def check_local(self, rules):
+        for key, limit, window, guard in rules:
+            if not limit:
+                # Лимит 0 запрещает запросы полностью.
+                self._wait = window
+                return False
+            if guard:
+                # Ведро непроверенного ключа не расходуется.
+                continue
+            bucket = local_buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(limit)
+                local_buckets.set(key, bucket)
+            if not bucket.take(limit, limit / window):
+                self._wait = window / limit
+                return False
+        return True
+
+    def script_args(self, rules):
+        now = int(time.time() * 1000)
+        args = [now, f"{now}-{uuid.uuid4().hex[:8]}"]
+        keys = [key for key, *_ in rules]
+        guards = []
+        for _, limit, window, guard in rules:
+            index = 0
+            if guard:
+                guards.append(guard)
+                index = len(keys) + len(guards)
+            args.extend((limit, window * 1000, index))
+        return keys + guards, args
+
+    def finish(self, wait):
+        if wait > 0:
+            self._wait = wait / 1000
+            return False
+        return True
+
+    def allow_request(self, request, view):
+        rules = self.get_rules(
+            request, request.data, live_config.snapshot()
+        )
+        if not rules:
+            return True
+        if not self.check_local(rules):
+            return False
+        keys, args = self.script_args(rules)
+        try:
+            wait = get_script(SLIDING_WINDOW)(keys=keys, args=args)
+        except RedisError:
+            logger.warning("Throttle check skipped, Redis unavailable")
+            return True
+        return self.finish(wait)
+
+    async def aallow_request(self, request, data):
+        rules = self.get_rules(
+            request, data, await live_config.asnapshot()
+        )
+        if not rules:
+            return True
+        if not self.check_local(rules):
+            return False
+        keys, args = self.script_args(rules)
+        try:
+            script = get_async_redis().register_script(SLIDING_WINDOW)
+            wait = await script(keys=keys, args=args)
+        except RedisError:
+            logger.warning("Throttle check skipped, Redis unavailable")
+            return True
+        return self.finish(wait)
+
+    def wait(self):
+        return self._wait
+
+
+class LoginThrottle(SlidingWindowThrottle):
+    scopes = (
+        ("THROTTLE_LOGIN_IP", "ip"),
+        ("THROTTLE_LOGIN_EMAIL", "email"),
+    )
+
+
+class RegisterThrottle(SlidingWindowThrottle):
+    scopes = (("THROTTLE_REGISTER_IP", "ip"),)
+
+
+class RefreshThrottle(SlidingWindowThrottle):
+    scopes = (
+        ("THROTTLE_REFRESH_IP", "ip"),
+        ("THROTTLE_REFRESH_FAMILY", "family"),
+    )
+
+
+class LogoutThrottle(SlidingWindowThrottle):
+    scopes = (("THROTTLE_LOGOUT_IP", "ip"),)
@@ -0,0 +1,576 @@
+import asyncio
+import hashlib
+import logging
+import secrets
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from redis.exceptions import RedisError
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken as BaseAccessToken
+from rest_framework_simplejwt.tokens import BlacklistMixin
+from rest_framework_simplejwt.tokens import RefreshToken as BaseRefreshToken
+from rest_framework_simplejwt.tokens import UntypedToken as BaseUntypedToken
+
+from . import revocation, tenants
+from .blacklist import get_blacklist
+from .cache import TTLCache
+from .connections import get_async_redis, get_redis, get_script
+from .keys import get_token_backend
+from .live_config import live_config
+from .renderers import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+FAMILY_CLAIM = "fam"
+
+# Значение ключа повторной ротации, пока первый запрос ещё выполняется.
+REFRESH_PENDING = b"pending"
+
+verified_payloads = TTLCache(
+    maxsize=settings.REFRESH_VERIFY_CACHE_SIZE,
+    ttl=settings.REFRESH_VERIFY_CACHE_TTL,
+)
+
+# Запись токена: "user:family:issued:expires:counter:version:tenant".
+# Счётчик семейства равен счётчику последнего выпущенного токена, поэтому
+# предъявление уже заменённого токена отзывает всё семейство. version —
+# поколение токенов пользователя, tenant — его арендатор; в старых записях
+# их может не быть.
+ROTATE_OPAQUE = """
+local record = redis.call("GET", KEYS[1])
+if not record then
+    return false
+end
+local user, family, issued, expires, counter, version, tenant = string.match(
+    record, "^([^:]+):([^:]+):(%d+):(%d+):(%d+):?(%d*):?([%w%-]*)$"
+)
+version = tonumber(version) or 0
+if redis.call("GET", KEYS[2]) ~= counter then
+    redis.call("DEL", KEYS[2])
+    return {-1, user}
+end
+if ARGV[3] == "0" then
+    return {0, user, tonumber(expires), version, tenant}
+end
+local now = tonumber(ARGV[1])
+local lifetime = tonumber(ARGV[2])
+counter = tostring(tonumber(counter) + 1)
+redis.call(
+    "SET", KEYS[3],
+    table.concat(
+        {user, family, now, now + lifetime, counter, version, tenant}, ":"
+    ),
+    "EX", lifetime
+)
+redis.call("SET", KEYS[2], counter, "EX", lifetime)
+return {1, user, now + lifetime, version, tenant}
+"""
+
+REVOKE_OPAQUE = """
+local record = redis.call("GET", KEYS[1])
+if not record then
+    return false
+end
+redis.call("DEL", KEYS[2])
+return record
+"""
+
+
+def token_digest(raw_token):
+    if isinstance(raw_token, str):
+        raw_token = raw_token.encode()
+    return hashlib.blake2b(raw_token, digest_size=16).hexdigest()
+
+
+class MemoizedTokenBackend:
+    """
+    Бэкенд, запоминающий payload refresh-токенов с уже проверенной
+    подписью: повторное предъявление того же токена не декодирует его
+    заново. Срок, blacklist и поколение проверяются в verify как обычно.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def decode(self, token, verify=True):
+        if not verify:
+            return self.backend.decode(token, verify=False)
+        key = token_digest(token)
+        payload = verified_payloads.get(key)
+        if payload is None:
+            payload = self.backend.decode(token, verify=True)
+            verified_payloads.set(key, payload, expires_at=payload.get("exp"))
+        # Токен меняет payload при ротации, запомненный должен остаться.
+        return dict(payload)
+
+
+class AccessToken(BaseAccessToken):
+    """Access-токен, подписываемый через get_token_backend."""
+
+    @property
+    def token_backend(self):
+        return get_token_backend()
+
+
+class UntypedToken(BaseUntypedToken):
+    """Проверка подписи и срока токена любого типа."""
+
+    @property
+    def token_backend(self):
+        return get_token_backend()
+
+
+class RefreshToken(BaseRefreshToken):
+    """
+    Refresh-токен, работающий через настраиваемый бэкенд blacklist.
+    Время жизни берётся из constance в момент выпуска, а не при импорте.
+    """
+
+    access_token_class = AccessToken
+    _config = None
+
+    @property
+    def token_backend(self):
+        return MemoizedTokenBackend(get_token_backend())
+
+    def use_config(self, values):
+        self._config = values
+        return self
+
+    @property
+    def config(self):
+        if self._config is None:
+            self._config = live_config.snapshot()
+        return self._config
+
+    @property
+    def refresh_lifetime(self):
+        return timedelta(days=self.config["REFRESH_TOKEN_LIFETIME"])
+
+    @property
+    def access_lifetime(self):
+        return timedelta(seconds=self.config["ACCESS_TOKEN_LIFETIME"])
+
+    @property
+    def access_token(self):
+        access = super().access_token
+        access.set_exp(
+            from_time=self.current_time, lifetime=self.access_lifetime
+        )
+        return access
+
+    def refresh_exp(self):
+        self.set_jti()
+        self.set_exp(lifetime=self.refresh_lifetime)
+        self.set_iat()
+
+    def verify(self):
+        super().verify()
+        self.check_version()
+
+    def check_blacklist(self):
+        if get_blacklist().is_blacklisted(self):
+            raise TokenError(_("Token is blacklisted"))
+
+    def check_version(self):
+        revocation.check_refresh(self)
+
+    def blacklist(self):
+        return get_blacklist().blacklist(self)
+
+    def rotate(self):
+        """Выпуск нового jti/exp с отзывом текущего токена."""
+        if api_settings.BLACKLIST_AFTER_ROTATION:
+            self.blacklist()
+        self.refresh_exp()
+
+    async def ablacklist(self):
+        return await get_blacklist().ablacklist(self)
+
+    async def arotate(self):
+        if api_settings.BLACKLIST_AFTER_ROTATION:
+            await self.ablacklist()
+        self.refresh_exp()
+
+    @classmethod
+    def refreshed(cls, raw_token):
+        """Проверенный токен, после ротации, если она включена."""
+        token = cls(raw_token)
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            token.rotate()
+        return token
+
+    @classmethod
+    def revoke(cls, raw_token):
+        token = cls(raw_token)
+        token.blacklist()
+        return token_subject(token)
+
+    @classmethod
+    def new_for_user(cls, user, values=None):
+        """
+        Новый токен без регистрации в blacklist. Семейство (fam) равно
+        первому jti и сохраняется при всех последующих ротациях.
+        """
+        token = super(BlacklistMixin, cls).for_user(user)
+        if values is not None:
+            token.use_config(values)
+        token.set_exp(lifetime=token.refresh_lifetime)
+        token[FAMILY_CLAIM] = token[api_settings.JTI_CLAIM]
+        token[revocation.VERSION_CLAIM] = user.token_version
+        token[tenants.TENANT_CLAIM] = user.tenant
+        return token
+
+    @classmethod
+    def for_user(cls, user):
+        token = cls.new_for_user(user)
+        get_blacklist().outstanding(token, user)
+        return token
+
+    @classmethod
+    async def afor_user(cls, user):
+        token = cls.new_for_user(user, await live_config.asnapshot())
+        await get_blacklist().aoutstanding(token, user)
+        return token
+
+
+class AsyncRefreshToken(RefreshToken):
+    """
+    Токен для асинхронных представлений: конструктор не обращается к
+    blacklist, проверка выполняется в averify через асинхронный Redis.
+    """
+
+    def check_blacklist(self):
+        pass
+
+    def check_version(self):
+        pass
+
+    @classmethod
+    async def averify(cls, raw_token):
+        token = cls(raw_token).use_config(await live_config.asnapshot())
+        if await get_blacklist().ais_blacklisted(token):
+            raise TokenError(_("Token is blacklisted"))
+        await revocation.acheck_refresh(token)
+        return token
+
+    @classmethod
+    async def arefreshed(cls, raw_token):
+        token = await cls.averify(raw_token)
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            await token.arotate()
+        return token
+
+    @classmethod
+    async def arevoke(cls, raw_token):
+        token = await cls.averify(raw_token)
+        await token.ablacklist()
+        return token_subject(token)
+
+
+class OpaqueRefreshToken:
+    """
+    Непрозрачный refresh-токен "<family>.<secret>". В Redis по хешу токена
+    хранится компактная запись с TTL до истечения, в БД ничего не пишется.
+    Проверка, ротация и обнаружение повторного использования выполняются
+    одним Lua-скриптом.
+    """
+
+    def __init__(
+        self, value, user_id, family, expires_at, values, version, tenant
+    ):
+        self.value = value
+        self.user_id = user_id
+        self.family = family
+        self.expires_at = expires_at
+        self.config = values
+        self.version = version
+        self.tenant = tenant
+
+    def __str__(self):
+        return self.value
+
+    @staticmethod
+    def family_of(raw_token):
+        family, _, secret = str(raw_token).partition(".")
+        if not secret or len(family) != 16 or not family.isalnum():
+            return None
+        return family
+
+    @staticmethod
+    def family_key(family):
+        # Хеш-тег {family} держит записи семейства в одном слоте кластера.
+        return f"{settings.OPAQUE_REFRESH_KEY_PREFIX}:{{{family}}}"
+
+    @classmethod
+    def token_key(cls, family, raw_token):
+        digest = hashlib.blake2b(raw_token.encode(), digest_size=16)
+        return f"{cls.family_key(family)}:{digest.hexdigest()}"
+
+    @classmethod
+    def keys(cls, raw_token):
+        family = cls.family_of(raw_token)
+        if family is None:
+            raise TokenError(_("Token is invalid or expired"))
+        return family, cls.token_key(family, raw_token)
+
+    @property
+    def access_token(self):
+        access = AccessToken()
+        access.set_exp(
+            from_time=access.current_time,
+            lifetime=timedelta(seconds=self.config["ACCESS_TOKEN_LIFETIME"]),
+        )
+        access[api_settings.USER_ID_CLAIM] = self.user_id
+        access[FAMILY_CLAIM] = self.family
+        access[revocation.VERSION_CLAIM] = self.version
+        access[tenants.TENANT_CLAIM] = self.tenant
+        return access
+
+    @staticmethod
+    def lifetime(values):
+        return int(
+            timedelta(days=values["REFRESH_TOKEN_LIFETIME"]).total_seconds()
+        )
+
+    @classmethod
+    def mint(cls, user, values, pipe):
+        family = secrets.token_hex(8)
+        value = f"{family}.{secrets.token_urlsafe(32)}"
+        now = int(time.time())
+        lifetime = cls.lifetime(values)
+        user_id = getattr(user, api_settings.USER_ID_FIELD)
+        version, tenant = user.token_version, user.tenant
+        pipe.set(
+            cls.token_key(family, value),
+            f"{user_id}:{family}:{now}:{now + lifetime}:0:{version}:{tenant}",
+            ex=lifetime,
+        )
+        pipe.set(cls.family_key(family), 0, ex=lifetime)
+        revocation.prime(user, pipe)
+        return cls(
+            value, user_id, family, now + lifetime, values, version, tenant
+        )
+
+    @classmethod
+    def for_user(cls, user):
+        pipe = get_redis().pipeline()
+        token = cls.mint(user, live_config.snapshot(), pipe)
+        pipe.execute()
+        return token
+
+    @classmethod
+    async def afor_user(cls, user):
+        pipe = get_async_redis().pipeline()
+        token = cls.mint(user, await live_config.asnapshot(), pipe)
+        await pipe.execute()
+        return token
+
+    @classmethod
+    def rotate_args(cls, raw_token, values):
+        family, key = cls.keys(raw_token)
+        value = f"{family}.{secrets.token_urlsafe(32)}"
+        rotate = api_settings.ROTATE_REFRESH_TOKENS
+        keys = [key, cls.family_key(family), cls.token_key(family, value)]
+        args = [int(time.time()), cls.lifetime(values), int(rotate)]
+        return family, (value if rotate else raw_token), keys, args
+
+    @classmethod
+    def from_result(cls, result, family, value, values):
+        if not result:
+            raise TokenError(_("Token is invalid or expired"))
+        if result[0] == -1:
+            raise TokenError(_("Token is blacklisted"))
+        user_id = result[1].decode()
+        if user_id.isdigit():
+            user_id = int(user_id)
+        tenant = result[4].decode() or settings.DEFAULT_TENANT
+        return cls(
+            value, user_id, family, result[2], values, result[3], tenant
+        )
+
+    @classmethod
+    def refreshed(cls, raw_token):
+        values = live_config.snapshot()
+        family, value, keys, args = cls.rotate_args(raw_token, values)
+        result = get_script(ROTATE_OPAQUE)(keys=keys, args=args)
+        token = cls.from_result(result, family, value, values)
+        version = revocation.current_version(token.user_id, token.tenant)
+        if token.version != version:
+            # Сессии отозваны после выпуска: семейство больше не нужно.
+            get_redis().delete(cls.family_key(family))
+            raise TokenError(_("Token has been revoked"))
+        return token
+
+    @classmethod
+    async def arefreshed(cls, raw_token):
+        values = await live_config.asnapshot()
+        family, value, keys, args = cls.rotate_args(raw_token, values)
+        script = get_async_redis().register_script(ROTATE_OPAQUE)
+        result = await script(keys=keys, args=args)
+        token = cls.from_result(result, family, value, values)
+        version = await revocation.acurrent_version(
+            token.user_id, token.tenant
+        )
+        if token.version != version:
+            await get_async_redis().delete(cls.family_key(family))
+            raise TokenError(_("Token has been revoked"))
+        return token
+
+    @classmethod
+    def revoke_keys(cls, raw_token):
+        family, key = cls.keys(raw_token)
+        return [key, cls.family_key(family)]
+
+    @staticmethod
+    def record_subject(record):
+        if not record:
+            raise TokenError(_("Token is invalid or expired"))
+        fields = record.decode().split(":")
+        user_id = int(fields[0]) if fields[0].isdigit() else fields[0]
+        tenant = fields[6] if len(fields) > 6 else ""
+        return user_id, tenant or settings.DEFAULT_TENANT
+
+    @classmethod
+    def revoke(cls, raw_token):
+        """Выход отзывает всё семейство токена."""
+        record = get_script(REVOKE_OPAQUE)(keys=cls.revoke_keys(raw_token))
+        return cls.record_subject(record)
+
+    @classmethod
+    async def arevoke(cls, raw_token):
+        script = get_async_redis().register_script(REVOKE_OPAQUE)
+        record = await script(keys=cls.revoke_keys(raw_token))
+        return cls.record_subject(record)
+
+
+def get_refresh_token_class(asynchronous=False):
+    """Класс refresh-токенов для REFRESH_TOKEN_FORMAT."""
+    if settings.REFRESH_TOKEN_FORMAT == "opaque":
+        return OpaqueRefreshToken
+    return AsyncRefreshToken if asynchronous else RefreshToken
+
+
+def token_subject(token):
+    """Пользователь и арендатор токена, для журнала аудита."""
+    if isinstance(token, OpaqueRefreshToken):
+        return token.user_id, token.tenant
+    return token.get(api_settings.USER_ID_CLAIM), tenants.token_tenant(token)
+
+
+def token_pair(token):
+    return {
+        "access_token": str(token.access_token),
+        "refresh_token": str(token),
+    }
+
+
+def _session(token):
+    return token_pair(token), token_subject(token)
+
+
+def _coalesce_key(raw_token):
+    return f"{settings.REFRESH_COALESCE_KEY_PREFIX}:{token_digest(raw_token)}"
+
+
+def refresh_pair(raw_token):
+    """
+    Ротация с объединением повторов: один и тот же токен, предъявленный
+    снова в течение REFRESH_COALESCE_WINDOW секунд (в том числе другим
+    воркером), получает ту же пару, что и первый запрос, а не ошибку
+    отозванного токена. Возвращает пару и token_subject.
+    """
+    token_class = get_refresh_token_class()
+    window = int(settings.REFRESH_COALESCE_WINDOW * 1000)
+    if not window:
+        return _session(token_class.refreshed(raw_token))
+    client = get_redis()
+    key = _coalesce_key(raw_token)
+    try:
+        claimed = client.set(key, REFRESH_PENDING, nx=True, px=window)
+    except RedisError:
+        return _session(token_class.refreshed(raw_token))
+    if not claimed:
+        return _wait_for_pair(client, key, token_class, raw_token)
+    try:
+        session = _session(token_class.refreshed(raw_token))
+    except BaseException:
+        try:
+            client.delete(key)
+        except RedisError:
+            _coalesce_failed()
+        raise
+    try:
+        client.set(key, dumps(session), px=window)
+    except RedisError:
+        _coalesce_failed()
+    return session
+
+
+def _coalesce_failed():
+    # Токен уже повёрнут, поэтому пара отдаётся клиенту в любом случае.
+    # Метка ожидания истечёт через REFRESH_COALESCE_WINDOW, до этого
+    # повторы той же пары не получат.
+    logger.warning("Refresh coalescing key not updated, Redis unavailable")
+
+
+def _wait_for_pair(client, key, token_class, raw_token):
+    deadline = time.monotonic() + settings.REFRESH_COALESCE_WAIT
+    while time.monotonic() < deadline:
+        value = client.get(key)
+        if value is None:
+            # Первый запрос не удался: проверяем токен сами.
+            return _session(token_class.refreshed(raw_token))
+        if value != REFRESH_PENDING:
+            pair, subject = loads(value)
+            return pair, tuple(subject)
+        time.sleep(settings.REFRESH_COALESCE_POLL)
+    raise TokenError(_("Token is invalid or expired"))
+
+
+async def arefresh_pair(raw_token):
+    token_class = get_refresh_token_class(asynchronous=True)
+    window = int(settings.REFRESH_COALESCE_WINDOW * 1000)
+    if not window:
+        return _session(await token_class.arefreshed(raw_token))
+    client = get_async_redis()
+    key = _coalesce_key(raw_token)
+    try:
+        claimed = await client.set(key, REFRESH_PENDING, nx=True, px=window)
+    except RedisError:
+        return _session(await token_class.arefreshed(raw_token))
+    if not claimed:
+        return await _await_pair(client, key, token_class, raw_token)
+    try:
+        session = _session(await token_class.arefreshed(raw_token))
+    except BaseException:
+        try:
+            await client.delete(key)
+        except RedisError:
+            _coalesce_failed()
+        raise
+    try:
+        await client.set(key, dumps(session), px=window)
+    except RedisError:
+        _coalesce_failed()
+    return session
+
+
+async def _await_pair(client, key, token_class, raw_token):
+    deadline = time.monotonic() + settings.REFRESH_COALESCE_WAIT
+    while time.monotonic() < deadline:
+        value = await client.get(key)
+        if value is None:
+            return _session(await token_class.arefreshed(raw_token))
+        if value != REFRESH_PENDING:
+            pair, subject = loads(value)
+            return pair, tuple(subject)
+        await asyncio.sleep(settings.REFRESH_COALESCE_POLL)
+    raise TokenError(_("Token is invalid or expired"))
@@ -1,12 +1,16 @@
 from django.urls import path
 
-from .views import (LoginView, LogoutView, RegisterAPIView, TokenRefreshView,
-                    UserDetailView)
+from .views import (BulkRegisterView, IntrospectionView, LoginView,
+                    LogoutAllView, LogoutView, RegisterAPIView,
+                    TokenRefreshView, UserDetailView)
 
 urlpatterns = [
     path("register/", RegisterAPIView.as_view(), name="register"),
+    path("register/bulk/", BulkRegisterView.as_view(), name="register_bulk"),
     path("login/", LoginView.as_view(), name="login"),
     path("refresh/", TokenRefreshView.as_view(), name="token_refresh"),
     path("logout/", LogoutView.as_view(), name="logout"),
+    path("logout/all/", LogoutAllView.as_view(), name="logout_all"),
+    path("introspect/", IntrospectionView.as_view(), name="introspect"),
     path("me/", UserDetailView.as_view(), name="user_detail"),
 ]
@@ -1,24 +1,56 @@
+import codecs
+import hmac
+import ipaddress
+import json
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.http import (HttpResponse, HttpResponseForbidden,
+                         HttpResponseNotModified, StreamingHttpResponse)
+from django.views.decorators.http import require_GET
 from rest_framework import generics, status
-from rest_framework.exceptions import ValidationError
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.exceptions import Throttled, ValidationError
+from rest_framework.parsers import FormParser, MultiPartParser
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.throttling import BaseThrottle
 from rest_framework.views import APIView
-from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework_simplejwt.exceptions import TokenError
-from rest_framework_simplejwt.tokens import RefreshToken
 
-from .serializers import (LoginSerializer, LogoutSerializer,
-                          RegisterSerializer, TokenRefreshSerializer,
-                          UserDetailSerializer)
+from . import audit, lockout, lookup, metrics, revocation
+from .authentication import CachedJWTAuthentication
+from .bulk import UserImporter, read_rows
+from .introspection import HasIntrospectionSecret, introspect
+from .keys import keyring
+from .renderers import (FastJSONParser, FastJSONRenderer,
+                        FirstRendererNegotiation)
+from .serializers import (IntrospectionSerializer, LoginSerializer,
+                          LogoutSerializer, RegisterSerializer,
+                          TokenRefreshSerializer, UserDetailSerializer,
+                          user_payload)
+from .throttling import (LoginThrottle, LogoutThrottle, RefreshThrottle,
+                         RegisterThrottle)
+from .tokens import get_refresh_token_class, refresh_pair
 
 User = get_user_model()
 
 
+class FastAPIView(APIView):
+    """
+    APIView для горячих эндпоинтов: только JSON-рендерер без разбора
+    Accept и orjson-парсер, формы по-прежнему принимаются.
+    """
+
+    renderer_classes = [FastJSONRenderer]
+    parser_classes = [FastJSONParser, FormParser, MultiPartParser]
+    content_negotiation_class = FirstRendererNegotiation
+
+
 class RegisterAPIView(generics.CreateAPIView):
     queryset = User.objects.all()
     serializer_class = RegisterSerializer
     permission_classes = [AllowAny]
+    throttle_classes = [RegisterThrottle]
 
     def create(self, request, *args, **kwargs):
         try:
@@ -27,68 +59,105 @@ class RegisterAPIView(generics.CreateAPIView):
             raise
 
 
-class LoginView(APIView):
+class BulkRegisterView(APIView):
+    """
+    Массовая регистрация из тела text/csv или application/x-ndjson.
+    Отчёт по строкам отдаётся потоком JSONL по мере обработки пачек.
+    """
+
+    permission_classes = [IsAdminUser]
+    content_types = {
+        "text/csv": "csv",
+        "application/x-ndjson": "jsonl",
+        "application/jsonl": "jsonl",
+    }
+
+    def post(self, request):
+        fmt = self.content_types.get(request.content_type.split(";")[0])
+        if fmt is None:
+            return Response(
+                {"error": "Send text/csv or application/x-ndjson."},
+                status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            )
+        lines = codecs.iterdecode(request.stream or (), "utf-8-sig")
+        report = UserImporter().run(read_rows(lines, fmt))
+        return StreamingHttpResponse(
+            (json.dumps(line) + "\n" for line in report),
+            content_type="application/x-ndjson",
+        )
+
+
+class LoginView(FastAPIView):
     permission_classes = [AllowAny]
+    throttle_classes = [LoginThrottle]
 
     def post(self, request):
         serializer = LoginSerializer(data=request.data)
         if serializer.is_valid():
-            user = User.objects.filter(
-                email=serializer.validated_data["email"]
-            ).first()
-            if user and user.check_password(
-                serializer.validated_data["password"]
-            ):
-                refresh = RefreshToken.for_user(user)
+            email = serializer.validated_data["email"]
+            wait = lockout.check(request, email)
+            if wait:
+                audit.record("login_locked", request)
+                raise Throttled(wait, "Too many failed login attempts.")
+            user = lookup.authenticate(
+                email, serializer.validated_data["password"]
+            )
+            if user:
+                lockout.succeeded(email)
+                refresh = get_refresh_token_class().for_user(user)
+                audit.record("login", request, user.pk, user.tenant)
                 return Response(
                     {
                         "access_token": str(refresh.access_token),
                         "refresh_token": str(refresh),
                     }
                 )
+            lockout.failed(request, email)
+            audit.record("login_failed", request)
         return Response(
             {"error": "Invalid credentials"},
             status=status.HTTP_401_UNAUTHORIZED,
         )
 
 
-class TokenRefreshView(APIView):
+class TokenRefreshView(FastAPIView):
     permission_classes = [AllowAny]
+    throttle_classes = [RefreshThrottle]
 
     def post(self, request):
         serializer = TokenRefreshSerializer(data=request.data)
         if serializer.is_valid():
             try:
-                refresh_token = serializer.validated_data["refresh_token"]
-                token = RefreshToken(refresh_token)
-                return Response(
-                    {
-                        "access_token": str(token.access_token),
-                        "refresh_token": str(token),
-                    }
+                pair, subject = refresh_pair(
+                    serializer.validated_data["refresh_token"]
                 )
             except TokenError:
+                audit.record("refresh_failed", request)
                 return Response(
                     {"error": "Invalid token or expired refresh token"},
                     status=status.HTTP_401_UNAUTHORIZED,
                 )
+            audit.record("refresh", request, *subject)
+            return Response(pair)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class LogoutView(APIView):
+class LogoutView(FastAPIView):
     permission_classes = [AllowAny]
+    throttle_classes = [LogoutThrottle]
 
     def post(self, request):
         serializer = LogoutSerializer(data=request.data)
         if serializer.is_valid():
             refresh_token = serializer.validated_data["refresh_token"]
             try:
-                token = RefreshToken(refresh_token)
-                token.blacklist()
+                subject = get_refresh_token_class().revoke(refresh_token)
+                audit.record("logout", request, *subject)
                 return Response(
                     {"success": "User logged out."}, status=status.HTTP_200_OK
                 )
             except Exception as e:
+                audit.record("logout_failed", request)
                 return Response(
                     {"error": str(e)}, status=status.HTTP_400_BAD_REQUEST
                 )
@@ -98,19 +167,127 @@ class LogoutView(APIView):
             )
 
 
-class UserDetailView(APIView):
+class LogoutAllView(FastAPIView):
     permission_classes = [IsAuthenticated]
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
+
+    def post(self, request):
+        revocation.revoke_all(request.user.pk, request.user.tenant)
+        audit.record(
+            "logout_all", request, request.user.pk, request.user.tenant
+        )
+        return Response({"success": "All sessions revoked."})
+
+
+class UserDetailView(FastAPIView):
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [CachedJWTAuthentication]
 
     def get(self, request):
-        serializer = UserDetailSerializer(request.user)
-        return Response(serializer.data)
+        return Response(user_payload(request.user))
 
     def put(self, request):
         serializer = UserDetailSerializer(
-            request.user, data=request.data, partial=True
+            User.objects.get(pk=request.user.pk),
+            data=request.data,
+            partial=True,
         )
         if serializer.is_valid():
             serializer.save()
+            audit.record(
+                "profile_update", request, request.user.pk, request.user.tenant
+            )
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class IntrospectionView(APIView):
+    authentication_classes = []
+    permission_classes = [HasIntrospectionSecret]
+
+    def post(self, request):
+        serializer = IntrospectionSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                serializer.errors, status=status.HTTP_400_BAD_REQUEST
+            )
+        data = serializer.validated_data
+        if "token" in data:
+            return Response(introspect([data["token"]])[0])
+        return Response({"results": introspect(data["tokens"])})
+
+
+EMPTY_JWKS = (b'{"keys":[]}', '"empty"')
+
+
+@require_GET
+def jwks(request):
+    body, etag = (
+        EMPTY_JWKS
+        if settings.JWT_SIGNING_ALGORITHM.startswith("HS")
+        else keyring.jwks_document()
+    )
+    if etag in request.headers.get("If-None-Match", ""):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, content_type="application/json")
+    response["ETag"] = etag
+    response["Cache-Control"] = f"public, max-age={settings.JWKS_MAX_AGE}"
+    return response
+
+
+@require_GET
+def openapi_schema(request, format):
+    """Заранее сериализованная схема с ETag и сжатыми вариантами."""
+    # drf_yasg импортируется только там, где документация подключена.
+    from .schema import get_documents
+
+    document = get_documents()[format]
+    encoding, body, etag = document.negotiate(
+        request.headers.get("Accept-Encoding", "")
+    )
+    if etag in request.headers.get("If-None-Match", ""):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, content_type=document.content_type)
+        if encoding:
+            response["Content-Encoding"] = encoding
+    response["ETag"] = etag
+    response["Vary"] = "Accept-Encoding"
+    response["Cache-Control"] = (
+        f"public, max-age={settings.OPENAPI_SCHEMA_MAX_AGE}"
+    )
+    return response
+
+
+def metrics_allowed(request):
+    """
+    /metrics отдаётся по секрету METRICS_SECRET (Authorization: Bearer) или
+    адресам из METRICS_ALLOWED_NETWORKS; если не задано ни то ни другое —
+    только в DEBUG.
+    """
+    secret = settings.METRICS_SECRET
+    networks = settings.METRICS_ALLOWED_NETWORKS
+    if not secret and not networks:
+        return settings.DEBUG
+    provided = request.headers.get("Authorization", "")
+    if secret and hmac.compare_digest(
+        provided.encode(), f"Bearer {secret}".encode()
+    ):
+        return True
+    try:
+        address = ipaddress.ip_address(BaseThrottle().get_ident(request))
+    except ValueError:
+        return False
+    return any(
+        address in ipaddress.ip_network(network, strict=False)
+        for network in networks
+    )
+
+
+@require_GET
+def metrics_view(request):
+    if not metrics_allowed(request):
+        return HttpResponseForbidden()
+    body, content_type = metrics.render()
+    return HttpResponse(body, content_type=content_type)
@@ -1,8 +1,9 @@
 import os
+import socket
 from datetime import timedelta
 from pathlib import Path
 
-from constance import config
+import dj_database_url
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -15,6 +16,9 @@ DEBUG = os.getenv("DEBUG", "False").lower() == "true"
 
 ALLOWED_HOSTS = os.getenv("ALLOWED_HOSTS", "").split(",")
 
+# Воркеры только для /api/: без админки, документации, сессий и статики.
+API_ONLY = os.getenv("API_ONLY", "False").lower() == "true"
+
 INSTALLED_APPS = [
     "corsheaders",
     "constance",
@@ -35,6 +39,8 @@ INSTALLED_APPS = [
 AUTH_USER_MODEL = "api.User"
 
 MIDDLEWARE = [
+    "api.metrics.MetricsMiddleware",
+    "api.tenants.TenantMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -46,6 +52,27 @@ MIDDLEWARE = [
     "whitenoise.middleware.WhiteNoiseMiddleware",
 ]
 
+if API_ONLY:
+    INSTALLED_APPS = [
+        app
+        for app in INSTALLED_APPS
+        if app
+        not in (
+            "django.contrib.admin",
+            "django.contrib.sessions",
+            "django.contrib.messages",
+            "drf_yasg",
+            "django_extensions",
+        )
+    ]
+    MIDDLEWARE = [
+        "api.metrics.MetricsMiddleware",
+        "api.tenants.TenantMiddleware",
+        "corsheaders.middleware.CorsMiddleware",
+        "django.middleware.security.SecurityMiddleware",
+        "django.middleware.common.CommonMiddleware",
+    ]
+
 ROOT_URLCONF = "authentication_api.urls"
 
 TEMPLATES = [
@@ -66,13 +93,58 @@ TEMPLATES = [
 
 WSGI_APPLICATION = "authentication_api.wsgi.application"
 
+ASGI_APPLICATION = "authentication_api.asgi.application"
+
+API_ASYNC_VIEWS = os.getenv("API_ASYNC_VIEWS", "False").lower() == "true"
+
+DATABASE_CONN_MAX_AGE = int(os.getenv("DATABASE_CONN_MAX_AGE", 600))
+
 DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
-    }
+    "default": dj_database_url.config(
+        default=f"sqlite:///{BASE_DIR / 'db.sqlite3'}",
+        conn_max_age=DATABASE_CONN_MAX_AGE,
+        conn_health_checks=True,
+    )
 }
 
+# Одноразовая база сервера, запущенного командой benchmark.
+if os.getenv("BENCHMARK_DATABASE_NAME"):
+    DATABASES["default"]["NAME"] = os.environ["BENCHMARK_DATABASE_NAME"]
+
+for index, url in enumerate(
+    filter(None, os.getenv("DATABASE_REPLICA_URLS", "").split(","))
+):
+    DATABASES[f"replica_{index}"] = {
+        **dj_database_url.parse(
+            url,
+            conn_max_age=DATABASE_CONN_MAX_AGE,
+            conn_health_checks=True,
+        ),
+        "TEST": {"MIRROR": "default"},
+    }
+
+DEFAULT_TENANT = "default"
+
+TENANT_HEADER = "X-Tenant"
+
+# "acme=postgres://...,globex=postgres://...": арендаторы в своих базах.
+TENANT_DATABASES = {}
+for entry in filter(None, os.getenv("TENANT_DATABASE_URLS", "").split(",")):
+    tenant, _, url = entry.partition("=")
+    TENANT_DATABASES[tenant] = f"tenant_{tenant}"
+    DATABASES[f"tenant_{tenant}"] = dj_database_url.parse(
+        url,
+        conn_max_age=DATABASE_CONN_MAX_AGE,
+        conn_health_checks=True,
+    )
+
+DATABASE_ROUTERS = [
+    "api.routers.TenantRouter",
+    "api.routers.PrimaryReplicaRouter",
+]
+
+DATABASE_REPLICA_LAG = int(os.getenv("DATABASE_REPLICA_LAG", 5))
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         "NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator",
@@ -88,6 +160,37 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+PASSWORD_HASHER_PROFILES = {
+    "pbkdf2": "api.hashers.PBKDF2PasswordHasher",
+    "argon2": "api.hashers.Argon2PasswordHasher",
+}
+
+PASSWORD_HASHER_PROFILE = os.getenv("PASSWORD_HASHER_PROFILE", "pbkdf2")
+
+PASSWORD_HASHERS = [
+    PASSWORD_HASHER_PROFILES[PASSWORD_HASHER_PROFILE],
+    *(
+        hasher
+        for name, hasher in PASSWORD_HASHER_PROFILES.items()
+        if name != PASSWORD_HASHER_PROFILE
+    ),
+    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+    "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",
+    "django.contrib.auth.hashers.ScryptPasswordHasher",
+]
+
+PASSWORD_PBKDF2_ITERATIONS = int(
+    os.getenv("PASSWORD_PBKDF2_ITERATIONS", 600_000)
+)
+
+PASSWORD_ARGON2_TIME_COST = int(os.getenv("PASSWORD_ARGON2_TIME_COST", 2))
+
+PASSWORD_ARGON2_MEMORY_COST = int(
+    os.getenv("PASSWORD_ARGON2_MEMORY_COST", 102_400)
+)
+
+PASSWORD_ARGON2_PARALLELISM = int(os.getenv("PASSWORD_ARGON2_PARALLELISM", 8))
+
 LANGUAGE_CODE = "en-us"
 
 TIME_ZONE = "UTC"
@@ -108,17 +211,23 @@ REFRESH_TOKEN_LIFETIME = timedelta(days=30)
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "api.authentication.CachedJWTAuthentication",
     ),
     "DEFAULT_PERMISSION_CLASSES": (
         "rest_framework.permissions.IsAuthenticated",
     ),
+    # Число доверенных прокси перед приложением: клиентом считается адрес,
+    # который добавил последний из них в X-Forwarded-For. 0 — REMOTE_ADDR.
+    "NUM_PROXIES": int(os.getenv("NUM_PROXIES", 0)),
 }
 
 AUTHENTICATION_BACKENDS = [
-    "django.contrib.auth.backends.ModelBackend",
+    "api.backends.TenantBackend",
 ]
 
+# Email уникален в паре с арендатором, вход ищет его в арендаторе запроса.
+SILENCED_SYSTEM_CHECKS = ["auth.W004"]
+
 CONSTANCE_BACKEND = "constance.backends.redisd.RedisBackend"
 
 CONSTANCE_REDIS_CONNECTION = {
@@ -127,17 +236,211 @@ CONSTANCE_REDIS_CONNECTION = {
     "db": 0,
 }
 
+# Отдельная база Redis сервера, запущенного командой benchmark.
+BENCHMARK_REDIS_DB = int(os.getenv("BENCHMARK_REDIS_DB", 15))
+
+if os.getenv("BENCHMARK_DATABASE_NAME"):
+    CONSTANCE_REDIS_CONNECTION["db"] = BENCHMARK_REDIS_DB
+
+# Каналы pub/sub общие для всех баз Redis, префикс отделяет их.
+BROADCAST_CHANNEL_PREFIX = os.getenv("BROADCAST_CHANNEL_PREFIX", "")
+
 CONSTANCE_CONFIG = {
     "ACCESS_TOKEN_LIFETIME": (30, "Access Token lifetime in seconds"),
     "REFRESH_TOKEN_LIFETIME": (30, "Refresh Token lifetime in days"),
+    "THROTTLE_LOGIN_IP": ("60/min", "Login attempts per client IP"),
+    "THROTTLE_LOGIN_EMAIL": ("10/min", "Login attempts per email"),
+    "THROTTLE_REGISTER_IP": ("20/hour", "Registrations per client IP"),
+    "THROTTLE_REFRESH_IP": ("120/min", "Token refreshes per client IP"),
+    "THROTTLE_REFRESH_FAMILY": (
+        "30/min",
+        "Token refreshes per refresh token family",
+    ),
+    "THROTTLE_LOGOUT_IP": ("60/min", "Logouts per client IP"),
+    "LOCKOUT_ACCOUNT_THRESHOLD": (
+        5,
+        "Failed logins per account before it is locked, 0 disables",
+    ),
+    "LOCKOUT_SOURCE_THRESHOLD": (
+        50,
+        "Failed logins per client IP before it is locked, 0 disables",
+    ),
+    "LOCKOUT_BASE_SECONDS": (
+        30,
+        "First lockout in seconds, doubled on every further failure",
+    ),
+    "LOCKOUT_MAX_SECONDS": (3600, "Longest lockout in seconds"),
+    "LOCKOUT_RESET_SECONDS": (
+        900,
+        "Seconds without failures after which the count starts over",
+    ),
 }
 
 SIMPLE_JWT = {
-    "ACCESS_TOKEN_LIFETIME": timedelta(seconds=config.ACCESS_TOKEN_LIFETIME),
-    "REFRESH_TOKEN_LIFETIME": timedelta(days=config.REFRESH_TOKEN_LIFETIME),
+    "ACCESS_TOKEN_LIFETIME": timedelta(
+        seconds=CONSTANCE_CONFIG["ACCESS_TOKEN_LIFETIME"][0]
+    ),
+    "REFRESH_TOKEN_LIFETIME": timedelta(
+        days=CONSTANCE_CONFIG["REFRESH_TOKEN_LIFETIME"][0]
+    ),
     "BLACKLIST_AFTER_ROTATION": True,
     "ROTATE_REFRESH_TOKENS": True,
     "UPDATE_LAST_LOGIN": True,
+    "AUTH_TOKEN_CLASSES": ("api.tokens.AccessToken",),
 }
 
+REFRESH_TOKEN_FORMAT = os.getenv("REFRESH_TOKEN_FORMAT", "jwt")
+
+OPAQUE_REFRESH_KEY_PREFIX = "refresh"
+
+JWT_SIGNING_ALGORITHM = os.getenv("JWT_SIGNING_ALGORITHM", "HS256")
+
+JWT_KEY_ROTATION_INTERVAL = timedelta(days=30)
+
+JWT_KEY_PUBLISH_AHEAD = timedelta(hours=1)
+
+JWT_KEYRING_TTL = 60
+
+JWKS_MAX_AGE = 3600
+
+INTROSPECTION_SECRET = os.getenv("INTROSPECTION_SECRET")
+
+# Доступ к /metrics: секрет скрейпера и/или его сети через запятую.
+METRICS_SECRET = os.getenv("METRICS_SECRET")
+
+METRICS_ALLOWED_NETWORKS = [
+    network.strip()
+    for network in os.getenv("METRICS_ALLOWED_NETWORKS", "").split(",")
+    if network.strip()
+]
+
+INTROSPECTION_BATCH_SIZE = 100
+
+TOKEN_BLACKLIST_BACKEND = os.getenv(
+    "TOKEN_BLACKLIST_BACKEND", "api.blacklist.RedisBlacklist"
+)
+
+# Отзывов на окно: каждая ротация refresh-токена отзывает предыдущий,
+# поэтому значение — примерно число обновлений и выходов за сутки.
+TOKEN_BLACKLIST_BLOOM_CAPACITY = int(
+    os.getenv("TOKEN_BLACKLIST_BLOOM_CAPACITY", 200_000)
+)
+
+TOKEN_BLACKLIST_BLOOM_ERROR_RATE = 0.01
+
+TOKEN_BLACKLIST_BLOOM_WINDOW = timedelta(days=1)
+
+TOKEN_BLACKLIST_BLOOM_REFRESH = 1
+
+TOKEN_BLACKLIST_LOG_TTL = 3600
+
+TOKEN_VERSION_CACHE_SIZE = 100_000
+
+TOKEN_VERSION_CACHE_TTL = 5
+
+TOKEN_VERSION_REDIS_TTL = 86400
+
+REFRESH_VERIFY_CACHE_SIZE = 10_000
+
+REFRESH_VERIFY_CACHE_TTL = 30
+
+REFRESH_COALESCE_KEY_PREFIX = "refresh-result"
+
+REFRESH_COALESCE_WINDOW = float(os.getenv("REFRESH_COALESCE_WINDOW", 10))
+
+REFRESH_COALESCE_WAIT = 2
+
+REFRESH_COALESCE_POLL = 0.02
+
+TOKEN_PURGE_BATCH_SIZE = 1000
+
+TOKEN_PURGE_PAUSE = 0.1
+
+TOKEN_PURGE_INTERVAL = 3600
+
+ACCESS_TOKEN_CACHE_SIZE = 10_000
+
+ACCESS_TOKEN_CACHE_TTL = 60
+
+# Процессов хеширования на весь хост; пул каждого воркера gunicorn получает
+# свою долю (WEB_CONCURRENCY — число воркеров, gunicorn читает его же).
+PASSWORD_HASHING_HOST_WORKERS = int(
+    os.getenv("PASSWORD_HASHING_HOST_WORKERS", os.cpu_count() or 1)
+)
+
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", 1)))
+
+PASSWORD_HASHING_WORKERS = int(
+    os.getenv(
+        "PASSWORD_HASHING_WORKERS",
+        max(1, PASSWORD_HASHING_HOST_WORKERS // WEB_CONCURRENCY),
+    )
+)
+
+# Очередь общая для всех воркеров хоста и считается в Redis.
+PASSWORD_HASHING_MAX_QUEUE = int(os.getenv("PASSWORD_HASHING_MAX_QUEUE", 32))
+
+PASSWORD_HASHING_HOST = os.getenv(
+    "PASSWORD_HASHING_HOST", socket.gethostname()
+)
+
+# Место упавшего воркера освобождается через столько секунд.
+PASSWORD_HASHING_SLOT_TTL = 60
+
+PASSWORD_HASHING_RETRY_AFTER = 1
+
+BULK_IMPORT_CHUNK_SIZE = 1000
+
+# Процессов пула, одновременно занятых хешированием при импорте.
+BULK_IMPORT_HASHING_SHARE = max(1, PASSWORD_HASHING_WORKERS // 2)
+
+LOGIN_NEGATIVE_CACHE_SIZE = 100_000
+
+LOGIN_NEGATIVE_CACHE_LOCAL_TTL = 60
+
+LOGIN_NEGATIVE_CACHE_TTL = 600
+
+# Выключается только у локального сервера нагрузочного прогона.
+THROTTLE_ENABLED = os.getenv("THROTTLE_ENABLED", "True").lower() == "true"
+
+THROTTLE_KEY_PREFIX = "throttle"
+
+THROTTLE_LOCAL_BUCKETS = 100_000
+
+LOCKOUT_KEY_PREFIX = "lockout"
+
+LOCKOUT_LOCAL_SIZE = 100_000
+
+LIVE_CONFIG_TTL = 5
+
+LIVE_CONFIG_TIMEOUT = 0.05
+
+# api.audit.RedisStreamSink, JSONLinesSink или DatabaseSink; пусто — выкл.
+AUDIT_SINK = os.getenv("AUDIT_SINK", "api.audit.RedisStreamSink")
+
+AUDIT_BUFFER_SIZE = 10_000
+
+AUDIT_BATCH_SIZE = 500
+
+AUDIT_FLUSH_INTERVAL = 1
+
+AUDIT_STREAM = "audit:events"
+
+AUDIT_STREAM_MAXLEN = 1_000_000
+
+AUDIT_LOG_PATH = os.getenv("AUDIT_LOG_PATH", BASE_DIR / "audit.jsonl")
+
+# prefix, trigram (PostgreSQL) или contains — прежний поиск Django.
+ADMIN_USER_SEARCH = os.getenv("ADMIN_USER_SEARCH", "prefix")
+
+ADMIN_EXACT_COUNT_LIMIT = 10_000
+
+OPENAPI_SCHEMA_DIR = os.getenv("OPENAPI_SCHEMA_DIR")
+
+OPENAPI_SCHEMA_MAX_AGE = 300
+
+SWAGGER_SETTINGS = {"SPEC_URL": ("schema-json", {"format": ".json"})}
+
+REDOC_SETTINGS = {"SPEC_URL": ("schema-json", {"format": ".json"})}
+
 STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
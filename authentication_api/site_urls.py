@@ -0,0 +1,34 @@
+from django.contrib import admin
+from django.urls import path, re_path
+from drf_yasg.views import get_schema_view
+from rest_framework import permissions
+
+from api.schema import INFO
+from api.views import openapi_schema
+
+# Страницы UI загружают схему с schema-json (SWAGGER_SETTINGS["SPEC_URL"]),
+# поэтому сами её не строят.
+schema_view = get_schema_view(
+    INFO,
+    public=True,
+    permission_classes=(permissions.AllowAny,),
+)
+
+urlpatterns = [
+    path("admin/", admin.site.urls),
+    path(
+        "api/swagger/",
+        schema_view.with_ui("swagger", cache_timeout=0),
+        name="schema-swagger-ui",
+    ),
+    path(
+        "api/redoc/",
+        schema_view.with_ui("redoc", cache_timeout=0),
+        name="schema-redoc",
+    ),
+    re_path(
+        r"^swagger(?P<format>\.json|\.yaml)$",
+        openapi_schema,
+        name="schema-json",
+    ),
+]
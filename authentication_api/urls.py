@@ -1,36 +1,17 @@
-from django.contrib import admin
-from django.urls import include, path, re_path
-from drf_yasg import openapi
-from drf_yasg.views import get_schema_view
-from rest_framework import permissions
+from django.conf import settings
+from django.urls import include, path
 
-schema_view = get_schema_view(
-    openapi.Info(
-        title="Authentication API",
-        default_version="v1",
-        description="API documentation",
-        contact=openapi.Contact(email="karpova.el.m@gmail.com"),
-    ),
-    public=True,
-    permission_classes=(permissions.AllowAny,),
-)
+from api.views import jwks, metrics_view
 
 urlpatterns = [
-    path("admin/", admin.site.urls),
-    path("api/", include("api.urls")),
-    path(
-        "api/swagger/",
-        schema_view.with_ui("swagger", cache_timeout=0),
-        name="schema-swagger-ui",
-    ),
+    path(".well-known/jwks.json", jwks, name="jwks"),
+    path("metrics", metrics_view, name="metrics"),
     path(
-        "api/redoc/",
-        schema_view.with_ui("redoc", cache_timeout=0),
-        name="schema-redoc",
-    ),
-    re_path(
-        r"^swagger(?P<format>\.json|\.yaml)$",
-        schema_view.without_ui(cache_timeout=0),
-        name="schema-json",
+        "api/",
+        include("api.async_urls" if settings.API_ASYNC_VIEWS else "api.urls"),
     ),
 ]
+
+# Админка и документация вместе с drf_yasg не загружаются в API_ONLY.
+if not settings.API_ONLY:
+    urlpatterns.append(path("", include("authentication_api.site_urls")))
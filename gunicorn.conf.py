@@ -0,0 +1,20 @@
+import os
+
+from prometheus_client import multiprocess
+
+
+def child_exit(server, worker):
+    # Метрики завершившегося воркера остаются в файлах и должны
+    # перестать учитываться в gauge, собираемых MultiProcessCollector.
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(worker.pid)
+
+
+def post_worker_init(worker):
+    # Схема OpenAPI готовится до первого запроса к /swagger.json.
+    from django.conf import settings
+
+    if not settings.API_ONLY:
+        from api.schema import get_documents
+
+        get_documents()